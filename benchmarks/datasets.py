@@ -0,0 +1,51 @@
+# Description: Synthetic datasets for the VerusDB benchmarks
+from __future__ import annotations
+import zlib
+import numpy as np
+from verusdb.embeddings import BaseEmbeddingsEngine
+
+
+def clustered_embeddings(n: int, dim: int, clusters: int = 32, spread: float = 0.35, seed: int = 0) -> np.ndarray:
+    """
+    Generate ``n`` unit vectors grouped around ``clusters`` random centroids.
+
+    Real embeddings are far from uniform, a clustered dataset makes the recall
+    numbers of approximate indexes (HNSW, coarse passes) meaningful.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((clusters, dim)).astype(np.float32)
+    centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+
+    assignments = rng.integers(0, clusters, size=n)
+    vectors = centroids[assignments] + spread * rng.standard_normal((n, dim)).astype(np.float32) / np.sqrt(dim)
+
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def ground_truth(corpus: np.ndarray, queries: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    Exact top k neighbours by cosine similarity, the vectors must be normalized
+    """
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, min(top_k, corpus.shape[0] - 1), axis=1)[:, :top_k]
+    order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+class SyntheticEmbeddingsEngine(BaseEmbeddingsEngine):
+    """
+    Random unit vectors seeded by the text, so the same text gets the same vector in every run
+
+    The seed is the crc32 of the text, ``hash()`` is salted per process.
+    """
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+
+    def encode(self, text: str) -> list[float]:
+        rng = np.random.default_rng(zlib.crc32(text.encode('utf-8')))
+        vector = rng.standard_normal(self.dimensions)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def get_dimensions(self) -> int:
+        return self.dimensions
@@ -0,0 +1,53 @@
+# Description: Encode throughput of a local embeddings engine in a process pool
+#
+# python -m benchmarks.encode
+# python -m benchmarks.encode --texts 20000 --workers 1 2 4 8 --batch-size 128
+from __future__ import annotations
+import argparse
+import os
+import time
+from functools import partial
+from verusdb.embeddings.hashing import HashingEmbeddingsEngine
+from verusdb.embeddings.process import ProcessPoolEmbeddingsEngine
+
+
+def synthetic_texts(n: int, words: int, vocabulary: int = 5000) -> list[str]:
+    return [' '.join(f'word{(index * 7919 + position) % vocabulary}' for position in range(words)) for index in range(n)]
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Measure the encode throughput of the process pool adapter')
+    parser.add_argument('--texts', type=int, default=5000, help='number of texts to encode')
+    parser.add_argument('--words', type=int, default=200, help='words per text')
+    parser.add_argument('--dim', type=int, default=384, help='embedding dimensions')
+    parser.add_argument('--batch-size', type=int, default=64, help='texts per task sent to a worker')
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, os.cpu_count() or 1}))
+    args = parser.parse_args(argv)
+
+    texts = synthetic_texts(args.texts, args.words)
+
+    # the calling thread alone, the baseline every pool is compared to
+    engine = HashingEmbeddingsEngine(args.dim)
+    start = time.perf_counter()
+    engine.encode_array(texts)
+    baseline = args.texts / (time.perf_counter() - start)
+    print(f'in process      {baseline:10.0f} texts/s')
+
+    for workers in args.workers:
+        pool = ProcessPoolEmbeddingsEngine(partial(HashingEmbeddingsEngine, args.dim), workers=workers, batch_size=args.batch_size)
+
+        try:
+            # starts the workers so their start up is not measured
+            pool.encode_array(texts[:workers * args.batch_size])
+
+            start = time.perf_counter()
+            pool.encode_array(texts)
+            throughput = args.texts / (time.perf_counter() - start)
+        finally:
+            pool.close()
+
+        print(f'{workers:3d} workers     {throughput:10.0f} texts/s  x{throughput / baseline:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# Description: Import time regression benchmark for VerusDB
+#
+# python -m benchmarks.imports
+# python -m benchmarks.imports --statement "from verusdb.engines.polars import PolarsEngine" --budget-ms 800
+from __future__ import annotations
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# packages that must not be imported by `import verusdb` alone
+HEAVY_MODULES = ('numpy', 'polars', 'pyarrow', 'redis', 'psycopg2', 'openai')
+
+
+def _import_times(statement: str) -> tuple[dict[str, float], list[str]]:
+    """
+    Cumulative import time in ms of every top level import of ``statement`` in a fresh interpreter
+    """
+    code = f'{statement}\nimport sys, json\nprint(json.dumps(sorted(sys.modules)))'
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, check=True
+    )
+
+    modules = {}
+
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # top level imports are not indented
+        if not name.startswith('  ', 1):
+            modules[name.strip()] = int(cumulative) / 1000
+
+    return modules, json.loads(process.stdout.splitlines()[-1])
+
+
+def measure(statement: str) -> dict:
+    """
+    Import ``statement`` in a fresh interpreter, without the modules imported by the interpreter itself
+    """
+    startup, _ = _import_times('pass')
+    modules, loaded = _import_times(statement)
+    modules = {name: elapsed for name, elapsed in modules.items() if name not in startup}
+
+    return {
+        'total_ms': sum(modules.values()),
+        'modules': dict(sorted(modules.items(), key=lambda item: -item[1])[:10]),
+        'heavy': [module for module in HEAVY_MODULES if module in loaded],
+    }
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Measure the import time of VerusDB')
+    parser.add_argument('--statement', default='import verusdb', help='python statement to time')
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters to average over')
+    parser.add_argument('--budget-ms', type=float, default=None, help='fail when the median import time is above this')
+    args = parser.parse_args(argv)
+
+    runs = [measure(args.statement) for _ in range(args.repeat)]
+    median = statistics.median(run['total_ms'] for run in runs)
+
+    print(f'{args.statement}: median {median:.1f} ms over {args.repeat} runs')
+    for module, elapsed in runs[-1]['modules'].items():
+        print(f'  {elapsed:8.1f} ms  {module}')
+
+    if runs[-1]['heavy']:
+        print('heavy modules imported: ' + ', '.join(runs[-1]['heavy']))
+
+    if args.budget_ms is not None and median > args.budget_ms:
+        print(f'import time {median:.1f} ms is above the budget of {args.budget_ms:.1f} ms')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+# Description: Cross-engine benchmark harness for VerusDB
+#
+# python -m benchmarks.run --engine polars --n 20000 --dim 256
+# python -m benchmarks.run --engine all --concurrency 8 --output results
+from __future__ import annotations
+import argparse
+import csv
+import json
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from verusdb.settings import Settings
+from verusdb.client import VerusClient
+from benchmarks.datasets import clustered_embeddings, ground_truth, SyntheticEmbeddingsEngine
+
+COLLECTION = 'bench'
+
+
+def percentiles(latencies: list[float]) -> dict[str, float]:
+    """
+    p50/p95/p99 in milliseconds
+    """
+    values = np.array(latencies) * 1000
+    return {
+        'p50_ms': float(np.percentile(values, 50)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'mean_ms': float(values.mean()),
+    }
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if platform.system() == 'Darwin' else rss / 1024
+
+
+def build_settings(engine: str, args, folder: str | None, options: str | None = None) -> Settings:
+    kwargs = json.loads(options) if options else {}
+    embeddings = SyntheticEmbeddingsEngine(args.dim)
+
+    if engine == 'polars':
+        return Settings(folder=folder, engine='polars', embeddings=embeddings, **kwargs)
+
+    if engine == 'redis':
+        return Settings(
+            engine='redis',
+            redis={
+                'host': args.redis_host,
+                'port': args.redis_port,
+                'db': 0,
+                'prefix': 'bench:',
+                'index': 'verusdb_bench',
+            },
+            embeddings=embeddings,
+            **kwargs
+        )
+
+    if engine == 'postgres':
+        return Settings(
+            engine='postgres',
+            postgres={
+                'host': args.pg_host,
+                'port': args.pg_port,
+                'db': args.pg_db,
+                'username': args.pg_user,
+                'password': args.pg_password,
+                'table': 'verusdb_bench',
+            },
+            embeddings=embeddings,
+            **kwargs
+        )
+
+    raise ValueError(f'Unknown engine {engine}')
+
+
+def reset(client: VerusClient, engine: str, recreate: bool = True):
+    """
+    Remove the documents of the benchmark without touching the rest of the database
+
+    clear() would flush the whole redis db or empty the configured table, the polars
+    store lives in its own temporary folder.
+    """
+    if engine == 'redis':
+        from redis.exceptions import ResponseError
+
+        redis_engine = client.get_engine()
+        for shard in redis_engine.shards:  # type: ignore
+            try:
+                # also deletes the hashes of the index, the keys under the bench: prefix
+                shard.ft(redis_engine.redis_index).dropindex(delete_documents=True)  # type: ignore
+            except ResponseError:
+                # no index left by an earlier run
+                pass
+
+        if recreate:
+            redis_engine.load()
+
+    elif engine == 'postgres':
+        client.delete(collection=COLLECTION)
+
+
+def recall_at_k(results: list[dict], expected: np.ndarray) -> float:
+    found = {int(doc['text']) for doc in results}
+    return len(found.intersection(expected.tolist())) / len(expected)
+
+
+def run_engine(engine: str, args, corpus: np.ndarray, queries: np.ndarray, truth: np.ndarray, options: str | None = None) -> dict:
+    folder = tempfile.mkdtemp(prefix='verusdb-bench-') if engine == 'polars' else None
+
+    try:
+        settings = build_settings(engine, args, folder, options)
+        client = VerusClient(settings)
+        reset(client, engine)
+
+        result: dict = {
+            'engine': engine,
+            'n': args.n,
+            'dim': args.dim,
+            'top_k': args.top_k,
+            'queries': len(queries),
+            'concurrency': args.concurrency,
+            'settings': options or '',
+        }
+
+        # ingest
+        rss_before = max_rss_mb()
+        start = time.perf_counter()
+        for offset in range(0, len(corpus), args.batch_size):
+            batch = corpus[offset:offset + args.batch_size]
+            client.add(
+                collection=COLLECTION,
+                texts=[str(i) for i in range(offset, offset + len(batch))],
+                embeddings=batch.tolist(),
+            )
+        elapsed = time.perf_counter() - start
+        result['ingest_seconds'] = elapsed
+        result['ingest_docs_per_second'] = len(corpus) / elapsed
+        result['max_rss_mb'] = max_rss_mb()
+        result['rss_growth_mb'] = result['max_rss_mb'] - rss_before
+
+        if engine == 'polars':
+            result['store_mb'] = client.get_engine().store.estimated_size('mb')  # type: ignore
+
+        # warm up caches and connections before timing
+        for query in queries[:min(5, len(queries))]:
+            client.search(embedding=query.tolist(), collection=COLLECTION, top_k=args.top_k)
+
+        # sequential latency and recall
+        latencies = []
+        recalls = []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            response = client.search(embedding=query.tolist(), collection=COLLECTION, top_k=args.top_k)
+            latencies.append(time.perf_counter() - start)
+            recalls.append(recall_at_k(response, expected))  # type: ignore
+
+        result.update(percentiles(latencies))
+        result[f'recall_at_{args.top_k}'] = float(np.mean(recalls))
+
+        # throughput under concurrent clients sharing one VerusClient
+        vectors = [query.tolist() for query in queries]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(lambda vector: client.search(embedding=vector, collection=COLLECTION, top_k=args.top_k), vectors))
+        result['qps'] = len(vectors) / (time.perf_counter() - start)
+
+        # persistence, only the polars engine writes to disk
+        if engine == 'polars':
+            start = time.perf_counter()
+            client.save()
+            result['save_seconds'] = time.perf_counter() - start
+            result['file_mb'] = os.path.getsize(settings.get_file()) / (1024 * 1024)
+
+            start = time.perf_counter()
+            VerusClient(settings)
+            result['load_seconds'] = time.perf_counter() - start
+
+        reset(client, engine, recreate=False)
+        return result
+
+    finally:
+        if folder is not None:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+def write_results(results: list[dict], output: str):
+    os.makedirs(output, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+
+    with open(os.path.join(output, f'benchmark-{stamp}.json'), 'w') as file:
+        json.dump(results, file, indent=2)
+
+    columns = sorted({key for result in results for key in result})
+    with open(os.path.join(output, f'benchmark-{stamp}.csv'), 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Benchmark the VerusDB engines')
+    parser.add_argument('--engine', default='polars', choices=['polars', 'redis', 'postgres', 'all'])
+    parser.add_argument('--n', type=int, default=10000, help='number of documents')
+    parser.add_argument('--dim', type=int, default=256, help='embedding dimensions')
+    parser.add_argument('--clusters', type=int, default=32)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--settings', action='append', default=None,
+        help='extra Settings keyword arguments as JSON, repeat it to compare several configurations'
+    )
+    parser.add_argument('--output', default='benchmark-results')
+    parser.add_argument('--redis-host', default='localhost')
+    parser.add_argument('--redis-port', type=int, default=6379)
+    parser.add_argument('--pg-host', default='localhost')
+    parser.add_argument('--pg-port', type=int, default=5432)
+    parser.add_argument('--pg-db', default='verus')
+    parser.add_argument('--pg-user', default='verus')
+    parser.add_argument('--pg-password', default='verus')
+    args = parser.parse_args(argv)
+
+    # queries are drawn from the same clusters as the corpus but are not part of it
+    vectors = clustered_embeddings(args.n + args.queries, args.dim, args.clusters, seed=args.seed)
+    corpus, queries = vectors[:args.n], vectors[args.n:]
+    truth = ground_truth(corpus, queries, args.top_k)
+
+    engines = ['polars', 'redis', 'postgres'] if args.engine == 'all' else [args.engine]
+    results = []
+
+    for engine in engines:
+        for options in args.settings or [None]:
+            try:
+                result = run_engine(engine, args, corpus, queries, truth, options)
+            except Exception as error:
+                # redis-stack and pgvector are optional, skip them when no server is reachable
+                if args.engine != 'all' or engine == 'polars':
+                    raise
+                print(f'skipping {engine}: {error}')
+                break
+
+            print(json.dumps(result, indent=2))
+            results.append(result)
+
+    if len(results) > 1:
+        # latency against recall of every configuration, best recall first
+        print(f"{'engine':<10} {'p50 ms':>8} {'p95 ms':>8} {'recall':>8}  settings")
+        for result in sorted(results, key=lambda item: -item[f'recall_at_{args.top_k}']):
+            print(
+                f"{result['engine']:<10} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+                f"{result[f'recall_at_{args.top_k}']:>8.3f}  {result['settings']}"
+            )
+
+    write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
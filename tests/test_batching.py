@@ -0,0 +1,113 @@
+from __future__ import annotations
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from verusdb.embeddings import BaseEmbeddingsEngine
+from verusdb.embeddings.batching import BatchingEmbeddingsEngine
+from verusdb.settings import Settings
+from verusdb.client import VerusClient
+
+
+class CountingEmbeddingsEngine(BaseEmbeddingsEngine):
+
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def encode(self, text: str) -> list[float]:
+        return self.encode_batch([text])[0]
+
+    def encode_batch(self, texts: list[str]) -> list[list[float]]:
+        with self.lock:
+            self.batches.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def get_dimensions(self) -> int:
+        return 2
+
+
+class TestBatching(unittest.TestCase):
+
+    def test_concurrent_encodes_are_coalesced(self):
+        engine = CountingEmbeddingsEngine()
+        batcher = BatchingEmbeddingsEngine(engine, max_batch_size=8, max_wait_ms=200)
+        texts = ['a' * size for size in range(1, 9)]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            vectors = list(executor.map(batcher.encode, texts))
+
+        # every caller gets the vector of its own text back
+        self.assertEqual([vector[0] for vector in vectors], [float(len(text)) for text in texts])
+        self.assertLess(len(engine.batches), len(texts))
+        self.assertTrue(all(len(batch) <= 8 for batch in engine.batches))
+
+    def test_errors_reach_every_caller(self):
+
+        class FailingEmbeddingsEngine(CountingEmbeddingsEngine):
+            def encode_batch(self, texts: list[str]) -> list[list[float]]:
+                raise RuntimeError('rate limited')
+
+        batcher = BatchingEmbeddingsEngine(FailingEmbeddingsEngine(), max_wait_ms=1)
+
+        with self.assertRaises(RuntimeError):
+            batcher.encode('test')
+
+    def test_missing_vectors_reach_every_caller(self):
+
+        class ShortEmbeddingsEngine(CountingEmbeddingsEngine):
+            def encode_batch(self, texts: list[str]) -> list[list[float]]:
+                return super().encode_batch(texts)[1:]
+
+        batcher = BatchingEmbeddingsEngine(ShortEmbeddingsEngine(), max_batch_size=4, max_wait_ms=200)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(batcher.encode, text) for text in ['a', 'b', 'c', 'd']]
+
+        for future in futures:
+            with self.assertRaises(ValueError):
+                future.result(timeout=5)
+
+        batcher.close()
+
+    def test_close(self):
+        batcher = BatchingEmbeddingsEngine(CountingEmbeddingsEngine(), max_wait_ms=1)
+        self.assertEqual(batcher.encode('ab'), [2.0, 1.0])
+
+        batcher.close()
+        self.assertNotIn('verusdb-encode-batcher', [thread.name for thread in threading.enumerate()])
+
+        # later encodes go straight to the wrapped engine
+        self.assertEqual(batcher.encode('abc'), [3.0, 1.0])
+        self.assertNotIn('verusdb-encode-batcher', [thread.name for thread in threading.enumerate()])
+        batcher.close()
+
+    def test_close_while_encoding(self):
+        batcher = BatchingEmbeddingsEngine(CountingEmbeddingsEngine(), max_wait_ms=1)
+        texts = ['a' * size for size in range(1, 201)]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(batcher.encode, text) for text in texts]
+            batcher.close()
+            vectors = [future.result(timeout=5) for future in futures]
+
+        self.assertEqual([vector[0] for vector in vectors], [float(len(text)) for text in texts])
+
+    def test_client_search_many(self):
+        engine = CountingEmbeddingsEngine()
+        client = VerusClient(Settings(engine='polars', embeddings=engine, batching={'max_wait_ms': 1}))
+        client.add(collection='test', texts=['a', 'bb', 'ccc'], metadata=[{}, {}, {}])
+
+        results = client.search_many(texts=['a', 'ccc'], collection='test', top_k=1)
+
+        self.assertEqual([result[0]['text'] for result in results], ['a', 'ccc'])
+        # one batch for the add and one for both queries
+        self.assertEqual(len(engine.batches), 2)
+
+        single = client.search(text='bb', collection='test', top_k=1)
+        self.assertEqual(single[0]['text'], 'bb') # type: ignore
+
+        client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+from __future__ import annotations
+import time
+import unittest
+import numpy as np
+from verusdb.settings import Settings
+from verusdb.client import VerusClient
+from verusdb.embeddings import BaseEmbeddingsEngine
+from verusdb.results import SearchResults, is_complete
+
+
+class SlowEmbeddingsEngine(BaseEmbeddingsEngine):
+
+    def __init__(self):
+        self.delay = 0.0
+
+    def encode(self, text: str) -> list[float]:
+        time.sleep(self.delay)
+        return [1.0, float(len(text)), 0.0]
+
+    def get_dimensions(self) -> int:
+        return 3
+
+
+class TestDeadline(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.embeddings = rng.random((100, 3)).tolist()
+        # the closest document to the query is the last one added
+        self.embeddings[-1] = [0.0, 0.0, 1.0]
+
+    def client(self, **kwargs) -> VerusClient:
+        client = VerusClient(Settings(engine='polars', polars={'deadline_chunk_size': 10}, **kwargs))
+        client.add(collection='test', texts=[f'test{i}' for i in range(100)], embeddings=self.embeddings)
+        return client
+
+    def test_complete(self):
+        client = self.client()
+
+        results = client.search(embedding=[0.0, 0.0, 1.0], collection='test', top_k=3, deadline_ms=10000)
+
+        self.assertIsInstance(results, SearchResults)
+        self.assertTrue(results.complete) # type: ignore
+        self.assertEqual(results, client.search(embedding=[0.0, 0.0, 1.0], collection='test', top_k=3))
+
+    def test_best_so_far(self):
+        client = self.client(cache={'max_size': 16})
+
+        results = client.search(embedding=[0.0, 0.0, 1.0], collection='test', top_k=3, deadline_ms=0.001)
+
+        # only the first chunk was scored before the deadline expired
+        self.assertFalse(is_complete(results))
+        self.assertEqual(len(results), 3) # type: ignore
+        self.assertNotEqual(results[0]['text'], 'test99') # type: ignore
+        self.assertTrue(all(int(document['text'][4:]) < 10 for document in results)) # type: ignore
+
+        # incomplete results are not cached
+        self.assertEqual(client.cache_stats()['size'], 0) # type: ignore
+
+        arrow = client.search(embedding=[0.0, 0.0, 1.0], collection='test', top_k=3, result_format='arrow', deadline_ms=0.001)
+        self.assertFalse(is_complete(arrow))
+
+    def test_encode_timeout(self):
+        embeddings = SlowEmbeddingsEngine()
+        client = self.client(cache={'max_size': 16}, embeddings=embeddings)
+
+        cached = client.search(text='query', collection='test', top_k=3)
+        client.add(collection='test', texts=['new'], embeddings=[[0.0, 0.0, 1.0]])
+
+        # the encode misses the deadline, the result computed before the add is returned
+        embeddings.delay = 0.2
+        results = client.search(text='query', collection='test', top_k=3, deadline_ms=20)
+
+        self.assertFalse(results.complete) # type: ignore
+        self.assertEqual(results, cached)
+
+        results = client.search(text='other', collection='test', top_k=3, deadline_ms=20)
+        self.assertEqual(results, [])
+        self.assertFalse(results.complete) # type: ignore
+
+        client.close()
@@ -0,0 +1,84 @@
+from __future__ import annotations
+import unittest
+from verusdb.settings import Settings
+from verusdb.client import VerusClient
+from verusdb.embeddings.openai import OpenAIEmbeddingsEngine
+from verusdb.utils import content_uuid
+
+
+class CountingEmbeddingsEngine(OpenAIEmbeddingsEngine):
+
+    def __init__(self):
+        super().__init__(api_key='', fake=True)
+        self.encoded = 0
+
+    def encode_batch(self, texts: list[str]) -> list[list[float]]:
+        self.encoded += len(texts)
+        return super().encode_batch(texts)
+
+
+class TestDedup(unittest.TestCase):
+
+    def client(self, dedup='skip') -> VerusClient:
+        self.embeddings = CountingEmbeddingsEngine()
+        return VerusClient(Settings(engine='polars', embeddings=self.embeddings, dedup=dedup))
+
+    def test_skip(self):
+        client = self.client()
+        client.add(texts=['a', 'b', 'a'], collection='test', metadata=[{'n': '1'}, {'n': '2'}, {'n': '3'}])
+        client.add(texts=['b', 'c'], collection='test', metadata=[{'n': '4'}, {'n': '5'}])
+
+        documents = client.get_documents(collection='test')
+        # repeated texts are neither stored nor encoded again, the first copy is kept
+        self.assertEqual([(document['text'], document['metadata']['n']) for document in documents], [('a', '1'), ('b', '2'), ('c', '5')]) # type: ignore
+        self.assertEqual(self.embeddings.encoded, 3)
+        self.assertEqual(documents[0]['uuid'], content_uuid('test', 'a')) # type: ignore
+
+        # the same text in another collection is another document
+        client.add(texts=['a'], collection='other')
+        self.assertEqual(len(client.get_documents(collection='other')), 1) # type: ignore
+
+    def test_upsert(self):
+        client = self.client('upsert')
+        client.add(texts=['a', 'b'], collection='test', metadata=[{'n': '1'}, {'n': '2'}])
+        client.add(texts=['b', 'c'], collection='test', metadata=[{'n': '3'}, {'n': '4'}])
+
+        documents = client.get_documents(collection='test')
+        self.assertEqual([(document['text'], document['metadata']['n']) for document in documents], [('a', '1'), ('b', '3'), ('c', '4')]) # type: ignore
+        self.assertEqual(self.embeddings.encoded, 3)
+
+    def test_add_stream(self):
+        client = self.client()
+        client.add(texts=['document 0', 'document 1'], collection='test')
+
+        progress = client.add_stream((f'document {index % 5}' for index in range(10)), collection='test', chunk_size=2, workers=1, max_pending=0)
+
+        self.assertEqual(progress.written, 10)
+        self.assertEqual(progress.duplicates, 7)
+        self.assertEqual(len(client.get_documents(collection='test')), 5) # type: ignore
+        self.assertEqual(self.embeddings.encoded, 5)
+
+    def test_add_stream_single_pass(self):
+        client = self.client()
+        calls = []
+        deduplicate = client.engine.deduplicate
+        client.engine.deduplicate = lambda *args: calls.append(args) or deduplicate(*args) # type: ignore
+
+        # the workers deduplicate every chunk once, the writes do not do it again
+        client.add_stream((f'document {index}' for index in range(10)), collection='test', chunk_size=2)
+        self.assertEqual(len(calls), 5)
+
+        # a text of a chunk written while the next one was in flight is still stored once
+        client.add_stream(['x', 'y', 'y', 'z', 'z', 'x'], collection='other', chunk_size=2, workers=2)
+        self.assertEqual(sorted(document['text'] for document in client.get_documents(collection='other')), ['x', 'y', 'z']) # type: ignore
+
+    def test_settings(self):
+        self.assertEqual(Settings(engine='polars', dedup=True).dedup, 'skip')
+        self.assertIsNone(Settings(engine='polars').dedup)
+
+        with self.assertRaises(ValueError):
+            Settings(engine='polars', dedup='merge')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+from __future__ import annotations
+import unittest
+from functools import partial
+import numpy as np
+from verusdb.embeddings import BaseEmbeddingsEngine
+from verusdb.embeddings.hashing import HashingEmbeddingsEngine
+from verusdb.embeddings.process import ProcessPoolEmbeddingsEngine
+from verusdb.settings import Settings
+from verusdb.client import VerusClient
+
+
+class FailingEmbeddingsEngine(BaseEmbeddingsEngine):
+
+    def encode(self, text: str) -> list[float]:
+        raise RuntimeError('model not loaded')
+
+    def encode_batch(self, texts: list[str]) -> list[list[float]]:
+        raise RuntimeError('model not loaded')
+
+    def get_dimensions(self) -> int:
+        return 4
+
+
+class TestHashingEmbeddings(unittest.TestCase):
+
+    def test_deterministic(self):
+        engine = HashingEmbeddingsEngine(dimensions=64)
+
+        vectors = np.array(engine.encode_batch(['red apples', 'red apples and pears', 'blue cars', '']))
+
+        self.assertEqual(vectors.shape, (4, 64))
+        self.assertEqual(engine.encode('red apples'), HashingEmbeddingsEngine(dimensions=64).encode('red apples'))
+        self.assertNotEqual(engine.encode('red apples'), HashingEmbeddingsEngine(dimensions=64, seed=1).encode('red apples'))
+
+        # texts sharing words are closer than texts that do not
+        self.assertGreater(vectors[0] @ vectors[1], vectors[0] @ vectors[2])
+        self.assertAlmostEqual(float(np.linalg.norm(vectors[0])), 1.0, places=5)
+        self.assertEqual(float(np.abs(vectors[3]).sum()), 0.0)
+
+
+class TestProcessPoolEmbeddings(unittest.TestCase):
+
+    def test_matches_the_wrapped_engine(self):
+        texts = [f'document {i} about topic {i % 7}' for i in range(50)]
+        pool = ProcessPoolEmbeddingsEngine(partial(HashingEmbeddingsEngine, dimensions=32), workers=2, batch_size=8)
+
+        try:
+            self.assertEqual(pool.get_dimensions(), 32)
+            np.testing.assert_allclose(pool.encode_array(texts), HashingEmbeddingsEngine(dimensions=32).encode_array(texts))
+            self.assertEqual(len(pool.encode('one text')), 32)
+            self.assertEqual(pool.encode_batch([]), [])
+
+            client = VerusClient(Settings(engine='polars', embeddings=pool))
+            client.add(collection='test', texts=texts)
+            self.assertEqual(client.search(text=texts[3], collection='test', top_k=1)[0]['text'], texts[3]) # type: ignore
+        finally:
+            pool.close()
+
+    def test_errors_reach_the_caller(self):
+        pool = ProcessPoolEmbeddingsEngine(FailingEmbeddingsEngine, workers=1)
+
+        try:
+            with self.assertRaises(RuntimeError):
+                pool.encode_batch(['text'])
+        finally:
+            pool.close()
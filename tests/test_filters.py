@@ -0,0 +1,46 @@
+from __future__ import annotations
+import unittest
+import polars as pl
+from verusdb.filters import NUMBER_PATTERN, Eq, Ne, In, Range, Prefix, And, compile_filters
+
+
+class TestFilters(unittest.TestCase):
+
+    def setUp(self):
+        self.frame = pl.DataFrame({
+            'uuid': ['1', '2', '3', '4'],
+            'metadata__source': ['web', 'pdf', 'web', 'mail'],
+            'metadata__pages': ['3', '10', 'x', '5'],
+        })
+
+    def matches(self, expression):
+        return self.frame.filter(expression.to_polars(self.frame.columns).fill_null(False))['uuid'].to_list()
+
+    def test_polars(self):
+        self.assertListEqual(self.matches(Eq('source', 'web')), ['1', '3'])
+        self.assertListEqual(self.matches(Ne('source', 'web')), ['2', '4'])
+        self.assertListEqual(self.matches(In('source', ['pdf', 'mail'])), ['2', '4'])
+        self.assertListEqual(self.matches(Range('pages', gte=4)), ['2', '4'])
+        self.assertListEqual(self.matches(Prefix('source', 'w') & ~Eq('pages', 'x')), ['1'])
+        self.assertListEqual(self.matches(Eq('source', 'pdf') | Eq('source', 'mail')), ['2', '4'])
+        self.assertListEqual(self.matches(Eq('missing', 'web')), [])
+
+    def test_compile_dict(self):
+        compiled = compile_filters({'source': 'web', 'pages': '3'})
+        self.assertIsInstance(compiled, And)
+        self.assertListEqual(self.matches(compiled), ['1'])
+        self.assertIsNone(compile_filters({}))
+
+    def test_sql(self):
+        sql, params = (Eq('source', 'web') & Eq('pages', '3') & Range('pages', lt=10)).to_sql()
+        self.assertEqual(sql, '(metadata @> %s::jsonb AND (CASE WHEN metadata->>%s ~ %s THEN (metadata->>%s)::numeric END < %s))')
+        self.assertListEqual(params, ['{"source": "web", "pages": "3"}', 'pages', NUMBER_PATTERN, 'pages', 10])
+
+        sql, params = Range('source', gte='p').to_sql()
+        self.assertEqual((sql, params), ('(metadata->>%s >= %s)', ['source', 'p']))
+
+    def test_redis(self):
+        self.assertEqual(In('source', ['web', 'my pdf']).to_redis(), r'@metadata:{source\:web | source\:my\ pdf}')
+        self.assertEqual((~Eq('source', 'web')).to_redis(), r'-(@metadata:{source\:web})')
+        with self.assertRaises(ValueError):
+            Range('pages', gte=3).to_redis()
@@ -0,0 +1,78 @@
+from __future__ import annotations
+import json
+import subprocess
+import sys
+import unittest
+from verusdb.settings import Settings
+from verusdb.client import VerusClient
+from verusdb.engines import BaseEngine
+from verusdb.engines.polars import PolarsEngine
+from verusdb.engines.registry import available_engines, get_engine, register_engine, unregister_engine
+
+
+def imported_modules(statement: str) -> list[str]:
+    """
+    The modules loaded by ``statement`` in a fresh interpreter
+    """
+    code = f'{statement}\nimport sys, json\nprint(json.dumps(sorted(sys.modules)))'
+    process = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return json.loads(process.stdout)
+
+
+class TestImports(unittest.TestCase):
+
+    def test_import_is_lightweight(self):
+        modules = imported_modules(
+            'import verusdb\n'
+            'from verusdb.filters import Eq\n'
+            'from verusdb.embeddings.openai import OpenAIEmbeddingsEngine\n'
+            "verusdb.Settings(engine='polars', batching=True, embeddings=OpenAIEmbeddingsEngine(api_key='', fake=True))"
+        )
+
+        for module in ('numpy', 'polars', 'pyarrow', 'redis', 'psycopg2', 'openai'):
+            self.assertNotIn(module, modules)
+
+    def test_only_the_configured_driver_is_imported(self):
+        modules = imported_modules(
+            'import verusdb\n'
+            "verusdb.VerusClient(verusdb.Settings(engine='polars'))"
+        )
+
+        self.assertIn('polars', modules)
+        self.assertNotIn('redis', modules)
+        self.assertNotIn('psycopg2', modules)
+
+    def test_registry(self):
+        self.assertIs(get_engine('polars'), PolarsEngine)
+        self.assertTrue({'polars', 'redis', 'postgres'} <= set(available_engines()))
+
+        class MemoryEngine(BaseEngine):
+
+            def __init__(self, settings: Settings):
+                self.option = settings.options['memory']['option']
+
+            def add(self, texts, collection=None, embeddings=None, metadata=None):
+                pass
+
+            def _serialize(self, documents):
+                return documents
+
+            def load(self):
+                pass
+
+            def search(self, collection, query, filters, num_results=10):
+                return []
+
+        register_engine('memory', MemoryEngine)
+        self.addCleanup(unregister_engine, 'memory')
+        client = VerusClient(Settings(engine='memory', memory={'option': 1}))
+
+        self.assertIsInstance(client.get_engine(), MemoryEngine)
+        self.assertEqual(client.get_engine().option, 1) # type: ignore
+
+        with self.assertRaises(ValueError):
+            Settings(engine='missing')
+
+
+if __name__ == '__main__':
+    unittest.main()
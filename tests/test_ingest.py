@@ -0,0 +1,99 @@
+from __future__ import annotations
+import json
+import os
+import tempfile
+import unittest
+from verusdb.settings import Settings
+from verusdb.client import VerusClient
+from verusdb.embeddings.openai import OpenAIEmbeddingsEngine
+from verusdb.ingest import IngestPipeline
+
+
+def documents(count: int, fail_at: int | None = None):
+    for index in range(count):
+        if index == fail_at:
+            raise RuntimeError('interrupted')
+        yield {'text': f'document {index}', 'metadata': {'index': str(index)}}
+
+
+class TestIngest(unittest.TestCase):
+
+    def client(self, folder: str | None = None) -> VerusClient:
+        return VerusClient(Settings(
+            folder=folder,
+            engine='polars',
+            embeddings=OpenAIEmbeddingsEngine(api_key='', fake=True)
+        ))
+
+    def test_add_stream(self):
+        client = self.client()
+        updates = []
+
+        progress = client.add_stream(documents(1000), collection='test', chunk_size=64, workers=3, max_pending=1, on_progress=updates.append)
+
+        self.assertEqual(progress.written, 1000)
+        self.assertEqual(len(updates), 16)
+
+        stored = client.get_documents(collection='test')
+        self.assertEqual(len(stored), 1000)
+        # chunks are written in the order of the source
+        self.assertEqual([item['metadata']['index'] for item in stored[:3]], ['0', '1', '2']) # type: ignore
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as folder:
+            checkpoint = os.path.join(folder, 'ingest.json')
+
+            with self.assertRaises(RuntimeError):
+                self.client(folder).add_stream(documents(500, fail_at=350), collection='test', chunk_size=50, workers=1, max_pending=0, checkpoint=checkpoint, checkpoint_every=2)
+
+            with open(checkpoint) as file:
+                self.assertEqual(json.load(file)['written'], 300)
+
+            # the saved store only holds the checkpointed documents, the second run skips them
+            client = self.client(folder)
+            self.assertEqual(len(client.get_documents(collection='test')), 300)
+
+            progress = client.add_stream(documents(500), collection='test', chunk_size=50, checkpoint=checkpoint, checkpoint_every=2)
+            self.assertEqual((progress.skipped, progress.written), (300, 200))
+
+            indexes = sorted(int(item['metadata']['index']) for item in self.client(folder).get_documents(collection='test')) # type: ignore
+            self.assertEqual(indexes, list(range(500)))
+
+            with self.assertRaises(ValueError):
+                client.add_stream(documents(10), collection='other', checkpoint=checkpoint)
+
+    def test_checkpoint_requires_a_folder(self):
+        # an in-memory store is lost with the process, a checkpoint would skip documents never persisted
+        with self.assertRaises(ValueError):
+            self.client().add_stream(documents(10), collection='test', checkpoint=os.path.join(tempfile.gettempdir(), 'ingest.json'))
+
+    def test_resume_without_flush(self):
+        # an engine committing every write, like redis and postgres
+        stored = []
+
+        def write(texts, collection, embeddings, metadata, deduplicated):
+            if fail_at is not None and len(stored) == fail_at:
+                raise RuntimeError('connection lost')
+            stored.extend(texts)
+
+        with tempfile.TemporaryDirectory() as folder:
+            checkpoint = os.path.join(folder, 'ingest.json')
+            pipeline = IngestPipeline(write, chunk_size=10, workers=1, max_pending=0, checkpoint=checkpoint, checkpoint_every=10)
+            source = [{'text': f'document {index}', 'embedding': [1.0, 0.0]} for index in range(100)]
+
+            fail_at = 30
+            with self.assertRaises(RuntimeError):
+                pipeline.run(source, 'test')
+
+            with open(checkpoint) as file:
+                self.assertEqual(json.load(file)['written'], 30)
+
+            fail_at = None
+            progress = pipeline.run(source, 'test')
+
+            self.assertEqual((progress.skipped, progress.written), (30, 70))
+            self.assertEqual(stored, [document['text'] for document in source])
+
+
+if __name__ == '__main__':
+    unittest.main()
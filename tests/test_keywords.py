@@ -0,0 +1,131 @@
+from __future__ import annotations
+import shutil
+import tempfile
+import unittest
+from verusdb.settings import Settings
+from verusdb.client import VerusClient
+from verusdb.engines.keywords import KeywordIndex, reciprocal_rank_fusion
+
+
+class TestKeywordIndex(unittest.TestCase):
+
+    def test_bm25(self):
+        index = KeywordIndex()
+        index.add(['a', 'b', 'c'], ['The quick brown fox', 'the lazy dog', 'quick, quick dog'])
+
+        ranking = index.search('Quick dog')
+        self.assertEqual(ranking['uuid'].to_list(), ['c', 'b', 'a'])
+        self.assertEqual(index.search('cat').height, 0)
+
+        index.remove(['c'])
+        self.assertEqual(index.search('quick dog')['uuid'].to_list(), ['b', 'a'])
+        self.assertEqual((index.documents, index.tokens), (2, 7))
+
+    def test_tail_merge(self):
+        index = KeywordIndex()
+        index.add([f'doc{i}' for i in range(5000)], [f'word{i} common' for i in range(5000)])
+        index.add(['new'], ['word7 rare'])
+
+        self.assertEqual(sorted(index.search('word7')['uuid'].to_list()), ['doc7', 'new'])
+        self.assertEqual(index.search('common').height, 5000)
+
+    def test_remove(self):
+        index = KeywordIndex()
+        index.add([f'doc{i}' for i in range(10000)], [f'word{i} common' for i in range(10000)])
+
+        # masked until they are an eighth of the documents
+        index.remove(['doc1', 'doc2', 'missing'])
+        self.assertEqual(index.search('word1 word2 word3')['uuid'].to_list(), ['doc3'])
+        self.assertEqual(index.postings.height, 2 * 9998)
+        self.assertEqual((index.documents, index.tokens), (9998, 2 * 9998))
+
+        # a removed document can be added again
+        index.add(['doc1'], ['word1 again'])
+        self.assertEqual(index.search('word1')['uuid'].to_list(), ['doc1'])
+
+        index.remove([f'doc{i}' for i in range(5000, 10000)])
+        self.assertEqual(index.search('common').height, 4998)
+        self.assertEqual(index.postings.height, 2 * 4999)
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['b']], k=60)
+        self.assertEqual(fused['uuid'].to_list(), ['b', 'a', 'c'])
+
+
+class TestKeywordSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def client(self, **polars) -> VerusClient:
+        return VerusClient(Settings(folder=self.folder, engine='polars', polars={'keywords': True, **polars}))
+
+    def add(self, client: VerusClient):
+        client.add(
+            collection='test',
+            texts=['red apples', 'green apples', 'red cars', 'blue cars'],
+            embeddings=[[1.0, 0.0, 0.0], [0.9, 0.1, 0.0], [0.0, 1.0, 0.0], [0.0, 0.9, 0.1]],
+        )
+
+    def test_prefilter(self):
+        client = self.client()
+        self.add(client)
+
+        results = client.search(embedding=[1.0, 0.0, 0.0], collection='test', keyword='cars')
+        self.assertEqual([document['text'] for document in results], ['red cars', 'blue cars']) # type: ignore
+
+        self.assertEqual(client.search(embedding=[1.0, 0.0, 0.0], collection='test', keyword='boats'), [])
+
+        client.delete_many([results[1]['uuid']]) # type: ignore
+        results = client.search(embedding=[1.0, 0.0, 0.0], collection='test', keyword='cars')
+        self.assertEqual([document['text'] for document in results], ['red cars']) # type: ignore
+
+    def test_rrf(self):
+        client = self.client(rrf_depth=2)
+        self.add(client)
+
+        # apples lead the vector ranking, red documents the keyword ranking
+        results = client.search(embedding=[1.0, 0.0, 0.0], collection='test', keyword='red', keyword_mode='rrf', top_k=3)
+
+        self.assertEqual(results[0]['text'], 'red apples') # type: ignore
+        self.assertEqual({document['text'] for document in results}, {'red apples', 'green apples', 'red cars'}) # type: ignore
+
+        with self.assertRaises(ValueError):
+            client.search(embedding=[1.0, 0.0, 0.0], keyword='red', keyword_mode='bm25')
+
+    def test_persisted(self):
+        client = self.client()
+        self.add(client)
+        client.save()
+
+        client = self.client()
+        self.assertEqual(client.engine.keywords.documents, 4) # type: ignore
+        self.assertEqual(len(client.search(embedding=[1.0, 0.0, 0.0], collection='test', keyword='apples')), 2) # type: ignore
+
+        stats = client.stats()
+        self.assertIn('keywords', [index['name'] for index in stats['indexes']])
+
+    def test_replayed_from_wal(self):
+        client = self.client(wal=True, checkpoint_interval=None)
+        self.add(client)
+        client.save()
+
+        # written after the checkpoint, only the log has them
+        client.add(collection='test', texts=['yellow boats'], embeddings=[[0.0, 0.0, 1.0]])
+        red = client.search(embedding=[0.0, 1.0, 0.0], keyword='red', top_k=1)
+        client.delete(uuid=red[0]['uuid']) # type: ignore
+
+        client = self.client(wal=True, checkpoint_interval=None)
+        self.assertEqual([document['text'] for document in client.search(embedding=[0.0, 0.0, 1.0], keyword='boats')], ['yellow boats']) # type: ignore
+        self.assertEqual([document['text'] for document in client.search(embedding=[0.0, 1.0, 0.0], keyword='cars')], ['blue cars']) # type: ignore
+        client.close()
+
+    def test_requires_index(self):
+        client = VerusClient(Settings(engine='polars'))
+        self.add(client)
+
+        with self.assertRaises(ValueError):
+            client.search(embedding=[1.0, 0.0, 0.0], keyword='red')
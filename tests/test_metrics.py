@@ -0,0 +1,58 @@
+from __future__ import annotations
+import unittest
+from verusdb.settings import Settings
+from verusdb.client import VerusClient
+from verusdb.metrics import InMemoryMetricsSink, MetricsRecorder
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        
+        self.sink = InMemoryMetricsSink()
+        self.settings = Settings(
+            engine='polars',
+            metrics=self.sink,
+        )
+
+        self.client = VerusClient(self.settings)
+
+    def test_disabled_recorder(self):
+        recorder = MetricsRecorder()
+        with recorder.span('search', 'score'):
+            pass
+        recorder.count('rows_returned', 3)
+        self.assertFalse(recorder.enabled)
+
+    def test_search_spans(self):
+        self.client.add(
+            collection='test',
+            texts=['test', 'test2', 'test3'],
+            embeddings=[[1.0, 2.0, 3.0], [1.0, 5.0, 63.0], [71.0, 2.0, 1.0]],
+            metadata=[{'test': 'test'}, {'test': 'test2'}, {'test': 'test3'}]
+        )
+        self.client.search(embedding=[1.0, 2.0, 3.0], collection='test', top_k=2)
+
+        snapshot = self.sink.snapshot()
+        phases = {(item['labels']['operation'], item['labels']['phase']) for item in snapshot['histograms']}
+        counters = {item['name']: item['value'] for item in snapshot['counters']}
+
+        self.assertIn(('search', 'total'), phases)
+        self.assertIn(('search', 'score'), phases)
+        self.assertIn(('add', 'write'), phases)
+        self.assertEqual(counters['verusdb_documents_scanned_total'], 3)
+        self.assertEqual(counters['verusdb_rows_returned_total'], 2)
+
+    def test_prometheus_export(self):
+        sink = InMemoryMetricsSink(buckets=(0.1, 1.0))
+        sink.observe('verusdb_operation_seconds', 0.5, {'operation': 'search'})
+        sink.increment('verusdb_cache_hits_total', 2, {'operation': 'search'})
+
+        text = sink.to_prometheus()
+
+        self.assertIn('# TYPE verusdb_operation_seconds histogram', text)
+        self.assertIn('verusdb_operation_seconds_bucket{operation="search",le="0.1"} 0', text)
+        self.assertIn('verusdb_operation_seconds_bucket{operation="search",le="1.0"} 1', text)
+        self.assertIn('verusdb_operation_seconds_bucket{operation="search",le="+Inf"} 1', text)
+        self.assertIn('verusdb_operation_seconds_count{operation="search"} 1', text)
+        self.assertIn('verusdb_cache_hits_total{operation="search"} 2', text)
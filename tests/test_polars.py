@@ -1,10 +1,13 @@
 from __future__ import annotations
 import unittest
 import os
+import tempfile
+import numpy as np
 import polars as pl
 from verusdb.settings import Settings
 from verusdb.client import VerusClient
 from verusdb.embeddings.openai import OpenAIEmbeddingsEngine
+from verusdb.filters import In, Range
 
 class TestVerusClient(unittest.TestCase):
 
@@ -97,6 +100,145 @@ class TestVerusClient(unittest.TestCase):
         self.assertEqual(len(self.client.get_documents(collection='test')), 3)
         self.assertListEqual(list(self.client.get_documents(collection='test')[0].keys()), ['uuid','collection', 'text', 'embeddings', 'metadata'])
 
+    def test_add_keeps_existing_metadata(self):
+        self.client.add(collection='test', texts=['test'], embeddings=[[1.0, 2.0, 3.0]], metadata=[{'test': 'first'}])
+        self.client.add(collection='test', texts=['test2'], embeddings=[[1.0, 5.0, 63.0]], metadata=[{'test': 'second'}])
+        self.assertListEqual(sorted(doc['metadata']['test'] for doc in self.client.get_documents(collection='test')), ['first', 'second']) # type: ignore
+
+    def test_iter_documents(self):
+        self.client.add(
+            collection='test',
+            texts=['test', 'test2', 'test3'],
+            embeddings=[[1.0, 2.0, 3.0], [1.0, 5.0, 63.0], [71.0, 2.0, 1.0]],
+            metadata=[{'test': 'test'}, {'test': 'test2'}, {'test': 'test3'}]
+        )
+        documents = list(self.client.iter_documents(collection='test', itersize=2))
+        self.assertEqual(len(documents), 3)
+        self.assertNotIn('embeddings', documents[0])
+        self.assertListEqual([doc['uuid'] for doc in documents], sorted(doc['uuid'] for doc in documents))
+        self.assertEqual(len(list(self.client.iter_documents(collection='test', after=documents[0]['uuid']))), 2)
+
+    def test_result_formats(self):
+        self.client.add(
+            collection='test',
+            texts=['test', 'test2', 'test3'],
+            embeddings=[[1.0, 2.0, 3.0], [1.0, 5.0, 63.0], [71.0, 2.0, 1.0]],
+            metadata=[{'test': 'test'}, {'test': 'test2'}, {'test': 'test3'}]
+        )
+        frame = self.client.search(embedding=[1.0, 2.0, 3.0], collection='test', result_format='polars')
+        self.assertIsInstance(frame, pl.DataFrame)
+        self.assertEqual(frame['metadata'].struct.field('test')[0], 'test') # type: ignore
+
+        table = self.client.search(embedding=[1.0, 2.0, 3.0], collection='test', result_format='arrow')
+        self.assertEqual(table.num_rows, 3) # type: ignore
+
+        arrays = self.client.search(embedding=[1.0, 2.0, 3.0], collection='test', result_format='numpy')
+        self.assertEqual(arrays['score'].shape, (3,)) # type: ignore
+        self.assertEqual(arrays['text'][0], 'test') # type: ignore
+
+        documents = self.client.get_documents(collection='test', result_format='numpy')
+        self.assertEqual(documents['embeddings'].shape, (3, 3)) # type: ignore
+
+        with self.assertRaises(ValueError):
+            self.client.search(embedding=[1.0, 2.0, 3.0], collection='test', result_format='csv')
+
+    def test_search_with_filter_expression(self):
+        self.client.add(
+            collection='test',
+            texts=['test', 'test2', 'test3'],
+            embeddings=[[1.0, 2.0, 3.0], [1.0, 5.0, 63.0], [71.0, 2.0, 1.0]],
+            metadata=[{'test': 'test', 'pages': '1'}, {'test': 'test2', 'pages': '12'}, {'test': 'test3', 'pages': '30'}]
+        )
+        temp = self.client.search(embedding=[1.0, 2.0, 3.0], collection='test', filters=In('test', ['test', 'test2']) & Range('pages', gte=10))
+        self.assertEqual(len(temp), 1) # type: ignore
+        self.assertEqual(temp[0]['text'], 'test2') # type: ignore
+
+        self.client.delete(collection='test', filters=Range('pages', lt=20))
+        self.assertEqual(len(self.client.get_documents(collection='test')), 1)
+
+    def test_metrics(self):
+        embeddings = [[1.0, 0.0], [10.0, 1.0], [0.0, 1.0]]
+
+        for metric, expected in [('cosine', 'a'), ('dot', 'b'), ('l2', 'a')]:
+            client = VerusClient(Settings(engine='polars', metric=metric))
+            client.add(collection='test', texts=['a', 'b', 'c'], embeddings=embeddings, metadata=[{}, {}, {}])
+            temp = client.search(embedding=[1.0, 0.0], collection='test', top_k=2)
+            self.assertEqual(temp[0]['text'], expected, metric) # type: ignore
+            self.assertEqual(len(temp), 2) # type: ignore
+
+        with self.assertRaises(ValueError):
+            Settings(engine='polars', metric='hamming')
+
+    def test_search_many(self):
+        embeddings = [[1.0, 0.0], [10.0, 1.0], [0.0, 1.0]]
+        queries = [[1.0, 0.0], [0.0, 1.0], [3.0, 1.0]]
+
+        for metric in ('cosine', 'dot', 'l2'):
+            client = VerusClient(Settings(engine='polars', metric=metric))
+            client.add(collection='test', texts=['a', 'b', 'c'], embeddings=embeddings, metadata=[{}, {}, {}])
+
+            batched = client.search_many(embeddings=queries, collection='test', top_k=2)
+            self.assertEqual(len(batched), len(queries))
+
+            # same ranking and scores as searching the queries one by one
+            for query, result in zip(queries, batched):
+                single = client.search(embedding=query, collection='test', top_k=2)
+                self.assertEqual([item['text'] for item in result], [item['text'] for item in single], metric) # type: ignore
+                for left, right in zip(result, single): # type: ignore
+                    self.assertAlmostEqual(left['score'], right['score'], places=6)
+
+    def test_coarse_search(self):
+        # most of the variance lives in a few directions, like real embeddings
+        rng = np.random.default_rng(0)
+        latent = rng.normal(size=(2000, 12))
+        embeddings = (latent @ rng.normal(size=(12, 64)) + rng.normal(scale=0.01, size=(2000, 64))).tolist()
+        texts = [str(index) for index in range(2000)]
+
+        with tempfile.TemporaryDirectory() as folder:
+            for method in ('pca', 'truncate'):
+                settings = Settings(folder=folder, engine='polars', polars={
+                    'coarse': {'method': method, 'dimensions': 16, 'candidates': 10, 'min_rows': 100}
+                })
+                client = VerusClient(settings)
+                client.clear()
+                client.add(collection='test', texts=texts, embeddings=embeddings, metadata=[{}] * 2000)
+
+                # a stored vector is its own nearest neighbour, the rerank uses the full vectors
+                for index in (0, 500, 1999):
+                    temp = client.search(embedding=embeddings[index], collection='test', top_k=5)
+                    self.assertEqual(temp[0]['text'], str(index), method) # type: ignore
+                    self.assertNotIn('coarse', temp[0]) # type: ignore
+
+                batched = client.search_many(embeddings=[embeddings[0], embeddings[1]], collection='test', top_k=5)
+                self.assertEqual([result[0]['text'] for result in batched], ['0', '1'])
+
+                client.save()
+                engine = VerusClient(settings).get_engine()
+                self.assertIn('coarse', engine.store.columns) # type: ignore
+                if method == 'pca':
+                    np.testing.assert_array_equal(engine.coarse.components, client.get_engine().coarse.components) # type: ignore
+
+        with self.assertRaises(ValueError):
+            VerusClient(Settings(engine='polars', polars={'coarse': {'method': 'hash'}}))
+
+    def test_dtype(self):
+        embeddings = [[1.0, 0.0, 0.0], [0.6, 0.8, 0.0], [0.0, 0.0, 1.0]]
+
+        with tempfile.TemporaryDirectory() as folder:
+            for dtype in ('float32', 'float16'):
+                client = VerusClient(Settings(folder=folder, engine='polars', dtype=dtype))
+                client.clear()
+                client.add(collection='test', texts=['a', 'b', 'c'], embeddings=embeddings, metadata=[{}, {}, {}])
+                client.save()
+
+                reloaded = VerusClient(Settings(folder=folder, engine='polars', dtype=dtype))
+                temp = reloaded.search(embedding=[0.9, 0.1, 0.0], collection='test', top_k=3)
+                self.assertEqual([item['text'] for item in temp], ['a', 'b', 'c'], dtype) # type: ignore
+                self.assertAlmostEqual(reloaded.get_documents(collection='test')[0]['embeddings'][0], 1.0, places=3) # type: ignore
+
+        with self.assertRaises(ValueError):
+            Settings(engine='polars', dtype='int8')
+
     def test_delete(self):
         self.client.add(
             collection='test',
@@ -128,6 +270,37 @@ class TestVerusClient(unittest.TestCase):
             
         
 
+    def test_update_many(self):
+        self.client.add(
+            collection='test',
+            texts=['test', 'test2', 'test3'],
+            embeddings=[[1.0, 2.0, 3.0], [1.0, 5.0, 63.0], [71.0, 2.0, 1.0]],
+            metadata=[{'test': 'test'}, {'test': 'test2'}, {'test': 'test3'}]
+        )
+        uuids = [document['uuid'] for document in self.client.get_documents(collection='test')] # type: ignore
+
+        self.client.update_many(uuids[:2], [{'test': 'Updated'}, {'source': 'new'}])
+
+        self.assertEqual(self.client.get_document(uuid=uuids[0])['metadata'], {'test': 'Updated', 'source': ''}) # type: ignore
+        # the metadata is replaced, keys the store did not have become columns
+        self.assertEqual(self.client.get_document(uuid=uuids[1])['metadata'], {'test': '', 'source': 'new'}) # type: ignore
+        self.assertEqual(self.client.get_document(uuid=uuids[2])['metadata'], {'test': 'test3', 'source': ''}) # type: ignore
+
+        with self.assertRaises(ValueError):
+            self.client.update_many(uuids, [{'test': 'Updated'}])
+
+    def test_delete_many(self):
+        self.client.add(
+            collection='test',
+            texts=['test', 'test2', 'test3'],
+            embeddings=[[1.0, 2.0, 3.0], [1.0, 5.0, 63.0], [71.0, 2.0, 1.0]],
+        )
+        uuids = [document['uuid'] for document in self.client.get_documents(collection='test')] # type: ignore
+
+        self.client.delete_many(uuids[:2] + ['missing'])
+
+        self.assertEqual([document['uuid'] for document in self.client.get_documents(collection='test')], uuids[2:]) # type: ignore
+
     def test_embeddings_creation(self):
         self.client.add(
             collection='test',
@@ -140,4 +313,76 @@ class TestVerusClient(unittest.TestCase):
         self.assertIsInstance(result, list)
         self.assertEqual(len(result), 3) # type: ignore
         self.assertEqual(result[0]['collection'], 'test') # type: ignore
-        
\ No newline at end of file
+        
+    def test_query_cache(self):
+        settings = Settings(engine='polars', cache={'max_size': 16})
+        client = VerusClient(settings)
+        client.add(
+            collection='test',
+            texts=['test', 'test2'],
+            embeddings=[[1.0, 2.0, 3.0], [1.0, 5.0, 63.0]],
+            metadata=[{'test': 'test'}, {'test': 'test2'}]
+        )
+
+        first = client.search(embedding=[1.0, 2.0, 3.0], collection='test')
+        second = client.search(embedding=[1.0, 2.0, 3.0], collection='test')
+        self.assertIs(first, second)
+        self.assertEqual(client.cache_stats()['hits'], 1) # type: ignore
+
+        client.add(collection='test', texts=['test3'], embeddings=[[71.0, 2.0, 1.0]], metadata=[{'test': 'test3'}])
+        self.assertEqual(len(client.search(embedding=[1.0, 2.0, 3.0], collection='test')), 3) # type: ignore
+        self.assertEqual(client.cache_stats()['hits'], 1) # type: ignore
+
+    def test_query_cache_settings(self):
+        self.assertIsNone(VerusClient(Settings(engine='polars', cache=False)).cache)
+        self.assertIsNone(VerusClient(Settings(engine='polars')).cache)
+        self.assertIsNotNone(VerusClient(Settings(engine='polars', cache=True)).cache)
+        # an empty dict keeps the defaults like True
+        self.assertIsNotNone(VerusClient(Settings(engine='polars', cache={})).cache)
+
+    def test_stats(self):
+        self.client.add(
+            collection='test',
+            texts=['test', 'test2', 'test3'],
+            embeddings=[[1.0, 2.0, 3.0], [1.0, 5.0, 63.0], [71.0, 2.0, 1.0]],
+            metadata=[{'test': 'test'}, {'test': 'test2'}, {'test': 'test3'}]
+        )
+        self.client.add(collection='other', texts=['other'], embeddings=[[1.0, 2.0, 3.0]])
+
+        stats = self.client.stats()
+
+        self.assertEqual(stats['documents'], 4)
+        self.assertEqual(stats['dimensions'], 3)
+        self.assertEqual(stats['chunks'], 2)
+        self.assertEqual(stats['collections']['test'], {'documents': 3, 'bytes': {'vectors': 72, 'text': 14, 'metadata': 14}})
+        self.assertEqual(stats['collections']['other']['documents'], 1)
+        self.assertGreaterEqual(stats['bytes']['total'], stats['bytes']['vectors'] + stats['bytes']['text'])
+
+        self.client.save()
+        streaming = VerusClient(Settings(folder='tests/data', engine='polars', polars={'streaming': True}))
+        stats = streaming.stats()
+        self.assertEqual(stats['documents'], 4)
+        self.assertEqual({name: collection['documents'] for name, collection in stats['collections'].items()}, {'test': 3, 'other': 1})
+
+    def test_streaming_search(self):
+        with tempfile.TemporaryDirectory() as folder:
+            client = VerusClient(Settings(folder=folder, engine='polars', polars={'row_group_size': 2}))
+            client.add(
+                collection='test',
+                texts=['test', 'test2', 'test3'],
+                embeddings=[[1.0, 2.0, 3.0], [1.0, 5.0, 63.0], [71.0, 2.0, 1.0]],
+                metadata=[{'test': 'test'}, {'test': 'test2'}, {'test': 'test3'}]
+            )
+            client.add(collection='other', texts=['other'], embeddings=[[1.0, 2.0, 3.0]], metadata=[{'test': 'test'}])
+            client.save()
+            expected = client.search(embedding=[1.0, 2.0, 3.0], collection='test', top_k=2)
+
+            streaming = VerusClient(Settings(folder=folder, engine='polars', polars={'streaming': True, 'batch_size': 1}))
+            temp = streaming.search(embedding=[1.0, 2.0, 3.0], collection='test', top_k=2)
+
+            self.assertListEqual([doc['uuid'] for doc in temp], [doc['uuid'] for doc in expected]) # type: ignore
+            self.assertEqual(len(streaming.search(embedding=[1.0, 2.0, 3.0], collection='test', filters={'test': 'test3'})), 1) # type: ignore
+            self.assertEqual(len(streaming.get_documents(collection='other')), 1) # type: ignore
+
+            with self.assertRaises(NotImplementedError):
+                streaming.add(collection='test', texts=['test4'], embeddings=[[1.0, 1.0, 1.0]], metadata=[{'test': 'test4'}])
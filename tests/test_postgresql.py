@@ -5,6 +5,7 @@ import numpy as np
 from verusdb.settings import Settings
 from verusdb.client import VerusClient
 from verusdb.embeddings.openai import OpenAIEmbeddingsEngine
+from verusdb.filters import Range
 
 def generate_fake_embeddings(length):
     
@@ -52,6 +53,30 @@ class TestVerusPostgreSQLClient(unittest.TestCase):
         
         self.assertEqual(len(self.client.get_documents(collection='test')), 1) # type: ignore
         
+    def test_add_quotes(self):
+        # the values are sent as parameters, an apostrophe does not end the string
+        self.client.add(
+            collection='test',
+            texts=["it's a test'); DROP TABLE verusdb; --"],
+            embeddings=[generate_fake_embeddings(self.dimensions)],
+            metadata=[{'author': "O'Brien"}]
+        )
+
+        documents = self.client.get_documents(collection='test')
+        self.assertEqual(documents[0]['text'], "it's a test'); DROP TABLE verusdb; --") # type: ignore
+        self.assertEqual(documents[0]['metadata'], {'author': "O'Brien"}) # type: ignore
+
+    def test_dedup_requires_unique_uuids(self):
+        embedding = generate_fake_embeddings(self.dimensions)
+        cursor = self.client.engine.connection.cursor() # type: ignore
+        # left behind by an earlier client with dedup
+        cursor.execute("DROP INDEX IF EXISTS verusdb_uuid_key;")
+        cursor.execute(f"INSERT INTO verusdb (uuid, collection, text, metadata, embeddings) VALUES ('same', 'test', 'a', '{{}}', '{embedding}'), ('same', 'test', 'b', '{{}}', '{embedding}');")
+        self.client.engine.connection.commit() # type: ignore
+
+        with self.assertRaisesRegex(ValueError, 'deduplicate'):
+            VerusClient(Settings(engine='postgres', postgres=self.settings.options['postgres'], embeddings=self.settings.embeddings, dedup=True)).engine.load()
+
     def test_search_with_embedding(self):
         
         embedding = generate_fake_embeddings(self.dimensions)
@@ -81,4 +106,99 @@ class TestVerusPostgreSQLClient(unittest.TestCase):
         self.assertEqual(len(temp), 2) # type: ignore
         self.assertEqual(temp[0]['collection'], 'test_search_with_text') # type: ignore
                 
-        
\ No newline at end of file
+        
+    def test_search_with_multiple_filters(self):
+        
+        embedding = generate_fake_embeddings(self.dimensions)
+        self.client.add(
+            collection='test',
+            texts=['test', 'test2', 'test3'],
+            embeddings=[embedding, embedding, embedding],
+            metadata=[{'source': 'a', 'pages': '1'}, {'source': 'a', 'pages': '2'}, {'source': 'b', 'pages': '1'}]
+        )
+        
+        temp = self.client.search(embedding=embedding, collection='test', filters={'source': 'a', 'pages': '1'})
+        
+        self.assertEqual(len(temp), 1) # type: ignore
+        self.assertEqual(temp[0]['text'], 'test') # type: ignore
+
+    def test_range_mixed_values(self):
+        # a value that is not a number is left out, as with the polars engine, instead of failing the query
+        self.client.add(
+            collection='test',
+            texts=['three', 'unknown', 'ten'],
+            embeddings=[generate_fake_embeddings(self.dimensions) for _ in range(3)],
+            metadata=[{'pages': '3'}, {'pages': 'n/a'}, {'pages': '10'}]
+        )
+
+        results = self.client.search(embedding=generate_fake_embeddings(self.dimensions), collection='test', filters=Range('pages', gte=4))
+        self.assertEqual([document['text'] for document in results], ['ten']) # type: ignore
+
+    def test_iter_documents(self):
+        
+        self.client.add(
+            collection='test',
+            texts=['test', 'test2', 'test3'],
+            embeddings=[generate_fake_embeddings(self.dimensions) for _ in range(3)],
+        )
+        
+        documents = list(self.client.iter_documents(collection='test', itersize=2))
+        
+        self.assertEqual(len(documents), 3)
+        self.assertNotIn('embeddings', documents[0])
+        self.assertEqual(len(list(self.client.iter_documents(collection='test', after=documents[0]['uuid']))), 2)
+
+    def test_update_and_delete_many(self):
+
+        self.client.add(
+            collection='test',
+            texts=['test', 'test2', 'test3'],
+            embeddings=[generate_fake_embeddings(self.dimensions) for _ in range(3)],
+            metadata=[{'test': 'test'}, {'test': 'test2'}, {'test': 'test3'}]
+        )
+        uuids = [document['uuid'] for document in self.client.get_documents(collection='test')] # type: ignore
+
+        self.assertEqual(self.client.update(uuids[0], {'test': 'First'})['metadata'], {'test': 'First'}) # type: ignore
+
+        self.client.update_many(uuids, [{'test': 'Updated'}] * 3)
+        self.assertEqual(self.client.get_document(uuid=uuids[0])['metadata'], {'test': 'Updated'}) # type: ignore
+
+        self.client.delete_many(uuids[:2])
+        self.assertEqual(len(self.client.get_documents(collection='test')), 1) # type: ignore
+
+    def test_keyword_search_unsupported(self):
+        with self.assertRaisesRegex(ValueError, 'requires the polars engine with keywords enabled'):
+            self.client.search(embedding=generate_fake_embeddings(self.dimensions), collection='test', keyword='test')
+
+    def test_stats(self):
+
+        self.client.add(
+            collection='test',
+            texts=['test', 'test2'],
+            embeddings=[generate_fake_embeddings(self.dimensions) for _ in range(2)],
+        )
+
+        stats = self.client.stats()
+
+        self.assertEqual(stats['dimensions'], self.dimensions)
+        self.assertIn('test', stats['collections'])
+        self.assertGreater(stats['bytes']['total'], 0)
+
+    def test_stats_rare_collections(self):
+        engine = self.client.engine
+        cursor = engine.connection.cursor() # type: ignore
+
+        # keeps a single most common value, the other collections are only in the exact count
+        cursor.execute('ALTER TABLE verusdb ALTER COLUMN collection SET STATISTICS 1;')
+        self.addCleanup(lambda: (cursor.execute('ALTER TABLE verusdb ALTER COLUMN collection SET STATISTICS -1;'), engine.connection.commit())) # type: ignore
+
+        self.client.add(collection='test', texts=[f'test{i}' for i in range(20)], embeddings=[generate_fake_embeddings(self.dimensions) for _ in range(20)])
+        self.client.add(collection='rare1', texts=['rare'], embeddings=[generate_fake_embeddings(self.dimensions)])
+        self.client.add(collection='rare2', texts=['rare'], embeddings=[generate_fake_embeddings(self.dimensions)])
+
+        cursor.execute('ANALYZE verusdb;')
+        engine.connection.commit() # type: ignore
+
+        collections = self.client.stats()['collections']
+        self.assertEqual({name: collections[name]['documents'] for name in ('rare1', 'rare2')}, {'rare1': 1, 'rare2': 1})
+        self.assertEqual(collections['test']['documents'], 20)
@@ -85,4 +85,111 @@ class TestVerusRedisClient(unittest.TestCase):
         self.assertEqual(temp[0]['collection'], 'test_search_with_text') # type: ignore
                 
         
-       
\ No newline at end of file
+       
+
+    def test_update_and_delete_many(self):
+
+        self.client.add(
+            collection='test',
+            texts=['test', 'test2', 'test3'],
+            embeddings=[generate_fake_embeddings(self.dimensions) for _ in range(3)],
+            metadata=[{'test': 'test'}, {'test': 'test2'}, {'test': 'test3'}]
+        )
+        uuids = [document['uuid'] for document in self.client.get_documents(collection='test')] # type: ignore
+
+        self.client.update_many(uuids, [{'test': 'Updated'}] * 3)
+        self.assertEqual([document['metadata'] for document in self.client.get_documents(collection='test')], [{'test': 'Updated'}] * 3) # type: ignore
+
+        self.client.delete_many(uuids[:2])
+        self.assertEqual(len(self.client.get_documents(collection='test')), 1) # type: ignore
+
+    def test_stats(self):
+
+        self.client.add(
+            collection='test',
+            texts=['test', 'test2'],
+            embeddings=[generate_fake_embeddings(self.dimensions) for _ in range(2)],
+        )
+
+        stats = self.client.stats()
+
+        self.assertEqual(stats['dimensions'], self.dimensions)
+        self.assertIn('test', stats['collections'])
+        self.assertGreater(stats['bytes']['total'], 0)
+
+    def test_keyword_search_unsupported(self):
+        with self.assertRaisesRegex(ValueError, 'requires the polars engine with keywords enabled'):
+            self.client.search(embedding=generate_fake_embeddings(self.dimensions), collection='test', keyword='test')
+
+
+class TestVerusRedisShards(unittest.TestCase):
+    """
+    Needs several redis-stack processes, e.g. REDIS_NODES=localhost:6379,localhost:6380
+    """
+
+    def setUp(self):
+
+        self.settings = Settings(
+            engine='redis',
+            redis={
+                'nodes': os.getenv('REDIS_NODES', 'localhost:6379,localhost:6380').split(','),
+                'prefix': 'doc:',
+                'index': 'verusdb',
+            },
+            embeddings=OpenAIEmbeddingsEngine(
+                api_key=os.getenv('OPENAI_API_KEY', ''),
+                fake=True
+            ),
+        )
+
+        self.client = VerusClient(self.settings)
+        self.dimensions = self.settings.embeddings.get_dimensions() # type: ignore
+
+        self.client.engine.clear()
+        self.client.engine.load()
+
+    def test_search_merges_shards(self):
+
+        embeddings = [generate_fake_embeddings(self.dimensions) for _ in range(30)]
+        self.client.add(
+            collection='test',
+            texts=[f'test{i}' for i in range(30)],
+            embeddings=embeddings,
+        )
+
+        stats = self.client.stats()
+        self.assertEqual(stats['documents'], 30)
+        self.assertEqual(len(stats['shards']), len(self.settings.redis_nodes)) # type: ignore
+
+        # the closest document is found whichever node stores it
+        results = self.client.search(collection='test', embedding=embeddings[7], top_k=5)
+        self.assertEqual(len(results), 5) # type: ignore
+        self.assertEqual(results[0]['text'], 'test7') # type: ignore
+
+        uuid = results[0]['uuid'] # type: ignore
+        self.assertEqual(self.client.get_document(uuid)['text'], 'test7') # type: ignore
+
+        # 30 documents on 2 nodes leave more than the 10 of an unpaged FT.SEARCH on one of them
+        self.client.delete_many([uuid])
+        self.assertEqual(len(self.client.get_documents(collection='test')), 29) # type: ignore
+
+
+class TestVerusRedisRouting(unittest.TestCase):
+
+    def test_nodes(self):
+
+        settings = Settings(engine='redis', redis={'nodes': ['localhost:6379', {'host': 'cache', 'db': 1}]})
+        self.assertEqual(settings.redis_nodes, [{'host': 'localhost', 'port': 6379}, {'host': 'cache', 'db': 1}]) # type: ignore
+
+        with self.assertRaises(ValueError):
+            Settings(engine='redis', redis={'nodes': ['localhost']})
+
+    def test_shard_is_stable(self):
+        from verusdb.engines.redis import RedisEngine
+
+        engine = RedisEngine(Settings(engine='redis', redis={'nodes': ['a:1', 'b:2', 'c:3']}))
+        shards = [engine._shard(f'uuid-{i}') for i in range(300)]
+
+        self.assertEqual(shards, [engine._shard(f'uuid-{i}') for i in range(300)])
+        self.assertEqual(set(shards), {0, 1, 2})
+        self.assertEqual(RedisEngine(Settings(engine='redis', redis={}))._shard('uuid-1'), 0)
@@ -0,0 +1,113 @@
+from __future__ import annotations
+import http.client
+import io
+import json
+import threading
+import unittest
+import numpy as np
+import pyarrow as pa
+from verusdb.settings import Settings
+from verusdb.client import VerusClient
+from verusdb.metrics import InMemoryMetricsSink
+from verusdb.server import ARROW, NPY, VerusServer
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        sink = InMemoryMetricsSink()
+        client = VerusClient(Settings(engine='polars', metrics=sink))
+
+        self.server = VerusServer(client, port=0, workers=2, sink=sink)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        # every request of a test goes through the same keep-alive connection
+        self.connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=5)
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request(self, method: str, path: str, body=None, headers: dict | None = None):
+        if isinstance(body, dict):
+            body = json.dumps(body)
+        self.connection.request(method, path, body=body, headers=headers or {'Content-Type': 'application/json'})
+        response = self.connection.getresponse()
+        return response.status, response.getheader('Content-Type'), response.read()
+
+    def add(self):
+        status, _, _ = self.request('POST', '/add', {
+            'collection': 'test',
+            'texts': ['test', 'test2', 'test3'],
+            'embeddings': [[1.0, 2.0, 3.0], [1.0, 5.0, 63.0], [71.0, 2.0, 1.0]],
+            'metadata': [{'test': 'test'}, {'test': 'test2'}, {'test': 'test3'}],
+        })
+        self.assertEqual(status, 200)
+
+    def test_search(self):
+        self.add()
+
+        status, _, body = self.request('POST', '/search', {'embedding': [70.0, 2.0, 1.0], 'collection': 'test', 'top_k': 2})
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['results'][0]['text'], 'test3')
+
+        status, _, body = self.request('POST', '/search', {'embedding': [1.0, 2.0, 3.0], 'filters': {'test': 'test2'}})
+        self.assertEqual([item['text'] for item in json.loads(body)['results']], ['test2'])
+
+        status, _, body = self.request('POST', '/search', {'embedding': [70.0, 2.0, 1.0], 'collection': 'test', 'deadline_ms': 10000})
+        self.assertTrue(json.loads(body)['complete'])
+
+        status, _, body = self.request('GET', '/health')
+        self.assertEqual(json.loads(body)['status'], 'ok')
+
+    def test_binary_payloads(self):
+        self.add()
+
+        payload = io.BytesIO()
+        np.save(payload, np.array([[70.0, 2.0, 1.0], [1.0, 5.0, 60.0]], dtype=np.float32))
+
+        status, content_type, body = self.request(
+            'POST', '/search_many?collection=test&top_k=1', payload.getvalue(), {'Content-Type': NPY, 'Accept': ARROW}
+        )
+        self.assertEqual((status, content_type), (200, ARROW))
+
+        table = pa.ipc.open_stream(body).read_all()
+        self.assertEqual(table.column('text').to_pylist(), ['test3', 'test2'])
+        self.assertEqual(table.column('query').to_pylist(), [0, 1])
+
+    def test_documents_and_delete(self):
+        self.add()
+
+        status, _, body = self.request('GET', '/documents?collection=test')
+        documents = json.loads(body)['documents']
+        self.assertEqual(len(documents), 3)
+
+        status, _, body = self.request('GET', '/documents/' + documents[0]['uuid'])
+        self.assertEqual(json.loads(body)['text'], documents[0]['text'])
+
+        self.request('POST', '/delete', {'filters': {'test': 'test'}})
+        status, _, body = self.request('GET', '/documents?collection=test')
+        self.assertEqual(len(json.loads(body)['documents']), 2)
+
+        status, _, _ = self.request('GET', '/documents/missing')
+        self.assertEqual(status, 404)
+
+        status, _, body = self.request('GET', '/stats')
+        self.assertEqual(json.loads(body)['collections']['test']['documents'], 2)
+
+    def test_errors_and_metrics(self):
+        status, _, _ = self.request('POST', '/search', {'collection': 'test'})
+        self.assertEqual(status, 400)
+
+        status, _, _ = self.request('GET', '/unknown')
+        self.assertEqual(status, 404)
+
+        status, content_type, body = self.request('GET', '/metrics')
+        self.assertEqual(status, 200)
+        self.assertIn('verusdb_http_4xx_total', body.decode())
+
+
+if __name__ == '__main__':
+    unittest.main()
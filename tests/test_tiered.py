@@ -0,0 +1,161 @@
+from __future__ import annotations
+import unittest
+from verusdb.settings import Settings
+from verusdb.client import VerusClient
+from verusdb.embeddings.openai import OpenAIEmbeddingsEngine
+from verusdb.engines.polars import PolarsEngine
+from verusdb.engines.registry import register_engine, unregister_engine
+from verusdb.engines.tiered import TieredEngine
+
+
+class ScorelessEngine:
+    """
+    Stands in for postgres as the cold tier, its results have no score
+    """
+
+    def __init__(self, settings: Settings):
+        self.engine = PolarsEngine(Settings(engine='polars', embeddings=settings.embeddings))
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def search(self, *args, **kwargs):
+        return [{key: value for key, value in document.items() if key != 'score'} for document in self.engine.search(*args, **kwargs)]
+
+
+class TestTiered(unittest.TestCase):
+
+    def client(self, **tiered) -> VerusClient:
+        # an in-memory polars store stands in for redis or postgres as the cold tier
+        return VerusClient(Settings(
+            engine='tiered',
+            embeddings=OpenAIEmbeddingsEngine(api_key='', fake=True),
+            tiered={'cold': 'polars', 'promote_after': 2, **tiered},
+        ))
+
+    def add(self, client: VerusClient, collection: str, count: int = 3):
+        client.add(
+            collection=collection,
+            texts=[f'{collection} {index}' for index in range(count)],
+            embeddings=[[1.0, float(index), 3.0] for index in range(count)],
+            metadata=[{'index': str(index)} for index in range(count)],
+        )
+
+    def test_promotion(self):
+        client = self.client()
+        engine: TieredEngine = client.engine # type: ignore
+        self.add(client, 'a')
+
+        cold = client.search(embedding=[1.0, 2.0, 3.0], collection='a', top_k=1)
+        client.search(embedding=[1.0, 2.0, 3.0], collection='a', top_k=1)
+        self.assertIn('a', engine.hot)
+
+        hot = client.search(embedding=[1.0, 2.0, 3.0], collection='a', top_k=1)
+        self.assertEqual(hot[0]['uuid'], cold[0]['uuid']) # type: ignore
+        self.assertEqual(client.tier_stats()['a'], {'hits': 1, 'misses': 2, 'hit_rate': 1 / 3, 'promotions': 1, 'evictions': 0, 'hot': True, 'size': engine.hot['a'].store.estimated_size()}) # type: ignore
+
+    def test_writes(self):
+        client = self.client()
+        engine: TieredEngine = client.engine # type: ignore
+        self.add(client, 'a')
+        for _ in range(2):
+            client.search(embedding=[1.0, 2.0, 3.0], collection='a')
+
+        # updates and deletes reach both tiers
+        uuid = client.search(embedding=[1.0, 2.0, 3.0], collection='a', top_k=1)[0]['uuid'] # type: ignore
+        self.assertEqual(client.update(uuid, {'index': 'updated'})['metadata'], {'index': 'updated'}) # type: ignore
+        client.delete_many([client.search(embedding=[1.0, 0.0, 3.0], collection='a', top_k=1)[0]['uuid']]) # type: ignore
+        results = client.search(embedding=[1.0, 2.0, 3.0], collection='a')
+        self.assertEqual(len(results), 2) # type: ignore
+        self.assertEqual(results[0]['metadata']['index'], 'updated') # type: ignore
+        self.assertEqual(len(client.get_documents(collection='a')), 2) # type: ignore
+
+        # an add drops the hot copy, the collection is promoted again once searched enough
+        self.add(client, 'a', 1)
+        self.assertNotIn('a', engine.hot)
+        for _ in range(2):
+            client.search(embedding=[1.0, 2.0, 3.0], collection='a')
+        self.assertEqual(len(engine.hot['a'].store), 3)
+
+    def test_eviction(self):
+        client = self.client(memory_budget_mb=0.0005, policy='lru')
+        engine: TieredEngine = client.engine # type: ignore
+
+        for collection in ('a', 'b'):
+            self.add(client, collection)
+            for _ in range(2):
+                client.search(embedding=[1.0, 2.0, 3.0], collection=collection)
+
+        # both copies do not fit, the least recently searched one is dropped
+        self.assertEqual(list(engine.hot), ['b'])
+        self.assertEqual(client.tier_stats()['a']['evictions'], 1) # type: ignore
+
+    def test_stats(self):
+        client = self.client()
+        self.add(client, 'a')
+        for _ in range(2):
+            client.search(embedding=[1.0, 2.0, 3.0], collection='a')
+
+        stats = client.stats()
+        self.assertEqual(stats['engine'], 'tiered (polars)')
+        self.assertEqual(stats['collections']['a']['documents'], 3)
+        self.assertEqual(stats['tiers']['a']['misses'], 2)
+        self.assertGreater(stats['bytes']['hot'], 0)
+
+    def test_keyword_search(self):
+        with self.assertRaisesRegex(ValueError, 'requires the polars engine with keywords enabled'):
+            client = self.client()
+            self.add(client, 'a')
+            client.search(embedding=[1.0, 2.0, 3.0], collection='a', keyword='a')
+
+        client = VerusClient(Settings(
+            engine='tiered',
+            embeddings=OpenAIEmbeddingsEngine(api_key='', fake=True),
+            tiered={'cold': 'polars'},
+            polars={'keywords': True},
+        ))
+        self.add(client, 'a')
+        self.add(client, 'b')
+
+        results = client.search(embedding=[1.0, 2.0, 3.0], keyword='b')
+        self.assertEqual({document['collection'] for document in results}, {'b'}) # type: ignore
+
+    def test_same_shape_in_both_tiers(self):
+        register_engine('scoreless', ScorelessEngine)
+        self.addCleanup(unregister_engine, 'scoreless')
+
+        client = self.client(cold='scoreless')
+        self.add(client, 'a')
+
+        cold = client.search(embedding=[1.0, 2.0, 3.0], collection='a', top_k=2)
+        client.search(embedding=[1.0, 2.0, 3.0], collection='a', top_k=2)
+        self.assertIn('a', client.engine.hot) # type: ignore
+
+        hot = client.search(embedding=[1.0, 2.0, 3.0], collection='a', top_k=2)
+        self.assertEqual(hot, cold)
+        self.assertNotIn('score', hot[0]) # type: ignore
+
+        hot = client.search(embedding=[1.0, 2.0, 3.0], collection='a', top_k=2, result_format='polars')
+        self.assertNotIn('score', hot.columns) # type: ignore
+
+        # a polars cold tier keeps its scores
+        client = self.client()
+        self.add(client, 'a')
+        cold = client.search(embedding=[1.0, 2.0, 3.0], collection='a', top_k=2)
+        client.search(embedding=[1.0, 2.0, 3.0], collection='a', top_k=2)
+        self.assertEqual(client.search(embedding=[1.0, 2.0, 3.0], collection='a', top_k=2), cold)
+        self.assertIn('score', cold[0]) # type: ignore
+
+    def test_settings(self):
+        with self.assertRaises(ValueError):
+            Settings(engine='tiered', tiered={'cold': 'tiered'})
+
+        with self.assertRaises(ValueError):
+            Settings(engine='tiered', tiered={'cold': 'polars', 'policy': 'fifo'})
+
+        with self.assertRaises(ValueError):
+            Settings(engine='tiered', tiered={'cold': 'redis'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+from __future__ import annotations
+import tempfile
+import unittest
+from verusdb.settings import Settings
+from verusdb.client import VerusClient
+from verusdb.cli import main
+from verusdb.embeddings.openai import OpenAIEmbeddingsEngine
+from verusdb.engines.transfer import EXPORT_SCHEMA
+
+
+class TestTransfer(unittest.TestCase):
+
+    def client(self, folder: str | None = None, **kwargs) -> VerusClient:
+        return VerusClient(Settings(
+            folder=folder,
+            engine='polars',
+            embeddings=OpenAIEmbeddingsEngine(api_key='', fake=True),
+            **kwargs
+        ))
+
+    def add(self, client: VerusClient):
+        client.add(
+            collection='test',
+            texts=['test', 'test2', 'test3'],
+            embeddings=[[1.0, 2.0, 3.0], [1.0, 5.0, 63.0], [71.0, 2.0, 1.0]],
+            metadata=[{'test': 'test'}, {'test': 'test2'}, {'test': 'test3'}]
+        )
+        client.add(collection='other', texts=['other'], embeddings=[[0.0, 1.0, 0.0]])
+
+    def test_export(self):
+        client = self.client()
+        self.add(client)
+
+        batches = list(client.export('test', batch_size=2))
+
+        self.assertEqual([batch.num_rows for batch in batches], [2, 1])
+        self.assertEqual(batches[0].schema, EXPORT_SCHEMA)
+        self.assertEqual(batches[0].to_pylist()[0]['metadata'], [('test', 'test')])
+        self.assertEqual(len(batches[0].to_pylist()[0]['embedding']), 3)
+
+    def test_import_keeps_uuids(self):
+        source = self.client()
+        self.add(source)
+        target = self.client()
+
+        # a batch holding several collections is split on import
+        self.assertEqual(target.import_batches(source.export(batch_size=3)), 4)
+
+        for collection in ('test', 'other'):
+            self.assertEqual(
+                [(document['uuid'], document['metadata']) for document in target.get_documents(collection=collection)], # type: ignore
+                [(document['uuid'], document['metadata']) for document in source.get_documents(collection=collection)], # type: ignore
+            )
+
+        self.assertEqual(
+            target.search(embedding=[1.0, 2.0, 3.0], collection='test', top_k=1)[0]['uuid'], # type: ignore
+            source.search(embedding=[1.0, 2.0, 3.0], collection='test', top_k=1)[0]['uuid'], # type: ignore
+        )
+
+    def test_import_is_logged(self):
+        source = self.client()
+        self.add(source)
+
+        with tempfile.TemporaryDirectory() as folder:
+            target = self.client(folder, polars={'wal': True, 'checkpoint_interval': None})
+            target.import_batches(source.export('test'))
+
+            # replayed from the write-ahead log, the store was never saved
+            self.assertEqual(len(self.client(folder, polars={'wal': True}).get_documents(collection='test')), 3) # type: ignore
+            target.close()
+
+    def test_migrate(self):
+        with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as target:
+            client = self.client(source)
+            self.add(client)
+            client.save()
+
+            main(['migrate', '--source', 'polars', '--source-folder', source, '--target', 'polars', '--target-folder', target, '--collection', 'test', '--batch-size', '2'])
+
+            migrated = self.client(target).get_documents(collection='test')
+            self.assertEqual([document['uuid'] for document in migrated], [document['uuid'] for document in client.get_documents(collection='test')]) # type: ignore
+            self.assertEqual(self.client(target).get_documents(collection='other'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
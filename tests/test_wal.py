@@ -0,0 +1,116 @@
+from __future__ import annotations
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from verusdb.settings import Settings
+from verusdb.client import VerusClient
+from verusdb.engines.wal import WriteAheadLog
+
+
+class TestWriteAheadLog(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def client(self, **polars) -> VerusClient:
+        return VerusClient(Settings(
+            folder=self.folder.name,
+            engine='polars',
+            polars={'wal': True, 'checkpoint_interval': None, **polars}
+        ))
+
+    def add(self, client: VerusClient):
+        client.add(
+            collection='test',
+            texts=['test', 'test2', 'test3'],
+            embeddings=[[1.0, 2.0, 3.0], [1.0, 5.0, 63.0], [71.0, 2.0, 1.0]],
+            metadata=[{'test': 'test'}, {'test': 'test2'}, {'test': 'test3'}]
+        )
+
+    def test_replay_without_save(self):
+        client = self.client()
+        self.add(client)
+        uuid = client.get_documents(collection='test')[0]['uuid']
+        client.update(uuid=uuid, metadata={'test': 'Updated'}) # type: ignore
+        client.delete(filters={'test': 'test3'})
+
+        # a new process that never saw a save sees every acknowledged write
+        reloaded = self.client()
+        self.assertEqual(len(reloaded.get_documents(collection='test')), 2)
+        self.assertEqual(reloaded.get_document(uuid=uuid)['metadata']['test'], 'Updated') # type: ignore
+        self.assertEqual(
+            reloaded.search(embedding=[1.0, 2.0, 3.0], collection='test', top_k=1)[0]['text'], # type: ignore
+            client.search(embedding=[1.0, 2.0, 3.0], collection='test', top_k=1)[0]['text'] # type: ignore
+        )
+
+    def test_replay_bulk_writes(self):
+        client = self.client()
+        self.add(client)
+        uuids = [document['uuid'] for document in client.get_documents(collection='test')]
+        client.update_many(uuids[:2], [{'test': 'Updated'}, {'test': 'Updated'}])
+        client.delete_many(uuids[2:])
+
+        reloaded = self.client()
+        self.assertEqual([document['metadata']['test'] for document in reloaded.get_documents(collection='test')], ['Updated', 'Updated'])
+
+    def test_checkpoint(self):
+        client = self.client()
+        self.add(client)
+        client.save()
+        client.delete(filters={'test': 'test'})
+
+        wal = WriteAheadLog(self.folder.name)
+        # only the segment written after the snapshot is left
+        self.assertEqual(len(wal.segments()), 1)
+        self.assertEqual([header['op'] for header, _ in wal.replay()], ['delete'])
+        self.assertFalse(os.path.exists(os.path.join(self.folder.name, 'verusdb.parquet.tmp')))
+
+        client.close()
+        self.assertEqual(len(self.client().get_documents(collection='test')), 2)
+
+    def test_torn_record(self):
+        client = self.client()
+        self.add(client)
+
+        wal = WriteAheadLog(self.folder.name)
+        path = wal.path(wal.segment)
+        size = os.path.getsize(path)
+
+        # a crash in the middle of the next record
+        with open(path, 'ab') as file:
+            file.write(b'\x10\x00\x00\x00partial')
+
+        self.assertEqual(len(self.client().get_documents(collection='test')), 3)
+        self.assertEqual(os.path.getsize(path), size)
+
+    def test_concurrent_writes(self):
+        client = self.client()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda _: self.add(client), range(16)))
+
+        self.assertEqual(len(self.client().get_documents(collection='test')), 48)
+
+    def test_background_checkpoint(self):
+        client = self.client(checkpoint_interval=0.05)
+        self.add(client)
+        client.engine.checkpoint() # type: ignore
+        client.close()
+
+        self.assertTrue(os.path.exists(os.path.join(self.folder.name, 'verusdb.parquet')))
+        self.assertEqual(len(self.client().get_documents(collection='test')), 3)
+
+    def test_settings(self):
+        with self.assertRaises(ValueError):
+            Settings(engine='polars', polars={'wal': True})
+
+        with self.assertRaises(ValueError):
+            self.client(sync='sometimes')
+
+
+if __name__ == '__main__':
+    unittest.main()
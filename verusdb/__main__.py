@@ -0,0 +1,3 @@
+from verusdb.cli import main
+
+main()
@@ -0,0 +1,136 @@
+# Description: Query result cache for the VerusClient
+from __future__ import annotations
+import hashlib
+import json
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+# returned by QueryCache.get when the key is not cached, None is a valid cached value
+MISS = object()
+
+
+class QueryCache:
+    """
+    LRU cache of search results with an optional time to live.
+
+    Every key embeds the write version of its collection, writes bump the
+    version so results computed before a write are never served again and
+    simply age out of the LRU. The last result of every query is also kept
+    apart, whatever its version, for ``get_stale``.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float | None = None):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.__entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self.__latest: OrderedDict[str, object] = OrderedDict()
+        self.__versions: dict[str | None, int] = {}
+        self.__epoch = 0
+        self.__lock = threading.Lock()
+
+    def key(
+        self,
+        text: str | None = None,
+        embedding: list[float] | None = None,
+        collection: str | None = None,
+        filters: dict[str, str] | None = None,
+        top_k: int = 10,
+        **options,
+    ) -> str:
+        """
+        Hash a query, followed by the current write version of its collection
+        """
+        digest = hashlib.blake2b(digest_size=20)
+
+        if text is not None:
+            digest.update(b't' + text.encode('utf-8'))
+        else:
+            digest.update(b'e' + array('d', embedding).tobytes())  # type: ignore
+
+        with self.__lock:
+            version = (self.__epoch, self.__versions.get(collection, 0))
+
+        normalized = json.dumps(
+            [collection, filters, top_k, options], sort_keys=True, default=str
+        )
+        digest.update(normalized.encode('utf-8'))
+
+        return f'{digest.hexdigest()}:{version[0]}.{version[1]}'
+
+    def get(self, key: str):
+        with self.__lock:
+            entry = self.__entries.get(key)
+
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self.__entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return MISS
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, value):
+        with self.__lock:
+            self.__entries[key] = (time.monotonic(), value)
+            self.__entries.move_to_end(key)
+
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+            query = key.partition(':')[0]
+            self.__latest[query] = value
+            self.__latest.move_to_end(query)
+
+            if len(self.__latest) > self.max_size:
+                self.__latest.popitem(last=False)
+
+    def get_stale(self, key: str):
+        """
+        The last result stored for the query of ``key`` whatever its write version, MISS when there is none
+        """
+        with self.__lock:
+            return self.__latest.get(key.partition(':')[0], MISS)
+
+    def invalidate(self, collection: str | None = None):
+        """
+        Bump the write version of a collection, or of every collection when it is not known
+        """
+        with self.__lock:
+            if collection is None:
+                self.__epoch += 1
+                return
+
+            self.__versions[collection] = self.__versions.get(collection, 0) + 1
+            # searches without a collection span all of them
+            self.__versions[None] = self.__versions.get(None, 0) + 1
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__latest.clear()
+            self.__epoch += 1
+
+    def stats(self) -> dict[str, float | int | None]:
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'size': len(self.__entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+            }
@@ -0,0 +1,105 @@
+# Description: Command line interface for VerusDB
+#
+# verusdb serve --folder data --engine polars --port 8000
+# verusdb migrate --source polars --source-folder data --target postgres --target-settings '{"postgres": {...}}'
+from __future__ import annotations
+import argparse
+import json
+import os
+from itertools import chain
+from verusdb.settings import Settings
+from verusdb.engines.registry import available_engines
+
+
+def build_settings(args, metrics=None) -> Settings:
+    """
+    Settings from the command line, --settings holds any other keyword argument as JSON
+    """
+    kwargs = json.loads(args.settings) if args.settings else {}
+    embeddings = None
+
+    api_key = args.openai_api_key or os.getenv('OPENAI_API_KEY')
+    if api_key:
+        from verusdb.embeddings.openai import OpenAIEmbeddingsEngine
+
+        embeddings = OpenAIEmbeddingsEngine(api_key=api_key)
+
+        # concurrent text searches share one request to the embeddings api
+        kwargs.setdefault('batching', {'max_wait_ms': args.batch_wait_ms})
+
+    return Settings(folder=args.folder, engine=args.engine, embeddings=embeddings, metrics=metrics, **kwargs)
+
+
+def serve(args):
+    from verusdb.client import VerusClient
+    from verusdb.metrics import InMemoryMetricsSink
+    from verusdb.server import serve as run
+
+    sink = InMemoryMetricsSink()
+    client = VerusClient(build_settings(args, sink))
+
+    print(f'verusdb serving the {args.engine} engine on http://{args.host}:{args.port}', flush=True)
+    run(client, args.host, args.port, args.workers, sink)
+
+
+def migrate(args):
+    from verusdb.client import VerusClient
+
+    source = VerusClient(Settings(
+        folder=args.source_folder, engine=args.source, **(json.loads(args.source_settings) if args.source_settings else {})
+    ))
+    batches = source.export(args.collection, args.batch_size)
+
+    # the target creates its index or table with the dimensions of the exported embeddings
+    first = next(batches, None)
+    if first is None:
+        print('verusdb migrate: nothing to migrate', flush=True)
+        source.close()
+        return
+
+    target_settings = json.loads(args.target_settings) if args.target_settings else {}
+    target_settings.setdefault('dimensions', len(first.column('embedding')[0]))
+    target = VerusClient(Settings(folder=args.target_folder, engine=args.target, **target_settings))
+
+    imported = target.import_batches(chain([first], batches))
+
+    if target.settings.engine == 'polars' and target.settings.persist:
+        target.save()
+
+    target.close()
+    source.close()
+    print(f'verusdb migrate: {imported} documents moved from {args.source} to {args.target}', flush=True)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog='verusdb', description='VerusDB command line interface')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    server = commands.add_parser('serve', help='serve a VerusClient over HTTP')
+    server.add_argument('--engine', default='polars', choices=available_engines())
+    server.add_argument('--folder', default=None, help='folder of the polars store')
+    server.add_argument('--host', default='127.0.0.1')
+    server.add_argument('--port', type=int, default=8000)
+    server.add_argument('--workers', type=int, default=None, help='worker threads, twice the number of cores by default')
+    server.add_argument('--settings', default=None, help='extra Settings keyword arguments as JSON, e.g. redis or postgres connection settings')
+    server.add_argument('--openai-api-key', default=None, help='enables text search, defaults to OPENAI_API_KEY')
+    server.add_argument('--batch-wait-ms', type=float, default=5, help='time window to batch the encodes of concurrent text searches')
+    server.set_defaults(handler=serve)
+
+    migration = commands.add_parser('migrate', help='copy documents and embeddings from one engine to another, keeping their uuids')
+    migration.add_argument('--source', required=True, choices=available_engines())
+    migration.add_argument('--source-folder', default=None, help='folder of a polars source')
+    migration.add_argument('--source-settings', default=None, help='extra Settings keyword arguments of the source as JSON')
+    migration.add_argument('--target', required=True, choices=available_engines())
+    migration.add_argument('--target-folder', default=None, help='folder of a polars target')
+    migration.add_argument('--target-settings', default=None, help='extra Settings keyword arguments of the target as JSON')
+    migration.add_argument('--collection', default=None, help='collection to migrate, every collection by default')
+    migration.add_argument('--batch-size', type=int, default=1000, help='documents per record batch, bounds the memory used')
+    migration.set_defaults(handler=migrate)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,12 @@
 from __future__ import annotations
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from verusdb.settings import Settings
-from verusdb.engines.polars import PolarsEngine
-from verusdb.engines.redis import RedisEngine
-from verusdb.engines.postgresql import PostgreSQLEngine
+from verusdb.cache import QueryCache, MISS
+from verusdb.deadline import Deadline
+from verusdb.filters import Filter
+from verusdb.ingest import IngestPipeline, IngestProgress
+from verusdb.engines.registry import get_engine
 
 
 class VerusClient:
@@ -10,18 +14,18 @@ class VerusClient:
     def __init__(self, settings: Settings):
         self.settings = settings
         self.collection = 'verusdb'
+        self.metrics = settings.metrics
+        self.cache = QueryCache(**settings.cache) if settings.cache is not None else None
         
-        if self.settings.engine == 'redis':
-            self.engine = RedisEngine(settings)
-            
-        if self.settings.engine == 'polars':
-            self.engine = PolarsEngine(settings)
-            
-        if self.settings.engine == 'postgres':
-            self.engine = PostgreSQLEngine(settings)
-            
-            
-        self.engine.load()
+        # only the driver of the configured engine is imported
+        self.engine = get_engine(self.settings.engine)(settings)
+
+        # encodes query texts for searches with a deadline, started on the first of them
+        self.__encoder: ThreadPoolExecutor | None = None
+        self.__encoder_lock = threading.Lock()
+
+        with self.metrics.span('load'):
+            self.engine.load()
         
 
     
@@ -36,11 +40,79 @@ class VerusClient:
         if collection is None:
             collection = self.collection
             
-        self.engine.add(texts=texts, collection=collection, embeddings=embeddings, metadata=metadata)
+        with self.metrics.span('add'):
+            self.engine.add(texts=texts, collection=collection, embeddings=embeddings, metadata=metadata)
+
+        self._invalidate(collection)
+
+    def add_stream(self, documents, collection: str | None = None, chunk_size: int = 256, workers: int = 2, max_pending: int = 4, checkpoint: str | None = None, checkpoint_every: int = 10, on_progress=None) -> IngestProgress:
+        """
+        Add documents from an iterable without materializing it
+
+        documents yields texts or dicts with a 'text' and optional 'embedding' and 'metadata'.
+        Chunks of chunk_size documents are encoded by a pool of workers and written in order,
+        with at most workers + max_pending chunks in memory. Every checkpoint_every chunks the
+        polars store is saved and the progress recorded in the checkpoint file, redis and postgres
+        commit every write so their progress is recorded after every chunk. Running add_stream
+        again with the same documents and checkpoint resumes after the last checkpoint, an in-memory
+        polars store keeps nothing to resume from and does not take a checkpoint.
+        """
+        if collection is None:
+            collection = self.collection
+
+        def write(texts, collection, embeddings, metadata, deduplicated):
+            self.engine.add(texts=texts, collection=collection, embeddings=embeddings, metadata=metadata, deduplicated=deduplicated)
+            self._invalidate(collection)
+
+        # redis and postgres commit every write, only the polars store has to be flushed
+        flush = None
+        if (self.settings.tiered_cold or self.settings.engine) == 'polars':
+            if self.settings.persist:
+                flush = self.save if self.settings.engine == 'polars' else self.engine.cold.save  # type: ignore
+            elif checkpoint is not None:
+                raise ValueError('A checkpoint requires a polars store saved to a folder, an in-memory store is lost with the process')
+
+        pipeline = IngestPipeline(
+            write,
+            embeddings=self.settings.embeddings,
+            chunk_size=chunk_size,
+            workers=workers,
+            max_pending=max_pending,
+            checkpoint=checkpoint,
+            checkpoint_every=checkpoint_every,
+            flush=flush,
+            on_progress=on_progress,
+            metrics=self.metrics,
+            deduplicate=self.engine.deduplicate if self.settings.dedup else None,
+        )
+
+        with self.metrics.span('add_stream'):
+            return pipeline.run(documents, collection)
 
-    def search(self, text: str| None = None, collection:str | None =  None, embedding: list[float] | None = None, filters: dict[str, str] | None = None, top_k: int = 10):
+    def search(self, text: str| None = None, collection:str | None =  None, embedding: list[float] | None = None, filters: dict[str, str] | Filter | None = None, top_k: int = 10, result_format: str = 'dicts', deadline_ms: float | None = None, keyword: str | None = None, keyword_mode: str = 'prefilter'):
         """
         Search for similar documents
+
+        result_format can be 'dicts' (default), 'arrow', 'polars' or 'numpy', the columnar formats
+        keep the metadata as a struct column and skip the per row conversion to python objects
+
+        filters is either a dict (equality on every key) or an expression from verusdb.filters,
+        e.g. In('source', ['web', 'pdf']) & Range('pages', gte=3)
+
+        When the query cache is enabled the same result object is returned for repeated
+        queries, it must not be modified in place.
+
+        deadline_ms is a time budget for the whole search. A text not encoded in time is
+        answered with the last cached result of the query, even one computed before a write,
+        or with no documents. The polars engine scores the store in chunks and returns the
+        best documents found when the budget expires, redis and postgres pass it on as a
+        query timeout. The results carry a completeness flag (verusdb.results.is_complete)
+        and incomplete results are not cached.
+
+        keyword is a query of the BM25 index of the texts (polars engine with
+        polars={'keywords': True}). With keyword_mode='prefilter' only the documents
+        containing one of its terms are scored, with 'rrf' the vector and keyword
+        rankings are merged by reciprocal rank fusion and the score is the fused score.
         """
         
         if text is None and embedding is None:
@@ -49,26 +121,202 @@ class VerusClient:
         if text and embedding:
             raise ValueError('Only one of text or embedding must be provided')
 
+        # redis and postgres have no keyword index and do not take the keyword arguments
+        if keyword is not None and getattr(self.engine, 'keywords', None) is None:
+            raise ValueError('Keyword search requires the polars engine with keywords enabled')
+
+        deadline = Deadline(deadline_ms) if deadline_ms is not None else None
+
+        # only passed to the engine when set, engines without a keyword index do not take them
+        options = {} if keyword is None else {'keyword': keyword, 'keyword_mode': keyword_mode}
+
+        key = None
+        if self.cache is not None:
+            # the key embeds the write version of the collection, it has to be taken before searching
+            key = self.cache.key(text, embedding, collection, filters, top_k, result_format=result_format, **options)
+            cached = self.cache.get(key)
+            if cached is not MISS:
+                self.metrics.count('cache_hits', 1, 'search')
+                return cached if deadline is None else _mark_complete(cached, True)
+            self.metrics.count('cache_misses', 1, 'search')
+
+        with self.metrics.span('search'):
+            if deadline is not None:
+                results = self.__search_until(deadline, key, text, collection, embedding, filters, top_k, result_format, options)
+            elif text:
+                results = self.engine.search_text(text, collection, filters, top_k, result_format=result_format, **options)
+            else:
+                if embedding is None:
+                    raise ValueError('Embedding must be provided for the search')        
+            
+                results = self.engine.search(embedding, collection, filters, top_k, result_format=result_format, **options)
+
+        if key is not None and (deadline is None or deadline.complete):
+            self.cache.put(key, results)  # type: ignore
+
+        if deadline is not None:
+            return _mark_complete(results, deadline.complete)
+
+        return results
+
+    def __search_until(self, deadline: Deadline, key: str | None, text, collection, embedding, filters, top_k: int, result_format: str, options: dict):
+        """
+        Search within the time left by the deadline, the engine records in it whether the search was cut short
+        """
         if text:
-            return self.engine.search_text(text, collection, filters, top_k)
-        
-        if embedding is None:
-            raise ValueError('Embedding must be provided for the search')        
-    
-        return self.engine.search(embedding, collection, filters, top_k)
+            embedding = self.__encode(text, deadline)
+
+            if embedding is None:
+                deadline.cut()
+
+                # the last result of the query is better than none, whatever the writes since
+                stale = self.cache.get_stale(key) if self.cache is not None and key is not None else MISS
+                self.metrics.count('deadline_stale_results' if stale is not MISS else 'deadline_empty_results', 1, 'search')
+
+                if stale is not MISS:
+                    return stale
+
+                from verusdb.results import format_frame, frame_from_documents
+                return format_frame(frame_from_documents([]), result_format)
+
+        return self.engine.search(embedding, collection, filters, top_k, result_format=result_format, deadline=deadline, **options)
+
+    def __encode(self, text: str, deadline: Deadline) -> list[float] | None:
+        """
+        Encode a query text on the encoder threads, None when the deadline expires first
+        """
+        if self.settings.embeddings is None:
+            raise ValueError('Embeddings Engine is not set')
+
+        with self.__encoder_lock:
+            if self.__encoder is None:
+                self.__encoder = ThreadPoolExecutor(max_workers=4, thread_name_prefix='verusdb-encode')
+
+        # a late encode finishes in the background, its worker is not interrupted
+        future = self.__encoder.submit(self.settings.embeddings.encode, text)
+
+        with self.metrics.span('search', 'encode'):
+            try:
+                return future.result(timeout=deadline.remaining())
+            except FutureTimeoutError:
+                self.metrics.count('deadline_expired', 1, 'encode')
+                return None
     
+    def search_many(self, texts: list[str] | None = None, collection: str | None = None, embeddings: list[list[float]] | None = None, filters: dict[str, str] | Filter | None = None, top_k: int = 10, result_format: str = 'dicts') -> list:
+        """
+        Search several queries with the same collection and filters at once
+
+        The texts are encoded with a single batched call and engines that support it score
+        every query in one pass over the store. Returns one result per query, in order.
+        The query cache is not used.
+        """
+        if texts is None and embeddings is None:
+            raise ValueError('Either texts or embeddings must be provided')
+
+        if texts is not None and embeddings is not None:
+            raise ValueError('Only one of texts or embeddings must be provided')
+
+        with self.metrics.span('search_many'):
+            if texts is not None:
+                if self.settings.embeddings is None:
+                    raise ValueError('Embeddings Engine is not set')
+
+                with self.metrics.span('search_many', 'encode'):
+                    embeddings = self.settings.embeddings.encode_batch(texts)
+
+            return self.engine.search_many(embeddings, collection, filters, top_k, result_format=result_format)  # type: ignore
+
     def clear(self):
         self.engine.clear()
+        self._invalidate()
     
     def update(self, uuid: str, metadata: dict[str, str]):
-        return self.engine.update(uuid, metadata)
+        result = self.engine.update(uuid, metadata)
+        self._invalidate()
+        return result
+
+    def update_many(self, uuids: list[str], metadata: list[dict[str, str]]):
+        """
+        Replace the metadata of several documents in a single bulk write
+        """
+        if len(uuids) != len(metadata):
+            raise ValueError('uuids and metadata must have the same length')
+
+        with self.metrics.span('update_many'):
+            self.engine.update_many(uuids, metadata)
+        self._invalidate()
+
+    def delete_many(self, uuids: list[str]):
+        """
+        Delete several documents by uuid in a single bulk write
+        """
+        with self.metrics.span('delete_many'):
+            self.engine.delete_many(uuids)
+        self._invalidate()
+
+    def cache_stats(self):
+        """
+        Hit rate and size of the query cache, None when the cache is disabled
+        """
+        return self.cache.stats() if self.cache is not None else None
+
+    def tier_stats(self):
+        """
+        Hits and misses of the hot tier per collection, None when the engine is not tiered
+        """
+        tier_stats = getattr(self.engine, 'tier_stats', None)
+        return tier_stats() if tier_stats is not None else None
+
+    def stats(self) -> dict:
+        """
+        Document counts, dimensions, memory per collection and index sizes reported by the engine
+
+        Every engine returns the same keys: engine, documents, dimensions, dtype, bytes (vectors,
+        text, metadata, index, total), indexes, chunks, tombstone_ratio and collections.
+        """
+        with self.metrics.span('stats'):
+            return self.engine.stats()
+
+    def _invalidate(self, collection: str | None = None):
+        """
+        Bump the write version of a collection so cached results are not served anymore
+        """
+        if self.cache is not None:
+            self.cache.invalidate(collection)
         
 
-    def get_documents(self, collection: str | None = None):
+    def get_documents(self, collection: str | None = None, result_format: str = 'dicts'):
+        if collection is None:
+            collection = self.collection
+        return self.engine.get_documents(collection=collection, result_format=result_format)
+    
+    def iter_documents(self, collection: str | None = None, **kwargs):
+        """
+        Iterate over the documents of a collection without loading all of them at once
+        """
         if collection is None:
             collection = self.collection
-        return self.engine.get_documents(collection=collection)
+        return self.engine.iter_documents(collection=collection, **kwargs)
     
+    def export(self, collection: str | None = None, batch_size: int = 1000):
+        """
+        Iterate over the documents of a collection, embeddings included, as Arrow record batches
+
+        The batches have the uuid, collection, text, metadata and embedding columns, pass them
+        to import_batches of another client to move the documents without encoding them again.
+        """
+        return self.engine.export(collection, batch_size)
+
+    def import_batches(self, batches) -> int:
+        """
+        Store record batches of export, keeping their uuids, and return the number of documents imported
+        """
+        with self.metrics.span('import'):
+            imported = self.engine.import_batches(batches)
+
+        self._invalidate()
+        return imported
+
     def get_document(self, uuid: str):
         return self.engine.get_document(uuid)
 
@@ -77,13 +325,41 @@ class VerusClient:
         Save the dataframe to disk
         """
         if self.settings.engine == 'polars':
-            self.engine.save()
+            with self.metrics.span('save'):
+                self.engine.save()
         else:
             raise NotImplementedError('Save is not implemented for this engine')
 
-    def delete(self, uuid: str| None = None, collection: str | None = None ,filters: dict[str, str]| None = None):
+    def close(self):
+        """
+        Release the resources of the engine and the embeddings engine, e.g. flush the polars
+        write-ahead log to a last checkpoint
+        """
+        close = getattr(self.engine, 'close', None)
+        if close is not None:
+            close()
+
+        # stops the threads or processes of the batching and process pool embeddings engines
+        close = getattr(self.settings.embeddings, 'close', None)
+        if close is not None:
+            close()
+
+        if self.__encoder is not None:
+            self.__encoder.shutdown(wait=False)
+            self.__encoder = None
+
+    def delete(self, uuid: str| None = None, collection: str | None = None ,filters: dict[str, str] | Filter | None = None):
         """
         Delete documents from the dataframe
         """
-        self.engine.delete(uuid=uuid, collection=collection, filters=filters)
+        with self.metrics.span('delete'):
+            self.engine.delete(uuid=uuid, collection=collection, filters=filters)
+
+        # deleting by uuid or filters can touch any collection
+        self._invalidate(collection if uuid is None and filters is None else None)
+
 
+def _mark_complete(results, complete: bool):
+    # results pulls polars in, it is only imported by searches with a deadline
+    from verusdb.results import mark_complete
+    return mark_complete(results, complete)
@@ -0,0 +1,44 @@
+# Description: Time budget of a search
+from __future__ import annotations
+import math
+import time
+
+
+class Deadline:
+    """
+    Time budget of a search, counted from its creation on the monotonic clock.
+
+    Every stage of the search checks the deadline before starting more work and
+    calls ``cut`` when it returns without finishing, the results are then
+    flagged as incomplete.
+    """
+
+    def __init__(self, ms: float):
+        if ms <= 0:
+            raise ValueError('deadline_ms must be positive')
+
+        self.ms = ms
+        self.expires = time.monotonic() + ms / 1000
+        self.complete = True
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
+
+    def remaining(self) -> float:
+        """
+        Seconds left, 0 once the deadline expired
+        """
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def remaining_ms(self) -> int:
+        """
+        Whole milliseconds left, at least 1 as servers read a timeout of 0 as no timeout
+        """
+        return max(math.ceil(self.remaining() * 1000), 1)
+
+    def cut(self):
+        """
+        Record that a stage stopped before it finished
+        """
+        self.complete = False
@@ -11,6 +11,12 @@ class BaseEmbeddingsEngine(ABC):
     def encode(self, text: str) -> list[float]:
         pass
     
+    def encode_batch(self, texts: list[str]) -> list[list[float]]:
+        """
+        Encode several texts, engines whose backend accepts batches should override this
+        """
+        return [self.encode(text) for text in texts]
+
     @abstractmethod
     def get_dimensions(self) -> int:
         pass
\ No newline at end of file
@@ -0,0 +1,143 @@
+from __future__ import annotations
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from verusdb.embeddings import BaseEmbeddingsEngine
+from verusdb.metrics import MetricsRecorder
+
+
+class BatchingEmbeddingsEngine(BaseEmbeddingsEngine):
+    """
+    Coalesce concurrent ``encode`` calls into batched ``encode_batch`` calls.
+
+    Texts arriving within ``max_wait_ms`` of the first pending one, up to
+    ``max_batch_size`` of them, are encoded together by a background thread
+    and every caller gets its own vector back. A single caller only pays the
+    wait, concurrent callers share one request to the embeddings backend.
+    The thread is started by the first encode, call ``close`` to stop it, later
+    encodes call the wrapped engine directly.
+    """
+
+    def __init__(
+        self,
+        engine: BaseEmbeddingsEngine,
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5,
+        metrics: MetricsRecorder | None = None,
+    ):
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be at least 1')
+
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.metrics = metrics or MetricsRecorder()
+
+        # None stops the worker
+        self.__pending: queue.Queue[tuple[str, Future] | None] = queue.Queue()
+        self.__worker: threading.Thread | None = None
+        self.__closed = False
+        self.__lock = threading.Lock()
+
+    def encode(self, text: str) -> list[float]:
+        future: Future = Future()
+
+        # queued under the lock so no text is queued after the stop of the worker
+        with self.__lock:
+            closed = self.__closed
+            if not closed:
+                self.__start()
+                self.__pending.put((text, future))
+
+        if closed:
+            return self.engine.encode_batch([text])[0]
+
+        return future.result()
+
+    def encode_batch(self, texts: list[str]) -> list[list[float]]:
+        # already a batch, nothing to wait for
+        return self.engine.encode_batch(texts)
+
+    def get_dimensions(self) -> int:
+        return self.engine.get_dimensions()
+
+    def close(self):
+        """
+        Stop the background thread once the texts already queued are encoded, and close the wrapped engine
+        """
+        with self.__lock:
+            if self.__closed:
+                return
+            self.__closed = True
+
+            worker = self.__worker
+            if worker is not None:
+                self.__pending.put(None)
+
+        if worker is not None and worker is not threading.current_thread():
+            worker.join()
+
+        close = getattr(self.engine, 'close', None)
+        if close is not None:
+            close()
+
+    def __start(self):
+        # called with the lock held
+        if self.__worker is None:
+            self.__worker = threading.Thread(target=self.__run, name='verusdb-encode-batcher', daemon=True)
+            self.__worker.start()
+
+    def __collect(self) -> tuple[list[tuple[str, Future]], bool]:
+        """
+        Block for the first pending text, then gather more until the batch is full or the window closes,
+        and tell whether the worker was stopped
+        """
+        first = self.__pending.get()
+        if first is None:
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.__pending.get(timeout=remaining) if remaining > 0 else self.__pending.get_nowait()
+            except queue.Empty:
+                break
+
+            # nothing is queued after the stop
+            if item is None:
+                return batch, True
+
+            batch.append(item)
+
+        return batch, False
+
+    def __run(self):
+        stopped = False
+
+        while not stopped:
+            batch, stopped = self.__collect()
+
+            if batch:
+                self.__encode(batch)
+
+    def __encode(self, batch: list[tuple[str, Future]]):
+        self.metrics.count('encode_batches', 1, 'search')
+        self.metrics.count('encode_texts', len(batch), 'search')
+
+        try:
+            vectors = self.engine.encode_batch([text for text, _ in batch])
+
+            # zip would silently leave the callers of the missing vectors waiting forever
+            if len(vectors) != len(batch):
+                raise ValueError(f'The embeddings engine returned {len(vectors)} vectors for {len(batch)} texts')
+        except Exception as error:
+            for _, future in batch:
+                future.set_exception(error)
+            return
+
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
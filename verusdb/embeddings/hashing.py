@@ -0,0 +1,51 @@
+from __future__ import annotations
+import hashlib
+import re
+import numpy as np
+from verusdb.embeddings import BaseEmbeddingsEngine
+
+
+class HashingEmbeddingsEngine(BaseEmbeddingsEngine):
+    """
+    Deterministic embeddings of hashed words and word pairs, for offline tests and benchmarks.
+
+    Every lowercased word, and every pair of consecutive words when ``ngrams``
+    is 2, adds +1 or -1 to one of ``dimensions`` buckets picked by its blake2b
+    hash, then the vector is normalized. Texts sharing words get close vectors
+    and a text gets the same vector in every process, unlike with ``hash()``.
+    """
+
+    def __init__(self, dimensions: int = 384, ngrams: int = 2, seed: int = 0):
+        if dimensions < 1 or ngrams not in (1, 2):
+            raise ValueError('dimensions must be positive and ngrams 1 or 2')
+
+        self.dimensions = dimensions
+        self.ngrams = ngrams
+        self.__key = seed.to_bytes(8, 'little')
+
+    def encode(self, text: str) -> list[float]:
+        return self.encode_array([text])[0].tolist()
+
+    def encode_batch(self, texts: list[str]) -> list[list[float]]:
+        return self.encode_array(texts).tolist()
+
+    def encode_array(self, texts: list[str]) -> np.ndarray:
+        """
+        The embeddings of ``texts`` as a float32 matrix, one row per text
+        """
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+
+        for row, text in enumerate(texts):
+            words = re.findall(r'\w+', text.lower())
+            features = words if self.ngrams == 1 else words + [f'{first} {second}' for first, second in zip(words, words[1:])]
+
+            for feature in features:
+                value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8, key=self.__key).digest(), 'little')
+                # the top bit picks the sign so colliding features tend to cancel out
+                matrix[row, value % self.dimensions] += 1.0 if value >> 63 else -1.0
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def get_dimensions(self) -> int:
+        return self.dimensions
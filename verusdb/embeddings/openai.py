@@ -1,6 +1,5 @@
 from __future__ import annotations
-import openai
-import numpy as np
+import random
 from verusdb.embeddings import BaseEmbeddingsEngine
 
 class OpenAIEmbeddingsEngine(BaseEmbeddingsEngine):
@@ -12,24 +11,52 @@ class OpenAIEmbeddingsEngine(BaseEmbeddingsEngine):
 
         self.__dimensions = 1536
         self.__fake = fake
-        openai.api_key = api_key
-        
-        if type == 'azure':
-            # TODO: add validation in case not all parameters are provided
-            openai.api_type = api_type 
-            openai.api_base = api_base 
-            openai.api_version = api_version 
+        self.__api_key = api_key
+        self.__api_type = api_type
+        self.__api_base = api_base
+        self.__api_version = api_version
+        self.__openai = None
+
+    def __client(self):
+        """
+        Import and configure the openai package on the first real request
+        """
+        if self.__openai is None:
+            import openai
+
+            openai.api_key = self.__api_key
+
+            if self.__api_type == 'azure':
+                # TODO: add validation in case not all parameters are provided
+                openai.api_type = self.__api_type
+                openai.api_base = self.__api_base
+                openai.api_version = self.__api_version
+
+            self.__openai = openai
+
+        return self.__openai
 
     def encode(self, text: str) -> list[float]:
         
         if self.__fake:
-            return np.random.rand(self.__dimensions).tolist()
-        response  = openai.Embedding.create(
+            return [random.random() for _ in range(self.__dimensions)]
+        response  = self.__client().Embedding.create(
             input=text,
             model="text-embedding-ada-002"
         ) 
         return response['data'][0]['embedding'] # type: ignore
 
+    def encode_batch(self, texts: list[str]) -> list[list[float]]:
+
+        if self.__fake:
+            return [[random.random() for _ in range(self.__dimensions)] for _ in texts]
+        response = self.__client().Embedding.create(
+            input=texts,
+            model="text-embedding-ada-002"
+        )
+        # the embeddings are not guaranteed to come back in the input order
+        return [item['embedding'] for item in sorted(response['data'], key=lambda item: item['index'])] # type: ignore
+
     def get_dimensions(self) -> int:
         return self.__dimensions  
 
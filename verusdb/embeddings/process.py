@@ -0,0 +1,136 @@
+from __future__ import annotations
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from typing import Callable
+import numpy as np
+from verusdb.embeddings import BaseEmbeddingsEngine
+
+# the engine of a worker process, built once when the worker starts
+_engine: BaseEmbeddingsEngine | None = None
+
+
+def _start_worker(factory: Callable[[], BaseEmbeddingsEngine]):
+    global _engine
+    _engine = factory()
+
+
+def _dimensions() -> int:
+    return _engine.get_dimensions()  # type: ignore
+
+
+def _encode_into(name: str, shape: tuple[int, int], dtype: str, start: int, texts: list[str]) -> int:
+    """
+    Encode texts in a worker and write their vectors to the rows of the shared matrix starting at ``start``
+    """
+    memory = shared_memory.SharedMemory(name=name)
+
+    try:
+        matrix = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+        matrix[start:start + len(texts)] = np.asarray(_engine.encode_batch(texts), dtype=dtype)  # type: ignore
+        # the view has to be released before the memory is closed
+        del matrix
+    finally:
+        memory.close()
+
+    return len(texts)
+
+
+class ProcessPoolEmbeddingsEngine(BaseEmbeddingsEngine):
+    """
+    Encode texts in a pool of worker processes, for CPU bound local models.
+
+    Every worker builds its own engine once by calling ``factory``, a class or
+    a functools.partial that can be pickled. A batch is split in chunks of
+    ``batch_size`` texts encoded in parallel, the workers write the vectors
+    straight into a shared memory matrix instead of sending them back as
+    pickled lists. The pool is started by the first encode, call ``close`` to
+    stop it.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], BaseEmbeddingsEngine],
+        workers: int | None = None,
+        batch_size: int = 64,
+        dtype: str = 'float32',
+        start_method: str = 'spawn',
+    ):
+        if batch_size < 1:
+            raise ValueError('batch_size must be at least 1')
+
+        self.factory = factory
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.dtype = np.dtype(dtype).name
+        # forking a process that runs threads (batching, checkpoints, the server) can deadlock the child
+        self.start_method = start_method
+
+        self.__pool: ProcessPoolExecutor | None = None
+        self.__dimensions: int | None = None
+        self.__lock = threading.Lock()
+
+    def __start(self) -> ProcessPoolExecutor:
+        with self.__lock:
+            if self.__pool is None:
+                self.__pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=_start_worker,
+                    initargs=(self.factory,),
+                )
+            return self.__pool
+
+    def encode(self, text: str) -> list[float]:
+        return self.encode_array([text])[0].tolist()
+
+    def encode_batch(self, texts: list[str]) -> list[list[float]]:
+        return self.encode_array(texts).tolist()
+
+    def encode_array(self, texts: list[str]) -> np.ndarray:
+        """
+        The embeddings of ``texts`` as a matrix of ``dtype``, one row per text
+        """
+        pool = self.__start()
+        shape = (len(texts), self.get_dimensions())
+
+        if not texts:
+            return np.empty(shape, dtype=self.dtype)
+
+        memory = shared_memory.SharedMemory(create=True, size=shape[0] * shape[1] * np.dtype(self.dtype).itemsize)
+
+        try:
+            futures = [
+                pool.submit(_encode_into, memory.name, shape, self.dtype, start, list(texts[start:start + self.batch_size]))
+                for start in range(0, len(texts), self.batch_size)
+            ]
+
+            # every worker is done with the memory before it is unlinked, even when one of them failed
+            wait(futures)
+            for future in futures:
+                future.result()
+
+            view = np.ndarray(shape, dtype=self.dtype, buffer=memory.buf)
+            matrix = view.copy()
+            del view
+        finally:
+            memory.close()
+            memory.unlink()
+
+        return matrix
+
+    def get_dimensions(self) -> int:
+        if self.__dimensions is None:
+            self.__dimensions = self.__start().submit(_dimensions).result()
+        return self.__dimensions
+
+    def close(self):
+        """
+        Stop the worker processes
+        """
+        with self.__lock:
+            if self.__pool is not None:
+                self.__pool.shutdown()
+                self.__pool = None
@@ -1,11 +1,12 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
+from verusdb.utils import content_uuid, generate_uuid
 
 class BaseEngine(ABC):
 
 
     @abstractmethod
-    def add(self, texts: list[str],  collection: str | None = None, embeddings: list[list[float]] | None = None, metadata: list[dict[str, str]] | None = None):
+    def add(self, texts: list[str],  collection: str | None = None, embeddings: list[list[float]] | None = None, metadata: list[dict[str, str]] | None = None, deduplicated: bool = False):
         pass
 
     @abstractmethod
@@ -20,4 +21,99 @@ class BaseEngine(ABC):
     def search(self, collection, query, filters, num_results=10) -> list[dict[str, str]]:
         pass
 
-    
\ No newline at end of file
+    def search_many(self, embeddings: list[list[float]], collection: str | None = None, filters=None, top_k: int = 10, result_format: str = 'dicts') -> list:
+        """
+        Search several embeddings at once, engines able to score them in a single pass should override this
+        """
+        return [self.search(embedding, collection, filters, top_k, result_format=result_format) for embedding in embeddings]  # type: ignore
+
+    def update_many(self, uuids: list[str], metadata: list[dict[str, str]]):
+        """
+        Replace the metadata of several documents, engines able to write them in bulk should override this
+        """
+        for uuid, meta in zip(uuids, metadata):
+            self.update(uuid, meta)  # type: ignore
+
+    def delete_many(self, uuids: list[str]):
+        """
+        Delete several documents by uuid, engines able to delete them in bulk should override this
+        """
+        for uuid in uuids:
+            self.delete(uuid=uuid)  # type: ignore
+
+    def stored(self, uuids: list[str]) -> set[str]:
+        """
+        The uuids of ``uuids`` found in the store, engines able to look them up in bulk should override this
+        """
+        return {uuid for uuid in uuids if self.get_document(uuid)}  # type: ignore
+
+    def deduplicate(self, texts: list[str], collection: str | None = None, metadata: list[dict[str, str]] | None = None) -> list[int]:
+        """
+        Indices of the texts to store, texts already in the collection are skipped or, with dedup='upsert', their metadata is replaced
+        """
+        upsert = self.settings.dedup == 'upsert'  # type: ignore
+
+        # a text repeated within the batch is stored once, the last copy wins an upsert
+        indices: dict[str, int] = {}
+        for index, text in enumerate(texts):
+            uuid = content_uuid(collection, text)
+            if upsert or uuid not in indices:
+                indices[uuid] = index
+
+        stored = self.stored(list(indices))
+
+        if upsert and stored and metadata is not None:
+            self.update_many([uuid for uuid in indices if uuid in stored], [metadata[indices[uuid]] for uuid in indices if uuid in stored])
+
+        keep = sorted(index for uuid, index in indices.items() if uuid not in stored)
+        self.metrics.count('duplicates_skipped', len(texts) - len(keep), 'add')  # type: ignore
+
+        return keep
+
+    def _new_documents(self, texts: list[str], collection: str | None = None, embeddings: list | None = None, metadata: list[dict[str, str]] | None = None, deduplicated: bool = False):
+        """
+        The uuids, texts, embeddings and metadata of the documents an add should store
+
+        ``deduplicated`` texts already went through ``deduplicate``, e.g. in the workers of add_stream.
+        """
+        if not self.settings.dedup:  # type: ignore
+            return generate_uuid(len(texts)), texts, embeddings, metadata
+
+        if deduplicated:
+            return [content_uuid(collection, text) for text in texts], texts, embeddings, metadata
+
+        keep = self.deduplicate(texts, collection, metadata)
+        texts = [texts[index] for index in keep]
+
+        return (
+            [content_uuid(collection, text) for text in texts],
+            texts,
+            None if embeddings is None else [embeddings[index] for index in keep],
+            None if metadata is None else [metadata[index] for index in keep],
+        )
+
+    def export(self, collection: str | None = None, batch_size: int = 1000):
+        """
+        Iterate over the documents of a collection, embeddings included, as Arrow record batches of ``batch_size`` rows
+        """
+        from verusdb.engines.transfer import to_batches
+
+        return to_batches(self.iter_documents(collection=collection, include_embeddings=True), batch_size)
+
+    def import_batches(self, batches) -> int:
+        """
+        Store record batches of ``export``, keeping their uuids, and return the number of documents imported
+        """
+        raise NotImplementedError('This engine can not import record batches')
+
+    def stats(self) -> dict:
+        """
+        Document counts, memory and index sizes of the store, cheap enough to poll
+        """
+        raise NotImplementedError('This engine does not report stats')
+
+    def iter_documents(self, collection: str | None = None, **kwargs):
+        """
+        Iterate over the documents of a collection, engines able to stream should override this
+        """
+        yield from self.get_documents(collection=collection)  # type: ignore
@@ -0,0 +1,134 @@
+from __future__ import annotations
+import base64
+import json
+import numpy as np
+from verusdb.engines.scoring import normalize
+
+COARSE_METHODS = ('pca', 'truncate')
+
+
+class CoarseIndex:
+    """
+    Reduced copies of the embeddings for a fast first search pass.
+
+    ``truncate`` keeps the first ``dimensions`` values, for Matryoshka style
+    models whose prefixes are embeddings on their own. ``pca`` projects the
+    vectors on their ``dimensions`` principal components, fitted once on a
+    sample of the store and saved with it. The coarse pass picks
+    ``candidates * top_k`` rows which are then scored with the full vectors.
+    """
+
+    def __init__(
+        self,
+        method: str = 'pca',
+        dimensions: int = 128,
+        candidates: int = 10,
+        metric: str = 'cosine',
+        min_rows: int = 1000,
+        sample_size: int = 50000,
+    ):
+        if method not in COARSE_METHODS:
+            raise ValueError(f'Invalid coarse method {method}, expected one of {", ".join(COARSE_METHODS)}')
+
+        if dimensions < 1 or candidates < 1:
+            raise ValueError('The coarse dimensions and candidates must be positive')
+
+        self.method = method
+        self.dimensions = dimensions
+        self.candidates = candidates
+        self.metric = metric
+        self.min_rows = min_rows
+        self.sample_size = sample_size
+
+        self.mean: np.ndarray | None = None
+        self.components: np.ndarray | None = None
+
+    @property
+    def ready(self) -> bool:
+        """
+        Whether vectors can be projected, a pca index has to be fitted first
+        """
+        return self.method == 'truncate' or self.components is not None
+
+    @property
+    def scoring_metric(self) -> str:
+        # cosine vectors are stored normalized, their coarse copies are ranked by inner product
+        return 'l2' if self.metric == 'l2' else 'dot'
+
+    def fit(self, matrix: np.ndarray):
+        """
+        Fit the principal components on a sample of the stored vectors
+        """
+        if self.method != 'pca':
+            return
+
+        if self.dimensions >= matrix.shape[1]:
+            raise ValueError(f'The coarse dimensions must be lower than the {matrix.shape[1]} dimensions of the embeddings')
+
+        if matrix.shape[0] > self.sample_size:
+            rows = np.random.default_rng(0).choice(matrix.shape[0], self.sample_size, replace=False)
+            matrix = matrix[rows]
+
+        matrix = matrix.astype(np.float64)
+        self.mean = matrix.mean(axis=0)
+        centered = matrix - self.mean
+
+        # eigenvectors of the covariance, cheaper than an svd of the sample when rows outnumber dimensions
+        values, vectors = np.linalg.eigh(centered.T @ centered)
+        order = np.argsort(values)[::-1][:self.dimensions]
+        self.components = vectors[:, order].T.astype(np.float32)
+
+    def project(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        Coarse copies of stored vectors, one row per vector
+        """
+        matrix = np.asarray(matrix, dtype=np.float32)
+
+        if self.method == 'truncate':
+            reduced = matrix[:, :self.dimensions]
+            return normalize(reduced).astype(np.float32) if self.metric == 'cosine' else reduced
+
+        return (matrix - self.mean.astype(np.float32)) @ self.components.T  # type: ignore
+
+    def project_query(self, query: np.ndarray) -> np.ndarray:
+        """
+        Coarse copy of a prepared query
+        """
+        query = np.asarray(query, dtype=np.float32)
+
+        if self.method == 'truncate':
+            return self.project(query[None, :])[0]
+
+        # the mean only shifts inner products by a constant, it only matters for distances
+        if self.metric == 'l2':
+            query = query - self.mean.astype(np.float32)  # type: ignore
+
+        return query @ self.components.T  # type: ignore
+
+    def state(self) -> dict[bytes, bytes]:
+        """
+        The fitted projection, saved in the metadata of the parquet file
+        """
+        if self.components is None:
+            return {}
+
+        state = {
+            'dimensions': self.dimensions,
+            'mean': base64.b64encode(self.mean.astype(np.float32).tobytes()).decode(),  # type: ignore
+            'components': base64.b64encode(self.components.tobytes()).decode(),
+        }
+        return {b'verusdb.coarse_pca': json.dumps(state).encode()}
+
+    def load_state(self, metadata: dict[bytes, bytes]):
+        """
+        Restore a projection saved by ``state``, a projection with other dimensions is refitted later
+        """
+        if self.method != 'pca' or b'verusdb.coarse_pca' not in metadata:
+            return
+
+        state = json.loads(metadata[b'verusdb.coarse_pca'])
+        if state['dimensions'] != self.dimensions:
+            return
+
+        self.mean = np.frombuffer(base64.b64decode(state['mean']), dtype=np.float32)
+        self.components = np.frombuffer(base64.b64decode(state['components']), dtype=np.float32).reshape(self.dimensions, -1)
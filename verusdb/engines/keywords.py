@@ -0,0 +1,205 @@
+from __future__ import annotations
+import os
+import re
+import numpy as np
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+KEYWORD_MODES = ('prefilter', 'rrf')
+
+# the stored texts are tokenized by polars and the queries by re, both read \w as unicode word characters
+TOKEN_PATTERN = r'\w+'
+
+
+def tokenize(text: str) -> list[str]:
+    return re.findall(TOKEN_PATTERN, text.lower())
+
+
+def reciprocal_rank_fusion(rankings: list[pl.Series], k: int = 60) -> pl.DataFrame:
+    """
+    Fuse rankings of uuids, best first, into one frame of uuids and fused scores, best first
+    """
+    frames = [
+        pl.DataFrame({'uuid': ranking, 'score': 1.0 / (k + np.arange(1, len(ranking) + 1, dtype=np.float64))})
+        for ranking in rankings
+        if len(ranking)
+    ]
+
+    if not frames:
+        return pl.DataFrame(schema=[('uuid', pl.Utf8), ('score', pl.Float64)])
+
+    return pl.concat(frames).groupby('uuid').agg(pl.col('score').sum()).sort('score', descending=True)
+
+
+class KeywordIndex:
+    """
+    Inverted BM25 index of the document texts.
+
+    The postings (term, uuid, term frequency and document length) are kept in a
+    frame sorted by term, with the rows of every term in a dict, and the
+    postings of new documents are appended to an unsorted tail. The tail is
+    merged once it holds an eighth of the sorted postings, so adds stay cheap
+    and a query only reads the rows of its own terms and the tail. Removed
+    documents are masked when scoring and their postings dropped once they
+    are an eighth of the documents.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, rrf_k: int = 60, rrf_depth: int = 100):
+        if k1 < 0 or not 0 <= b <= 1:
+            raise ValueError('The keyword k1 must be positive and b between 0 and 1')
+
+        if rrf_k < 1 or rrf_depth < 1:
+            raise ValueError('The keyword rrf_k and rrf_depth must be positive')
+
+        self.k1 = k1
+        self.b = b
+        self.rrf_k = rrf_k
+        self.rrf_depth = rrf_depth
+
+        self.clear()
+
+    @staticmethod
+    def blank() -> pl.DataFrame:
+        return pl.DataFrame(schema=[('term', pl.Utf8), ('uuid', pl.Utf8), ('tf', pl.UInt32), ('length', pl.UInt32)])
+
+    def clear(self):
+        self.__sorted = self.blank()
+        self.__terms: dict[str, tuple[int, int]] = {}
+        self.__tail = self.blank()
+        # removed documents whose postings are still in the frames
+        self.__removed: frozenset[str] = frozenset()
+        self.__lengths: dict[str, int] = {}
+
+        # documents with at least one token and their number of tokens, for the average document length
+        self.documents = 0
+        self.tokens = 0
+
+    @property
+    def postings(self) -> pl.DataFrame:
+        """
+        Every posting of the stored documents, the frames are never modified in place so this is a consistent snapshot
+        """
+        postings, removed = pl.concat([self.__sorted, self.__tail], rechunk=False), self.__removed
+        return postings.filter(~pl.col('uuid').is_in(list(removed))) if removed else postings
+
+    def add(self, uuids: list[str], texts: list[str]):
+        postings = (
+            pl.DataFrame({'uuid': uuids, 'term': texts}, schema={'uuid': pl.Utf8, 'term': pl.Utf8})
+            .with_columns(pl.col('term').str.to_lowercase().str.extract_all(TOKEN_PATTERN))
+            .with_columns(pl.col('term').list.lengths().cast(pl.UInt32).alias('length'))
+            .explode('term')
+            .drop_nulls('term')
+            .groupby(['term', 'uuid'])
+            .agg(pl.count().cast(pl.UInt32).alias('tf'), pl.col('length').first())
+            .select(self.blank().columns)
+        )
+
+        # a document added again must not be masked by its removal
+        if not self.__removed.isdisjoint(uuids):
+            self.__compact()
+
+        self.__count(postings)
+        self.__tail = self.__tail.vstack(postings)
+
+        if self.__tail.height > max(self.__sorted.height // 8, 4096):
+            self.__load(self.postings)
+
+    def remove(self, uuids: list[str]):
+        removed = set()
+
+        for uuid in uuids:
+            length = self.__lengths.pop(uuid, None)
+
+            if length is not None:
+                removed.add(uuid)
+                self.documents -= 1
+                self.tokens -= length
+
+        # replaced rather than updated, a concurrent search keeps reading the set it started with
+        if removed:
+            self.__removed = self.__removed | removed
+
+        if len(self.__removed) > max(self.documents // 8, 4096):
+            self.__compact()
+
+    def __compact(self):
+        """
+        Drop the postings of the removed documents, filtering keeps the sorted frame sorted
+        """
+        kept = ~pl.col('uuid').is_in(list(self.__removed))
+        self.__load(self.__sorted.filter(kept), self.__tail.filter(kept), presorted=True)
+
+    def __count(self, postings: pl.DataFrame):
+        if postings.height:
+            lengths = postings.groupby('uuid').agg(pl.col('length').first())
+            self.__lengths.update(zip(lengths['uuid'].to_list(), lengths['length'].to_list()))
+            self.documents += lengths.height
+            self.tokens += int(lengths['length'].sum())
+
+    def __load(self, postings: pl.DataFrame, tail: pl.DataFrame | None = None, presorted: bool = False):
+        """
+        Sort the postings by term and index the rows of every term, the removed documents must not be in them
+        """
+        self.__sorted = (postings if presorted else postings.sort('term')).rechunk()
+        self.__tail = tail if tail is not None else self.blank()
+        self.__removed = frozenset()
+
+        counts = self.__sorted.groupby('term', maintain_order=True).agg(pl.count().alias('rows'))
+        offsets = np.concatenate([[0], np.cumsum(counts['rows'].to_numpy())[:-1]]) if counts.height else []
+        self.__terms = dict(zip(counts['term'].to_list(), zip((int(offset) for offset in offsets), counts['rows'].to_list())))
+
+    def search(self, query: str) -> pl.DataFrame:
+        """
+        The uuids of the documents containing a term of the query with their BM25 score, best first
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+
+        frames = [self.__sorted.slice(*self.__terms[term]) for term in terms if term in self.__terms]
+        if self.__tail.height:
+            frames.append(self.__tail.filter(pl.col('term').is_in(terms)))
+
+        matched = pl.concat(frames) if frames else self.blank()
+        removed = self.__removed
+        if removed:
+            matched = matched.filter(~pl.col('uuid').is_in(list(removed)))
+
+        if matched.height == 0 or self.documents == 0:
+            return pl.DataFrame(schema=[('uuid', pl.Utf8), ('score', pl.Float64)])
+
+        average = self.tokens / self.documents
+        tf = pl.col('tf').cast(pl.Float64)
+        frequency = pl.col('df').cast(pl.Float64)
+
+        idf = (1 + (self.documents - frequency + 0.5) / (frequency + 0.5)).log()
+        saturation = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * pl.col('length').cast(pl.Float64) / average))
+
+        return (
+            matched.join(matched.groupby('term').agg(pl.count().alias('df')), on='term')
+            .groupby('uuid')
+            .agg((idf * saturation).sum().alias('score'))
+            .sort('score', descending=True)
+        )
+
+    def table(self, postings: pl.DataFrame, token: str) -> pa.Table:
+        """
+        The postings sorted by term as an arrow table tagged with the token of the store file they belong to
+        """
+        table = postings.sort('term').to_arrow()
+        return table.replace_schema_metadata({b'verusdb.keywords': token.encode()})
+
+    def read(self, path: str, token: bytes | None) -> bool:
+        """
+        Load postings written with the store, False when there are none or they belong to another store file
+        """
+        if token is None or not os.path.exists(path):
+            return False
+
+        if (pq.read_schema(path).metadata or {}).get(b'verusdb.keywords') != token:
+            return False
+
+        self.clear()
+        postings = pl.read_parquet(path)
+        self.__count(postings)
+        self.__load(postings, presorted=True)
+        return True
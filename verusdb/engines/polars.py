@@ -1,10 +1,21 @@
 from __future__ import annotations
 import os
+import threading
 import numpy as np
 import polars as pl
+import pyarrow.parquet as pq
 from verusdb.engines import BaseEngine
 from verusdb.settings import Settings
 from verusdb.utils import generate_uuid
+from verusdb.results import fold_metadata, format_frame, validate_result_format
+from verusdb.engines.streaming import ParquetScanner
+from verusdb.engines.wal import WriteAheadLog
+from verusdb.engines.coarse import CoarseIndex
+from verusdb.engines.keywords import KEYWORD_MODES, KeywordIndex, reciprocal_rank_fusion
+from verusdb.engines.transfer import record_batch, split_batch
+from verusdb.deadline import Deadline
+from verusdb.filters import Filter, compile_filters
+from verusdb.engines.scoring import POLARS_DTYPES, descending, normalize, prepare_query, score, score_many, to_matrix, to_series
 
 
 class PolarsEngine(BaseEngine):
@@ -20,6 +31,29 @@ class PolarsEngine(BaseEngine):
         self.store = pl.DataFrame()
         self.settings = settings
         self.embeddings_engine = settings.embeddings
+        self.metrics = settings.metrics
+
+        # storage type of the embeddings, scores are always computed in at least float32
+        self.dtype = settings.dtype or "float64"
+
+        # set by load() when the store is searched straight from the parquet file
+        self.scanner: ParquetScanner | None = None
+
+        # reduced copies of the embeddings for a first search pass, kept in the "coarse" column
+        self.coarse = CoarseIndex(metric=settings.metric, **settings.polars_coarse) if settings.polars_coarse else None
+
+        # inverted bm25 index of the texts, maintained by every write and saved next to the store
+        keywords = settings.polars_keywords
+        self.keywords = KeywordIndex(**(keywords if isinstance(keywords, dict) else {})) if keywords else None
+
+        # set by load() when the writes are logged, see checkpoint()
+        self.wal: WriteAheadLog | None = None
+
+        # writes replace self.store, the lock keeps them in the order they are logged
+        self.__lock = threading.RLock()
+        self.__checkpoint_lock = threading.Lock()
+        self.__checkpointer: threading.Thread | None = None
+        self.__stop = threading.Event()
 
     def __get_blank_store(self):
         """
@@ -30,7 +64,7 @@ class PolarsEngine(BaseEngine):
                 ("uuid", str),
                 ("collection", pl.Utf8),
                 ("text", pl.Utf8),
-                ("embeddings", pl.List(pl.Float64)),
+                ("embeddings", pl.List(POLARS_DTYPES[self.dtype])),
             ]
         )
 
@@ -42,15 +76,184 @@ class PolarsEngine(BaseEngine):
             self.store = self.__get_blank_store()
             return
 
+        if self.settings.polars_streaming:
+            if not os.path.exists(self.settings.file):
+                raise ValueError(f"Streaming mode requires an existing store, {self.settings.file} not found")
+
+            # nothing is read now, every search scans the file in batches
+            self.scanner = ParquetScanner(
+                self.settings.file, self.settings.polars_batch_size, self.metrics, self.settings.metric
+            )
+            self.store = self.__get_blank_store()
+            return
+
         if self.settings.folder and os.path.exists(
             self.settings.folder + "/verusdb.parquet"
         ):
-            self.store = pl.read_parquet(self.settings.folder + "/verusdb.parquet")
+            with self.metrics.span("load", "read"):
+                self.store = pl.read_parquet(self.settings.folder + "/verusdb.parquet")
+
+                # stores written before the metric setting existed keep the raw vectors,
+                # and the file may have been written with another dtype
+                stored = self.store.schema["embeddings"] != pl.List(POLARS_DTYPES[self.dtype])
+                if self.store.height > 0 and (self.settings.metric == "cosine" or stored):
+                    matrix = to_matrix(self.store["embeddings"])
+                    if self.settings.metric == "cosine":
+                        matrix = normalize(matrix)
+                    self.store = self.store.with_columns(to_series("embeddings", matrix, self.dtype))
         else:
             self.store = self.__get_blank_store()
 
+        metadata = (pq.read_schema(self.settings.file).metadata or {}) if os.path.exists(self.settings.file) else {}
+
+        if self.coarse is not None:
+            self.coarse.load_state(metadata)
+            self.__index_coarse()
+
+        if self.keywords is not None:
+            # postings of another version of the store file are rebuilt from the texts
+            if not self.keywords.read(self.__keywords_file(), metadata.get(b"verusdb.keywords")):
+                with self.metrics.span("load", "keywords"):
+                    self.keywords.add(self.store["uuid"].to_list(), self.store["text"].to_list())
+
+        if self.settings.polars_wal:
+            self.__open_wal()
+
+    def __keywords_file(self) -> str:
+        return self.settings.folder + "/verusdb.keywords.parquet"  # type: ignore
+
+    def __index_coarse(self):
+        """
+        Compute the coarse copy of every stored embedding
+        """
+        if self.coarse is None or not self.coarse.ready:
+            return
+
+        if self.store.height == 0:
+            self.store = self.store.with_columns(pl.Series("coarse", [], dtype=pl.List(pl.Float32)))
+            return
+
+        reduced = self.coarse.project(to_matrix(self.store["embeddings"]))
+        self.store = self.store.with_columns(to_series("coarse", reduced, "float32"))
+
+    def __fit_coarse(self):
+        """
+        Fit the pca projection once the store holds enough documents
+        """
+        if self.coarse is None or self.coarse.ready or self.store.height < self.coarse.min_rows:
+            return
+
+        with self.__lock:
+            if self.coarse.ready:
+                return
+
+            with self.metrics.span("search", "fit"):
+                sample = self.store
+                if sample.height > self.coarse.sample_size:
+                    sample = sample.sample(n=self.coarse.sample_size, seed=0)
+
+                self.coarse.fit(to_matrix(sample["embeddings"]))
+                self.__index_coarse()
+
+    def __candidates(self, documents: pl.DataFrame, query: np.ndarray, top_k: int | None) -> pl.DataFrame:
+        """
+        The candidates * top_k documents closest to the query according to their coarse copies
+        """
+        if self.coarse is None or top_k is None or "coarse" not in documents.columns:
+            return documents
+
+        pool = top_k * self.coarse.candidates
+        if documents.height <= pool:
+            return documents
+
+        with self.metrics.span("search", "coarse"):
+            metric = self.coarse.scoring_metric
+            scores = score(to_matrix(documents["coarse"]), self.coarse.project_query(query), metric)
+            rows = np.argpartition(-scores if descending(metric) else scores, pool)[:pool]
+
+        self.metrics.count("coarse_candidates", pool, "search")
+
+        return documents[rows]
+
+    def __open_wal(self):
+        """
+        Replay the writes logged after the last snapshot and start logging new ones
+        """
+        os.makedirs(self.settings.folder, exist_ok=True)  # type: ignore
+        self.wal = WriteAheadLog(self.settings.folder, self.settings.polars_sync)  # type: ignore
+
+        covered = 0
+        if os.path.exists(self.settings.file):
+            metadata = pq.read_schema(self.settings.file).metadata or {}
+            covered = int(metadata.get(b"verusdb.wal_segment", 0))
+
+        with self.metrics.span("load", "replay"):
+            for header, payload in self.wal.replay(after=covered):
+                self.__apply(header, payload)
+
+        self.wal.open()
+
+        interval = self.settings.polars_checkpoint_interval
+        if interval:
+            self.__checkpointer = threading.Thread(
+                target=self.__checkpoint_loop, args=(interval,), name="verusdb-checkpointer", daemon=True
+            )
+            self.__checkpointer.start()
+
+    def __log(self, header: dict, payload: bytes = b""):
+        """
+        Append a write to the log, call while holding the write lock so records follow the order of the writes
+        """
+        if self.wal is None:
+            return None
+
+        with self.metrics.span(header["op"], "wal"):
+            return self.wal.append(header, payload)
+
+    def __commit(self, sequence: int | None):
+        """
+        Wait for a logged write to be durable, outside of the write lock so concurrent writers share the fsync
+        """
+        if sequence is not None:
+            with self.metrics.span("commit", "wal"):
+                self.wal.commit(sequence)  # type: ignore
+
+    def __apply(self, header: dict, payload: bytes):
+        """
+        Redo a write read back from the log
+        """
+        op = header["op"]
+
+        if op == "add":
+            embeddings = np.frombuffer(payload, dtype=np.float64).reshape(len(header["texts"]), -1)
+            self._insert(header["uuids"], header["texts"], header["collection"], embeddings, header["metadata"])
+        elif op == "delete":
+            self.store = self.store.filter(~pl.col("uuid").is_in(header["uuids"]))
+            if self.keywords is not None:
+                self.keywords.remove(header["uuids"])
+        elif op == "update":
+            self._update_many([header["uuid"]], [header["metadata"]])
+        elif op == "update_many":
+            self._update_many(header["uuids"], header["metadata"])
+        elif op == "clear":
+            self.store = self.__get_blank_store()
+            if self.keywords is not None:
+                self.keywords.clear()
+
+    def __check_writable(self):
+        if self.scanner is not None:
+            raise NotImplementedError("The store is read-only in streaming mode")
+
     def clear(self):
-        self.store = self.__get_blank_store()
+        self.__check_writable()
+
+        with self.__lock:
+            self.store = self.__get_blank_store()
+            if self.keywords is not None:
+                self.keywords.clear()
+            sequence = self.__log({"op": "clear"})
+
+        self.__commit(sequence)
 
     def add(
         self,
@@ -58,25 +261,74 @@ class PolarsEngine(BaseEngine):
         collection: str | None = None,
         embeddings: list[list[float]] | None = None,
         metadata: list[dict[str, str]] | None = None,
+        deduplicated: bool = False,
     ):
         """
         Add a document to the dataframe
         """
-        metadata_df = pl.DataFrame(metadata)
+        self.__check_writable()
+
+        # duplicates are dropped before anything is encoded
+        uuids, texts, embeddings, metadata = self._new_documents(texts, collection, embeddings, metadata, deduplicated)
+        if not texts:
+            return
 
         if embeddings is None:
             if self.embeddings_engine is None:
                 raise ValueError("Embeddings engine not set")
 
-            embeddings = [self.embeddings_engine.encode(text) for text in texts]
+            with self.metrics.span("add", "encode"):
+                embeddings = self.embeddings_engine.encode_batch(texts)
+
+        vectors = np.asarray(embeddings, dtype=np.float64)
+
+        with self.__lock:
+            if self.settings.dedup:
+                # a concurrent add may have stored the same texts while these were encoded
+                stored = self.stored(uuids)
+                if stored:
+                    keep = [index for index, uuid in enumerate(uuids) if uuid not in stored]
+                    uuids, texts, vectors = [uuids[i] for i in keep], [texts[i] for i in keep], vectors[keep]
+                    metadata = None if metadata is None else [metadata[i] for i in keep]
+                    if not uuids:
+                        return
+
+            # applied before it is logged, a write that fails on bad input never reaches the log
+            self._insert(uuids, texts, collection, vectors, metadata)  # type: ignore
+            header = {"op": "add", "uuids": uuids, "collection": collection, "texts": list(texts), "metadata": metadata}
+            sequence = self.__log(header, vectors.tobytes())
+
+        self.__commit(sequence)
+
+    def _insert(
+        self,
+        uuids: list[str],
+        texts: list[str],
+        collection: str | None,
+        vectors: np.ndarray,
+        metadata: list[dict[str, str]] | None = None,
+    ):
+        """
+        Append documents whose uuids and embeddings are already known
+        """
+        metadata_df = pl.DataFrame(metadata)
+
+        # with cosine the vectors are normalized once here so searches are a plain dot product
+        if self.settings.metric == "cosine":
+            vectors = normalize(vectors)
 
         data = {
-            "uuid": generate_uuid(dimension=len(texts)),
+            "uuid": uuids,
             "collection": collection,
             "text": texts,
-            "embeddings": embeddings,
+            "embeddings": to_series("embeddings", vectors, self.dtype),
         }
 
+        if self.coarse is not None and self.coarse.ready:
+            if "coarse" not in self.store.columns:
+                self.__index_coarse()
+            data["coarse"] = to_series("coarse", self.coarse.project(vectors), "float32")
+
         # Add the metadata to the dataframe
         for key in metadata_df.columns:
             data["metadata__" + key] = metadata_df[key]
@@ -86,169 +338,759 @@ class PolarsEngine(BaseEngine):
             if key.startswith("metadata__") and key not in data.keys():
                 data[key] = ""
 
-        # Add to self.store the new columns with '' as the value
-        self.store = self.store.with_columns(
-            (pl.lit("")).alias("metadata__" + key) for key in metadata_df.columns
-        )
+        with self.metrics.span("add", "write"):
+            # Add to self.store the new columns with '' as the value
+            self.store = self.store.with_columns(
+                (pl.lit("")).alias("metadata__" + key)
+                for key in metadata_df.columns
+                if "metadata__" + key not in self.store.columns
+            )
+
+            # Add the new dataframe to the existing dataframe, in the column order of the store
+            self.store = self.store.vstack(pl.DataFrame(data).select(self.store.columns))
+
+        if self.keywords is not None:
+            with self.metrics.span("add", "keywords"):
+                self.keywords.add(uuids, list(texts))
+
+    def export(self, collection: str | None = None, batch_size: int = 1000):
+        """
+        Record batches of the store built from its columns, read from the parquet file in streaming mode
+        """
+        if self.scanner is not None:
+            frames = self.scanner.batches(collection)
+        else:
+            frames = [self.store if collection is None else self.store.filter(pl.col("collection") == collection)]
+
+        for frame in frames:
+            for offset in range(0, frame.height, batch_size):
+                batch = frame.slice(offset, batch_size)
+                columns = [column for column in batch.columns if column.startswith("metadata__")]
+                metadata = fold_metadata(batch.select(columns))["metadata"].to_list() if columns else [{}] * batch.height
+
+                yield record_batch(
+                    batch["uuid"].to_list(),
+                    batch["collection"].to_list(),
+                    batch["text"].to_list(),
+                    metadata,
+                    to_matrix(batch["embeddings"]),
+                )
+
+    def import_batches(self, batches) -> int:
+        """
+        Append record batches of an export with one vstack per batch, keeping their uuids
+        """
+        self.__check_writable()
+        imported = 0
+
+        for batch in batches:
+            for collection, uuids, texts, vectors, metadata in split_batch(batch):
+                with self.__lock:
+                    with self.metrics.span("import", "write"):
+                        self._insert(uuids, texts, collection, vectors, metadata)
+                    header = {"op": "add", "uuids": uuids, "collection": collection, "texts": texts, "metadata": metadata}
+                    sequence = self.__log(header, vectors.tobytes())
+
+                self.__commit(sequence)
+                imported += len(uuids)
 
-        # Add the new dataframe to the existing dataframe
-        self.store = self.store.vstack(pl.DataFrame(data))
+        return imported
 
-    def delete(self, uuid: str | None = None, collection: str | None = None, filters: dict[str, str] | None = None):
+    def delete(self, uuid: str | None = None, collection: str | None = None, filters: dict[str, str] | Filter | None = None):
         """
         Delete documents from the store
         """
+        self.__check_writable()
+
         if uuid is None and filters is None and collection is None:
-            ValueError("uuid, collection or filters must be provided")
-            
-        if collection is not None:
-            self.store = self.store.filter(pl.col("collection") != collection)
+            raise ValueError("uuid, collection or filters must be provided")
+
+        predicate = self._predicate(collection, filters)
 
         if uuid is not None:
-            self.store = self.store.filter(pl.col("uuid") != uuid)
+            predicate = pl.col("uuid") == uuid if predicate is None else predicate & (pl.col("uuid") == uuid)
+
+        with self.__lock:
+            # the log records the deleted uuids, filters can not be replayed against a different store
+            deleted = None
+            if self.wal is not None or self.keywords is not None:
+                deleted = self.store.filter(predicate.fill_null(False))["uuid"].to_list()  # type: ignore
+
+            with self.metrics.span("delete", "write"):
+                # rows where the predicate is null (e.g. a numeric range on a non numeric value) are kept
+                self.store = self.store.filter(~predicate.fill_null(False))  # type: ignore
+
+                if self.keywords is not None:
+                    self.keywords.remove(deleted)  # type: ignore
 
-        if filters is not None:
-            for key, value in filters.items():
-                self.store = self.store.filter(pl.col(f"metadata__{key}") != value)
+            sequence = self.__log({"op": "delete", "uuids": deleted}) if self.wal is not None else None
 
-    def _cosine_similarity(
+        self.__commit(sequence)
+
+    def _predicate(
         self,
-        embedding: list[float],
         collection: str | None = None,
-        filters: dict[str, str] | None = None,
+        filters: dict[str, str] | Filter | None = None,
+    ) -> pl.Expr | None:
+        """
+        Compile the collection and the filters into a single expression
+        """
+        predicate = None
+
+        if collection is not None:
+            predicate = pl.col("collection") == collection
+
+        compiled = compile_filters(filters)
+        if compiled is not None:
+            expression = compiled.to_polars(self.store.columns)
+            predicate = expression if predicate is None else predicate & expression
+
+        return predicate
+
+    def _filtered(
+        self,
+        collection: str | None = None,
+        filters: dict[str, str] | Filter | None = None,
+        uuids: pl.Series | None = None,
     ) -> pl.DataFrame:
         """
-        Calculate the cosine similarity
+        The documents matching the collection and the filters, and among ``uuids`` when given
         """
         temp = self.store
 
-        if collection is not None:
-            temp = temp.filter(pl.col("collection") == collection)
+        with self.metrics.span("search", "filter"):
+            predicate = self._predicate(collection, filters)
 
-        # filter the dataframe
-        if filters is not None:
-            for key, value in filters.items():
-                temp = temp.filter(pl.col("metadata__" + key) == value)
+            if uuids is not None:
+                matching = pl.col("uuid").is_in(uuids)
+                predicate = matching if predicate is None else predicate & matching
 
-        norm = np.linalg.norm(embedding)
+            # one fused pass over the store instead of a filtered copy per condition
+            if predicate is not None:
+                temp = temp.lazy().filter(predicate.fill_null(False)).collect()
 
-        if norm == 0:
-            raise ValueError("The embedding cannot be a zero vector")
+        self.metrics.count("documents_scanned", temp.height, "search")
 
-        # Calculate the cosine similarity
-        # TODO: This is not the most efficient way to do this, there is a pylint warning
-        temp = temp.with_columns(
-            pl.col("embeddings").apply(lambda x: (x.dot(embedding)) / (norm * np.linalg.norm(x))).alias("score")  # type: ignore
-        )
+        return temp
+
+    def _rank(self, documents: pl.DataFrame, scores: np.ndarray, top_k: int | None = None) -> pl.DataFrame:
+        """
+        Attach the scores and keep the top k documents, best first
+        """
+        metric = self.settings.metric
+
+        # only the top k rows are sorted, the rest of the store is never reordered
+        if top_k is not None and top_k < len(scores):
+            best = -scores if descending(metric) else scores
+            rows = np.argpartition(best, top_k)[:top_k]
+            documents = documents[rows]
+            scores = scores[rows]
+
+        documents = documents.with_columns(pl.Series("score", scores))
+
+        return documents.sort("score", descending=descending(metric))
+
+    def _similarity(
+        self,
+        embedding: list[float],
+        collection: str | None = None,
+        filters: dict[str, str] | Filter | None = None,
+        top_k: int | None = None,
+        deadline: Deadline | None = None,
+        keyword: str | None = None,
+        keyword_mode: str = "prefilter",
+    ) -> pl.DataFrame:
+        """
+        Score the matching documents with the configured metric, best first
+
+        With a keyword the documents are either restricted to the ones containing
+        one of its terms (``prefilter``) or ranked by the reciprocal rank fusion of
+        the vector and the BM25 rankings (``rrf``), the score is then the fused score.
+        """
+        self.__fit_coarse()
 
-        # Return the dataframe sorted by cosine similarity
-        return temp.sort("score", descending=True)
+        ranking = self.__keyword_ranking(keyword, keyword_mode) if keyword is not None else None
+        fuse = ranking is not None and keyword_mode == "rrf"
+
+        # only the postings of the keyword are scored with a prefilter
+        filtered = self._filtered(collection, filters, None if ranking is None or fuse else ranking["uuid"])
+        query = prepare_query(embedding, self.settings.metric)
+
+        # the fusion ranks the rrf_depth best documents of both searches
+        depth = max(top_k, self.keywords.rrf_depth) if fuse and top_k is not None else top_k  # type: ignore
+
+        # with a coarse index only its best candidates are scored with the full vectors
+        temp = self.__candidates(filtered, query, depth)
+
+        with self.metrics.span("search", "score"):
+            if deadline is not None:
+                ranked = self.__score_until(temp, query, depth, deadline)
+            else:
+                ranked = self._rank(temp, score(to_matrix(temp["embeddings"]), query, self.settings.metric), depth)
+
+        if not fuse:
+            return ranked
+
+        with self.metrics.span("search", "fuse"):
+            # keyword matches outside the collection and the filters are left out of the keyword ranking
+            keyword_ranked = ranking.join(filtered.select("uuid"), on="uuid", how="semi")  # type: ignore
+            if depth is not None:
+                keyword_ranked = keyword_ranked.head(depth)
+
+            fused = reciprocal_rank_fusion([ranked["uuid"], keyword_ranked["uuid"]], self.keywords.rrf_k)  # type: ignore
+            if top_k is not None:
+                fused = fused.head(top_k)
+
+            return filtered.join(fused, on="uuid").sort("score", descending=True)
+
+    def __keyword_ranking(self, keyword: str, keyword_mode: str) -> pl.DataFrame:
+        """
+        The uuids of the documents matching a keyword query with their BM25 score, best first
+        """
+        if self.keywords is None:
+            raise ValueError("Keyword search requires the keyword index, enable it with polars={'keywords': True}")
+
+        if keyword_mode not in KEYWORD_MODES:
+            raise ValueError(f"Invalid keyword mode {keyword_mode}, expected one of {', '.join(KEYWORD_MODES)}")
+
+        with self.metrics.span("search", "keywords"):
+            ranking = self.keywords.search(keyword)
+
+        self.metrics.count("keyword_matches", ranking.height, "search")
+
+        return ranking
+
+    def __score_until(self, documents: pl.DataFrame, query: np.ndarray, top_k: int | None, deadline: Deadline) -> pl.DataFrame:
+        """
+        Score the documents chunk by chunk and rank the ones scored before the deadline expired
+        """
+        size = self.settings.polars_deadline_chunk_size
+        scores = []
+
+        for start in range(0, documents.height, size):
+            # the first chunk is always scored, an expired search still returns its best so far
+            if start and deadline.expired:
+                deadline.cut()
+                self.metrics.count("deadline_expired", 1, "search")
+                self.metrics.count("documents_skipped", documents.height - start, "search")
+                break
+
+            scores.append(score(to_matrix(documents["embeddings"].slice(start, size)), query, self.settings.metric))
+
+        scores = np.concatenate(scores) if scores else np.empty(0, dtype=np.float32)
+
+        return self._rank(documents.head(len(scores)), scores, top_k)
+
+    def _similarity_many(
+        self,
+        embeddings: list[list[float]],
+        collection: str | None = None,
+        filters: dict[str, str] | Filter | None = None,
+        top_k: int | None = None,
+    ) -> list[pl.DataFrame]:
+        """
+        Score the matching documents against several queries with a single matrix product
+        """
+        self.__fit_coarse()
+
+        temp = self._filtered(collection, filters)
+        queries = np.stack([prepare_query(embedding, self.settings.metric) for embedding in embeddings])
+
+        if self.coarse is not None and top_k is not None and "coarse" in temp.columns:
+            # every query has its own candidates, they are reranked one by one
+            results = []
+            for query in queries:
+                candidates = self.__candidates(temp, query, top_k)
+                with self.metrics.span("search", "score"):
+                    scores = score(to_matrix(candidates["embeddings"]), query, self.settings.metric)
+                results.append(self._rank(candidates, scores, top_k))
+            return results
+
+        with self.metrics.span("search", "score"):
+            scores = score_many(to_matrix(temp["embeddings"]), queries, self.settings.metric)
+            return [self._rank(temp, scores[:, index], top_k) for index in range(len(embeddings))]
 
     def search(
         self,
         embedding: list[float],
         collection: str | None = None,
-        filters: dict[str, str] | None = None,
+        filters: dict[str, str] | Filter | None = None,
         top_k: int = 10,
-    ) -> list[dict[str, str]]:
+        result_format: str = "dicts",
+        deadline: Deadline | None = None,
+        keyword: str | None = None,
+        keyword_mode: str = "prefilter",
+    ):
         """
-        Search the dataframe
+        Search the dataframe, with a deadline the store is scored in chunks until it expires
+
+        keyword is a query of the BM25 index, see _similarity for the keyword modes
         """
+        validate_result_format(result_format)
 
-        # Calculate the cosine similarity
-        results = self._cosine_similarity(embedding, collection, filters).drop(
-            "embeddings"
-        )
+        results = self._top_k(embedding, collection, filters, top_k, deadline, keyword, keyword_mode)
 
         # Return the top k results
-        return self._serialize(results.head(top_k), include_score=True)
+        with self.metrics.span("search", "serialize"):
+            return self._serialize(results, include_score=True, result_format=result_format)
+
+    def search_many(
+        self,
+        embeddings: list[list[float]],
+        collection: str | None = None,
+        filters: dict[str, str] | Filter | None = None,
+        top_k: int = 10,
+        result_format: str = "dicts",
+    ) -> list:
+        """
+        Search the dataframe for several embeddings, the store is filtered and scored once for all of them
+        """
+        validate_result_format(result_format)
+
+        if not embeddings:
+            return []
+
+        if self.scanner is not None:
+            # every batch read from disk would have to be kept for all the queries, search them one by one
+            results = [self._top_k(embedding, collection, filters, top_k) for embedding in embeddings]
+        else:
+            results = [
+                documents.drop("embeddings")
+                for documents in self._similarity_many(embeddings, collection, filters, top_k)
+            ]
+            self.metrics.count("rows_returned", sum(documents.height for documents in results), "search")
+
+        with self.metrics.span("search", "serialize"):
+            return [
+                self._serialize(documents, include_score=True, result_format=result_format)
+                for documents in results
+            ]
 
     def search_text(
         self,
         text: str,
         collection: str | None = None,
-        filters: dict[str, str] | None = None,
+        filters: dict[str, str] | Filter | None = None,
         top_k: int = 10,
         return_object: bool = False,
+        result_format: str = "dicts",
+        keyword: str | None = None,
+        keyword_mode: str = "prefilter",
     ):
         """
         Search the dataframe
         """
+        validate_result_format(result_format)
 
         if self.embeddings_engine is None:
             raise ValueError("Embeddings Engine is not set")
 
         # calulate the embedding
-        embedding: list[float] = self.embeddings_engine.encode(text)
+        with self.metrics.span("search", "encode"):
+            embedding: list[float] = self.embeddings_engine.encode(text)
 
         # perform the search
-        results = self._cosine_similarity(
-            embedding=embedding, collection=collection, filters=filters
-        ).drop("embeddings")
+        results = self._top_k(embedding, collection, filters, top_k, keyword=keyword, keyword_mode=keyword_mode)
 
         # Return the top k results
         if return_object:
-            return results.head(top_k)
+            return results
 
-        return self._serialize(results.head(top_k), include_score=True)
+        with self.metrics.span("search", "serialize"):
+            return self._serialize(results, include_score=True, result_format=result_format)
+
+    def _top_k(
+        self,
+        embedding: list[float],
+        collection: str | None = None,
+        filters: dict[str, str] | Filter | None = None,
+        top_k: int = 10,
+        deadline: Deadline | None = None,
+        keyword: str | None = None,
+        keyword_mode: str = "prefilter",
+    ) -> pl.DataFrame:
+        """
+        The top k documents with their score, without the embeddings
+        """
+        if self.scanner is not None:
+            results = self.scanner.search(embedding, collection, filters, top_k, deadline)
+            if results is None:
+                results = self.__get_blank_store().drop("embeddings").with_columns(pl.lit(0.0).alias("score"))
+        else:
+            results = self._similarity(embedding, collection, filters, top_k, deadline, keyword, keyword_mode).drop("embeddings")
+
+        self.metrics.count("rows_returned", results.height, "search")
+
+        return results
 
     def _serialize(
-        self, documents: pl.DataFrame, include_score: bool = False
-    ) -> list[dict[str, str]]:
+        self, documents: pl.DataFrame, include_score: bool = False, result_format: str = "dicts"
+    ):
+        """
+        Fold the metadata__* columns into a metadata struct and convert the frame to the requested format
+        """
         if not include_score and "score" in documents.columns:
             documents = documents.drop("score")
 
-        serialized_data = documents.to_dicts()
+        if "coarse" in documents.columns:
+            documents = documents.drop("coarse")
+
+        # half precision vectors are kept as bit patterns, return them as float32
+        if self.dtype == "float16" and "embeddings" in documents.columns:
+            documents = documents.with_columns(to_series("embeddings", to_matrix(documents["embeddings"]), "float32"))
+
+        return format_frame(fold_metadata(documents), result_format)
 
-        for data in serialized_data:
-            metadata = {}
-            keys_to_remove = []
-            for key, value in data.items():
-                if key.startswith("metadata__"):
-                    metadata[key.split("__")[1]] = value
-                    keys_to_remove.append(key)
-            for key in keys_to_remove:
-                data.pop(key)
-            data["metadata"] = metadata
+    def get_documents(self, collection: str | None = None, result_format: str = "dicts"):
+        validate_result_format(result_format)
 
-        return serialized_data
+        if self.scanner is not None:
+            frames = list(self.scanner.batches(collection))
+            documents = pl.concat(frames) if frames else self.__get_blank_store()
+            return self._serialize(documents, result_format=result_format)
 
-    def get_documents(self, collection: str | None = None):
         if collection is None:
-            return self._serialize(self.store)
+            return self._serialize(self.store, result_format=result_format)
 
-        return self._serialize(self.store.filter(pl.col("collection") == collection))
+        return self._serialize(self.store.filter(pl.col("collection") == collection), result_format=result_format)
+
+    def iter_documents(
+        self,
+        collection: str | None = None,
+        include_embeddings: bool = False,
+        itersize: int = 2000,
+        after: str | None = None,
+    ):
+        """
+        Iterate over the documents ordered by uuid, serializing ``itersize`` rows at a time
+
+        In streaming mode the documents are read in file order and ``after`` is not supported.
+        """
+        if self.scanner is not None:
+            if after is not None:
+                raise ValueError("Keyset pagination is not available in streaming mode")
+
+            columns = None if include_embeddings else [c for c in self.scanner.columns() if c != "embeddings"]
+            for frame in self.scanner.batches(collection, columns=columns):
+                yield from self._serialize(frame)
+            return
+
+        documents = self.store
+
+        if collection is not None:
+            documents = documents.filter(pl.col("collection") == collection)
+
+        if after is not None:
+            documents = documents.filter(pl.col("uuid") > after)
+
+        if not include_embeddings:
+            documents = documents.drop("embeddings")
+
+        for frame in documents.sort("uuid").iter_slices(n_rows=itersize):
+            yield from self._serialize(frame)
 
     def get_document(self, uuid: str):
+        if self.scanner is not None:
+            for frame in self.scanner.batches():
+                frame = frame.filter(pl.col("uuid") == uuid)
+                if frame.height > 0:
+                    return self._serialize(frame.drop("embeddings"))[0]
+            return None
+
         document = self._serialize(
             self.store.filter(pl.col("uuid") == uuid).drop("embeddings")
         )
         return document[0] if len(document) > 0 else None
 
+    def stored(self, uuids: list[str]) -> set[str]:
+        """
+        The uuids of ``uuids`` found in the store, with one pass over the uuid column
+        """
+        if self.scanner is not None:
+            return {uuid for frame in self.scanner.batches() for uuid in frame.filter(pl.col("uuid").is_in(uuids))["uuid"]}
+
+        return set(self.store.filter(pl.col("uuid").is_in(uuids))["uuid"])
+
     def update(self, uuid: str, metadata: dict[str, str]):
         """
         Update the metadata of a document
         """
+        self.update_many([uuid], [metadata])
+
+        return self.get_document(uuid)
 
-        removed_uuid = self.store.filter(pl.col("uuid") != uuid)
-        uuid_df = self.store.filter(pl.col("uuid") == uuid)
+    def update_many(self, uuids: list[str], metadata: list[dict[str, str]]):
+        """
+        Replace the metadata of several documents with a single join over the store
+        """
+        self.__check_writable()
 
-        # replace all metadata columns with empty strings from the uuid_df
-        for key in uuid_df.columns:
-            if key.startswith("metadata__"):
-                uuid_df = uuid_df.with_columns(pl.lit("").alias(key))
+        if len(uuids) != len(metadata):
+            raise ValueError("uuids and metadata must have the same length")
 
-        # add the metadata to the uuid_df
-        for key, value in metadata.items():
-            uuid_df = uuid_df.with_columns(pl.lit(value).alias("metadata__" + key))
+        if not uuids:
+            return
 
-        # combine the two dataframes
-        self.store = removed_uuid.vstack(uuid_df)
+        with self.__lock:
+            with self.metrics.span("update", "write"):
+                self._update_many(uuids, metadata)
+            sequence = self.__log({"op": "update_many", "uuids": list(uuids), "metadata": metadata})
 
-        return self.get_document(uuid)
+        self.__commit(sequence)
+
+    def _update_many(self, uuids: list[str], metadata: list[dict[str, str]]):
+        keys = sorted({key for item in metadata for key in item})
+
+        # keys the store has never seen become columns, empty for the other documents
+        self.store = self.store.with_columns(
+            pl.lit("").alias("metadata__" + key) for key in keys if "metadata__" + key not in self.store.columns
+        )
+
+        columns = [column for column in self.store.columns if column.startswith("metadata__")]
+
+        # the whole metadata is replaced, keys missing from the new metadata are emptied
+        updates = pl.DataFrame(
+            {
+                "uuid": list(uuids),
+                **{column + "__new": [item.get(column[len("metadata__"):], "") for item in metadata] for column in columns},
+            },
+            schema={"uuid": pl.Utf8, **{column + "__new": pl.Utf8 for column in columns}},
+        ).unique(subset="uuid", keep="last", maintain_order=True).with_columns(pl.lit(True).alias("__updated"))
+
+        self.store = (
+            self.store.join(updates, on="uuid", how="left")
+            .with_columns(
+                pl.when(pl.col("__updated")).then(pl.col(column + "__new")).otherwise(pl.col(column)).alias(column)
+                for column in columns
+            )
+            .drop([column + "__new" for column in columns] + ["__updated"])
+        )
+
+    def delete_many(self, uuids: list[str]):
+        """
+        Delete several documents by uuid in a single pass over the store
+        """
+        self.__check_writable()
+
+        if not uuids:
+            return
+
+        with self.__lock:
+            with self.metrics.span("delete", "write"):
+                self.store = self.store.filter(~pl.col("uuid").is_in(list(uuids)))
+                if self.keywords is not None:
+                    self.keywords.remove(list(uuids))
+            sequence = self.__log({"op": "delete", "uuids": list(uuids)})
+
+        self.__commit(sequence)
+
+    def stats(self) -> dict:
+        """
+        Document counts and memory of the store, from the sizes of its buffers and one group by over the collections
+        """
+        if self.scanner is not None:
+            return self.__file_stats()
+
+        store = self.store
+        metadata_columns = [column for column in store.columns if column.startswith("metadata__")]
+        dimensions = len(store["embeddings"][0]) if store.height else None
+        itemsize = np.dtype(self.dtype).itemsize
+
+        collections = store.groupby("collection", maintain_order=True).agg(
+            pl.count().alias("documents"),
+            pl.col("text").str.lengths().sum().alias("text"),
+            *[pl.col(column).str.lengths().sum().alias(column) for column in metadata_columns],
+        )
+
+        indexes = []
+        if "coarse" in store.columns:
+            indexes.append({"name": "coarse", "type": self.coarse.method, "bytes": store["coarse"].estimated_size()})  # type: ignore
+
+        if self.keywords is not None:
+            indexes.append({"name": "keywords", "type": "bm25", "bytes": self.keywords.postings.estimated_size()})
+
+        wal_bytes = 0
+        if self.wal is not None:
+            wal_bytes = sum(os.path.getsize(self.wal.path(segment)) for segment in self.wal.segments())
+
+        return {
+            "engine": "polars",
+            "documents": store.height,
+            "dimensions": dimensions,
+            "dtype": self.dtype,
+            "bytes": {
+                "vectors": store["embeddings"].estimated_size(),
+                "text": store["text"].estimated_size(),
+                "metadata": sum(store[column].estimated_size() for column in metadata_columns),
+                "index": sum(index["bytes"] for index in indexes),
+                "total": store.estimated_size(),
+                "wal": wal_bytes,
+            },
+            "indexes": indexes,
+            # vstack appends chunks, a store split in many of them is slower to search until it is saved and loaded
+            "chunks": store.n_chunks(),
+            # deletes rewrite the frame, no deleted rows are kept
+            "tombstone_ratio": 0.0,
+            "collections": {
+                row["collection"]: {
+                    "documents": row["documents"],
+                    "bytes": {
+                        "vectors": row["documents"] * (dimensions or 0) * itemsize,
+                        "text": row["text"] or 0,
+                        "metadata": sum(row[column] or 0 for column in metadata_columns),
+                    },
+                }
+                for row in collections.iter_rows(named=True)
+            },
+        }
+
+    def __file_stats(self) -> dict:
+        """
+        Stats of a store searched from its parquet file, read from the file footer and the collection column
+        """
+        metadata = pq.ParquetFile(self.settings.file).metadata
+        sizes: dict[str, int] = {}
+
+        for group in range(metadata.num_row_groups):
+            row_group = metadata.row_group(group)
+            for index in range(row_group.num_columns):
+                column = row_group.column(index)
+                name = column.path_in_schema.split(".")[0]
+                sizes[name] = sizes.get(name, 0) + column.total_uncompressed_size
+
+        collections = pl.scan_parquet(self.settings.file).groupby("collection", maintain_order=True).agg(pl.count().alias("documents")).collect()
+
+        return {
+            "engine": "polars",
+            "documents": metadata.num_rows,
+            "dimensions": None,
+            "dtype": self.dtype,
+            "bytes": {
+                "vectors": sizes.get("embeddings", 0),
+                "text": sizes.get("text", 0),
+                "metadata": sum(size for name, size in sizes.items() if name.startswith("metadata__")),
+                "index": 0,
+                "total": sum(sizes.values()),
+                "file": os.path.getsize(self.settings.file),
+            },
+            "indexes": [],
+            "chunks": metadata.num_row_groups,
+            "tombstone_ratio": 0.0,
+            "collections": {row["collection"]: {"documents": row["documents"]} for row in collections.iter_rows(named=True)},
+        }
 
     def save(self):
         """
-        Save the dataframe
+        Save the dataframe, with the write-ahead log enabled this is a checkpoint
+        """
+        self.__check_writable()
+
+        if self.wal is not None:
+            self.checkpoint()
+            return
+
+        with self.__lock:
+            store, postings = self.store, self.keywords.postings if self.keywords is not None else None
+
+        with self.metrics.span("save", "write"):
+            self.__write_snapshot(store, postings=postings)
+
+    def checkpoint(self):
+        """
+        Snapshot the store and drop the log segments it covers, writes are only blocked while the log is rotated
+        """
+        if self.wal is None:
+            raise ValueError("Checkpoints require the write-ahead log, enable it with polars={'wal': True}")
+
+        with self.__checkpoint_lock:
+            with self.__lock:
+                # the store is never modified in place, this reference is a consistent snapshot
+                store = self.store
+                postings = self.keywords.postings if self.keywords is not None else None
+                covered = self.wal.rotate()
+
+            with self.metrics.span("checkpoint", "write"):
+                self.__write_snapshot(store, covered, postings)
+
+            self.wal.remove(upto=covered)
+
+    def close(self):
+        """
+        Stop the background checkpointer, write a last checkpoint and close the log
+        """
+        if self.wal is None:
+            return
+
+        self.__stop.set()
+        if self.__checkpointer is not None:
+            self.__checkpointer.join()
+            self.__checkpointer = None
+
+        self.checkpoint()
+        self.wal.close()
+        self.wal = None
+
+    def __checkpoint_loop(self, interval: float):
+        while not self.__stop.wait(interval):
+            try:
+                self.checkpoint()
+            except Exception:
+                # the log still holds every write, the next attempt covers them
+                self.metrics.count("checkpoint_errors", 1, "checkpoint")
+
+    def __write_snapshot(self, store: pl.DataFrame, covered: int | None = None, postings: pl.DataFrame | None = None):
+        """
+        Write the store next to the current file and rename it over, a crash never leaves a partial store
         """
-        self.store.write_parquet(self.settings.file)
+        os.makedirs(self.settings.folder, exist_ok=True)  # type: ignore
+
+        # the coarse copies are recomputed on load, only the pca projection is saved
+        table = (store.drop("coarse") if "coarse" in store.columns else store).to_arrow()
+        metadata = {**(table.schema.metadata or {})}
+
+        if self.coarse is not None:
+            metadata.update(self.coarse.state())
+
+        if covered is not None:
+            # load() replays only the log segments written after this one
+            metadata[b"verusdb.wal_segment"] = str(covered).encode()
+
+        if postings is not None:
+            # written first, the token tells load() whether the postings match the store file next to them
+            token: str = generate_uuid()  # type: ignore
+            _replace_file(self.keywords.table(postings, token), self.__keywords_file())  # type: ignore
+            metadata[b"verusdb.keywords"] = token.encode()
+
+        table = table.replace_schema_metadata(metadata)
+
+        # min/max statistics let the streaming mode skip row groups that can not match
+        _replace_file(table, self.settings.file, row_group_size=self.settings.polars_row_group_size, write_statistics=True)
+        _fsync_folder(self.settings.folder)  # type: ignore
+
+
+def _replace_file(table, path: str, **options):
+    """
+    Write a parquet file next to ``path`` and rename it over once it is on disk
+    """
+    temporary = path + ".tmp"
+    pq.write_table(table, temporary, **options)
+
+    with open(temporary, "rb") as file:
+        os.fsync(file.fileno())
+
+    os.replace(temporary, path)
+
+
+def _fsync_folder(folder: str):
+    """
+    Persist a rename, directories can not be opened on windows and the rename is durable there
+    """
+    try:
+        descriptor = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
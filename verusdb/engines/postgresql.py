@@ -1,10 +1,15 @@
 from __future__ import annotations
+import io
 import psycopg2
 import json
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import Json, RealDictCursor, execute_values
+from psycopg2.errors import QueryCanceled, UniqueViolation
 from verusdb.engines import BaseEngine
+from verusdb.deadline import Deadline
 from verusdb.settings import Settings
 from verusdb.utils import generate_uuid
+from verusdb.filters import Filter, compile_filters
+from verusdb.results import format_frame, frame_from_documents, validate_result_format
 
 
 class PostgreSQLEngine(BaseEngine):
@@ -14,14 +19,24 @@ class PostgreSQLEngine(BaseEngine):
         """
         self.settings = settings
         self.embeddings_engine = settings.embeddings
+        self.metrics = settings.metrics
         self.pg_host = settings.pg_host
         self.pg_port = settings.pg_port
         self.pg_db = settings.pg_db
         self.username = settings.username
         self.pg_password = settings.pg_password
         self.pg_table = settings.pg_table
+        self.pg_itersize = settings.pg_itersize
+        self.pg_batch_size = settings.pg_batch_size
 
-        self.dimensions = self.embeddings_engine.get_dimensions()  # type: ignore
+        # only needed to create the table, a client reading an existing one can go without embeddings
+        self.dimensions = settings.dimensions or (self.embeddings_engine.get_dimensions() if self.embeddings_engine else None)
+
+        # pgvector distance operator matching Settings.metric, <#> is the negative inner product
+        self.distance_operator = {'cosine': '<=>', 'dot': '<#>', 'l2': '<->'}[settings.metric]
+
+        # pgvector stores vector as float32, halfvec (pgvector 0.7+) as float16
+        self.vector_type = 'halfvec' if settings.dtype == 'float16' else 'vector'
 
         self.connection = self.__get_connection()
 
@@ -41,27 +56,79 @@ class PostgreSQLEngine(BaseEngine):
         
         if results and not results[0]:
             cursor.execute(
-                f"CREATE TABLE {self.pg_table} (uuid varchar(250), collection text, text text, metadata JSON, embeddings vector({self.dimensions}));"
+                f"CREATE TABLE {self.pg_table} (uuid varchar(250), collection text, text text, metadata JSONB, embeddings {self.vector_type}({self.dimensions}));"
             )
-            self.connection.commit()
-            
+        else:
+            # tables created by older versions store the metadata as JSON, which can not be indexed
+            cursor.execute(
+                "SELECT data_type FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s AND column_name = 'metadata';",
+                (self.pg_table,),
+            )
+            column = cursor.fetchone()
+            if column and column[0] == 'json':
+                cursor.execute(
+                    f"ALTER TABLE {self.pg_table} ALTER COLUMN metadata TYPE JSONB USING metadata::jsonb;"
+                )
+
+            # switching the dtype converts the stored vectors in place
+            cursor.execute(
+                "SELECT udt_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s AND column_name = 'embeddings';",
+                (self.pg_table,),
+            )
+            column = cursor.fetchone()
+            if column and column[0] != self.vector_type:
+                cursor.execute(
+                    f"ALTER TABLE {self.pg_table} ALTER COLUMN embeddings TYPE {self.vector_type}({self.dimensions}) USING embeddings::{self.vector_type}({self.dimensions});"
+                )
+
+        # jsonb_path_ops only supports containment (@>), which is all the filters need, and is smaller than the default GIN opclass
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.pg_table}_metadata_idx ON {self.pg_table} USING GIN (metadata jsonb_path_ops);"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.pg_table}_collection_idx ON {self.pg_table} (collection);"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.pg_table}_uuid_idx ON {self.pg_table} (uuid);"
+        )
+        if self.settings.dedup:
+            # content uuids are the hash index, concurrent writers of the same text conflict on it
+            try:
+                cursor.execute(
+                    f"CREATE UNIQUE INDEX IF NOT EXISTS {self.pg_table}_uuid_key ON {self.pg_table} (uuid);"
+                )
+            except UniqueViolation as error:
+                self.connection.rollback()
+                cursor.close()
+                raise ValueError(
+                    f"The table {self.pg_table} already holds documents with the same uuid, deduplicate it before enabling dedup"
+                ) from error
+        self.connection.commit()
             
         cursor.close()
-    def search_text(self, text: str, collection: str | None = None,  filters: dict[str, str] | None = None, top_k: int = 10, return_object: bool | None = None):
+
+    def _where(self, collection: str | None = None, filters: dict[str, str] | Filter | None = None):
         """
-        Search the index for a text string
+        Build a parameterized WHERE clause for the collection and metadata filters
         """
-        # calulate the embedding
-        if self.embeddings_engine is None:
-            raise ValueError('Embeddings Engine is not set')
-        
-        embedding : list[float] = self.embeddings_engine.encode(text)
+        conditions = []
+        params = []
 
-        #perform the search
-        results  = self.search(embedding, collection, filters, top_k)
+        if collection is not None:
+            conditions.append("collection = %s")
+            params.append(collection)
 
-        # Return the top k results
-        return results
+        compiled = compile_filters(filters)
+        if compiled is not None:
+            # equalities are merged into a single metadata @> containment predicate that can use the GIN index
+            sql, values = compiled.to_sql()
+            conditions.append(sql)
+            params.extend(values)
+
+        if not conditions:
+            return "", params
+
+        return "WHERE " + " AND ".join(conditions), params
 
     def _serialize(self, documents):
         return super()._serialize(documents)
@@ -72,51 +139,88 @@ class PostgreSQLEngine(BaseEngine):
         collection: str | None = None,
         embeddings: list[list[float]] | None = None,
         metadata: list[dict[str, str]] | None = None,
+        deduplicated: bool = False,
     ):
-        cursor = self.connection.cursor()
+        if metadata is None:
+            metadata = [{}] * len(texts)
+
+        # duplicates are dropped before anything is encoded
+        uuids, texts, embeddings, metadata = self._new_documents(texts, collection, embeddings, metadata, deduplicated)
+        if not texts:
+            return
 
         if embeddings is None:
-            embeddings = [self.embeddings_engine.encode(text) for text in texts]  # type: ignore
+            with self.metrics.span('add', 'encode'):
+                embeddings = self.embeddings_engine.encode_batch(texts)  # type: ignore
 
-        if metadata is None:
-            metadata = [{}] * len(texts)
+        rows = [
+            (uuid, collection, text, Json(meta), str(list(embedding)))
+            for uuid, text, meta, embedding in zip(uuids, texts, metadata, embeddings)
+        ]
+        query = f"INSERT INTO {self.pg_table} (uuid, collection, text, metadata, embeddings) VALUES %s"
 
-        uuids = generate_uuid(len(texts))
+        if self.settings.dedup == 'upsert':
+            query += " ON CONFLICT (uuid) DO UPDATE SET metadata = EXCLUDED.metadata"
+        elif self.settings.dedup:
+            query += " ON CONFLICT (uuid) DO NOTHING"
 
-        query = f"INSERT INTO {self.pg_table} (uuid, collection, text, metadata, embeddings) VALUES "
-        for uuid, text, meta, embedding in zip(uuids, texts, metadata, embeddings):
-            query += f"('{uuid}','{collection}', '{text}', '{json.dumps(meta)}', '{embedding}'),"
+        template = f"(%s, %s, %s, %s, %s::{self.vector_type})"
+
+        with self.metrics.span('add', 'write'):
+            self.__transaction(
+                lambda cursor: execute_values(cursor, query, rows, template=template, page_size=self.pg_batch_size)
+            )
 
-        query = query[:-1] + ";"
 
-        cursor.execute(query)
-        self.connection.commit()
-        cursor.close()
-        
     def search(
         self,
         embedding: list[float],
         collection: str | None = None,
-        filters: dict[str, str] | None = None,
+        filters: dict[str, str] | Filter | None = None,
         top_k: int = 10,
+        result_format: str = 'dicts',
+        deadline: Deadline | None = None,
     ) :
+        """
+        Nearest documents by the pgvector distance, with a deadline its remaining time is the statement_timeout of the query
+        """
+        validate_result_format(result_format)
 
         cursor = self.connection.cursor(cursor_factory=RealDictCursor)
-        metadata_filters = ""
+        where, params = self._where(collection, filters)
+
+        with self.metrics.span('search', 'query'):
+            try:
+                if deadline is not None:
+                    # SET LOCAL only lasts until the end of the transaction, it is committed below
+                    cursor.execute("SET LOCAL statement_timeout = %s;", (deadline.remaining_ms(),))
+
+                cursor.execute(
+                    f"SELECT uuid, collection, text, metadata FROM {self.pg_table} {where} ORDER BY embeddings {self.distance_operator} %s::{self.vector_type} LIMIT %s;",
+                    params + [str(list(embedding)), top_k],
+                )
+                results = cursor.fetchall()
+
+                if deadline is not None:
+                    self.connection.commit()
+            except QueryCanceled:
+                self.connection.rollback()
+                if deadline is None:
+                    raise
+
+                # postgres has no partial results, a cancelled query returns none
+                deadline.cut()
+                self.metrics.count('deadline_expired', 1, 'search')
+                results = []
+            finally:
+                cursor.close()
+
+        self.metrics.count('rows_returned', len(results), 'search')
         
-        if filters:
-            metadata_filters = "AND metadata->>'{}' = '{}'".format(
-                list(filters.keys())[0], list(filters.values())[0]
-            )
+        return self._format(results, result_format)
 
-        cursor.execute(f"SELECT uuid, collection, text, metadata  FROM {self.pg_table} WHERE collection = '{collection}' {metadata_filters} ORDER BY embeddings <-> '{embedding}' LIMIT {top_k};")
-        results = cursor.fetchall()  
-        cursor.close()
         
-        return results
-
-        
-    def search_text(self, text: str, collection: str | None = None,  filters: dict[str, str] | None = None, top_k: int = 10, return_object: bool | None = None):
+    def search_text(self, text: str, collection: str | None = None,  filters: dict[str, str] | Filter | None = None, top_k: int = 10, return_object: bool | None = None, result_format: str = 'dicts'):
         """
         Search the index for a text string
         """
@@ -124,10 +228,11 @@ class PostgreSQLEngine(BaseEngine):
         if self.embeddings_engine is None:
             raise ValueError('Embeddings Engine is not set')
         
-        embedding : list[float] = self.embeddings_engine.encode(text)
+        with self.metrics.span('search', 'encode'):
+            embedding : list[float] = self.embeddings_engine.encode(text)
 
         #perform the search
-        results  = self.search(embedding, collection, filters, top_k)
+        results  = self.search(embedding, collection, filters, top_k, result_format)
 
         # Return the top k results
         return results
@@ -139,44 +244,270 @@ class PostgreSQLEngine(BaseEngine):
         cursor.close()
 
 
-    def get_documents(self, collection: str | None = None):
-        if collection is None:
-            cursor = self.connection.cursor(cursor_factory=RealDictCursor)
-            cursor.execute(f"SELECT * FROM {self.pg_table};")
-        else:
-            cursor = self.connection.cursor(cursor_factory=RealDictCursor)
-            cursor.execute(
-                f"SELECT * FROM {self.pg_table} WHERE collection = '{collection}';"
-            )
+    def get_documents(self, collection: str | None = None, result_format: str = 'dicts'):
+        validate_result_format(result_format)
+        return self._format(list(self.iter_documents(collection=collection, include_embeddings=True)), result_format)
 
-        result = cursor.fetchall()
-        
-        cursor.close()
+    def _format(self, rows, result_format: str = 'dicts'):
+        """
+        Rows are already dicts with the metadata decoded from JSONB, only the columnar formats need a conversion
+        """
+        if result_format == 'dicts':
+            return rows
 
+        return format_frame(frame_from_documents(rows), result_format)
 
-        return result
+    def iter_documents(self, collection: str | None = None, include_embeddings: bool = False, itersize: int | None = None, after: str | None = None):
+        """
+        Stream the documents through a server-side cursor, ordered by uuid.
+
+        Only ``itersize`` rows are held in memory at a time. Pass the uuid of the
+        last document received as ``after`` to resume an interrupted export.
+        """
+        columns = "uuid, collection, text, metadata"
+        if include_embeddings:
+            columns += ", embeddings"
+
+        where, params = self._where(collection)
+
+        if after is not None:
+            where += (" AND " if where else "WHERE ") + "uuid > %s"
+            params.append(after)
+
+        # named cursors live on the server, only the rows of the current fetch are sent to the client
+        cursor = self.connection.cursor(name=f"verusdb_{generate_uuid().replace('-', '')}", cursor_factory=RealDictCursor)  # type: ignore
+        cursor.itersize = itersize or self.pg_itersize
+
+        try:
+            cursor.execute(f"SELECT {columns} FROM {self.pg_table} {where} ORDER BY uuid;", params)
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+            self.connection.commit()
 
     def get_document(self, uuid: str):
         cursor = self.connection.cursor(cursor_factory=RealDictCursor)
-        cursor.execute(f"SELECT * FROM {self.pg_table} WHERE uuid = '{uuid}';")
+        cursor.execute(f"SELECT * FROM {self.pg_table} WHERE uuid = %s;", (uuid,))
         result = cursor.fetchone()
         cursor.close()
-        self.connection.close()
+        self.connection.commit()
 
         return result
 
-    def update(self, uuid, metadata):
+    def import_batches(self, batches) -> int:
+        """
+        Store record batches of an export with one COPY per batch, keeping their uuids
+        """
+        from verusdb.engines.transfer import split_batch
+
+        imported = 0
         cursor = self.connection.cursor()
-        cursor.execute(
-            f"UPDATE {self.pg_table} SET metadata = '{json.dumps(metadata)}' WHERE uuid = '{uuid}';"
+
+        try:
+            for batch in batches:
+                rows = io.StringIO()
+
+                for collection, uuids, texts, vectors, metadata in split_batch(batch):
+                    for uuid, text, vector, meta in zip(uuids, texts, vectors.tolist(), metadata):
+                        rows.write('\t'.join([
+                            _copy_value(uuid),
+                            _copy_value(collection),
+                            _copy_value(text),
+                            _copy_value(json.dumps(meta)),
+                            '[' + ','.join(map(str, vector)) + ']',
+                        ]) + '\n')
+
+                rows.seek(0)
+                with self.metrics.span('import', 'write'):
+                    cursor.copy_expert(f"COPY {self.pg_table} (uuid, collection, text, metadata, embeddings) FROM STDIN;", rows)
+                    self.connection.commit()
+                imported += batch.num_rows
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        return imported
+
+    def stats(self) -> dict:
+        """
+        Document counts and sizes of the table from the catalog and the planner statistics, no row is read
+
+        The counts per collection are estimated from the most common values of the
+        collection column. The collections left out of them, and every collection when
+        the table was never analyzed, are counted exactly.
+        """
+        cursor = self.connection.cursor()
+
+        try:
+            cursor.execute(
+                "SELECT c.reltuples, c.relpages, pg_relation_size(c.oid), pg_total_relation_size(c.oid), pg_indexes_size(c.oid), "
+                "s.n_live_tup, s.n_dead_tup, a.atttypmod "
+                "FROM pg_class c LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid "
+                "LEFT JOIN pg_attribute a ON a.attrelid = c.oid AND a.attname = 'embeddings' "
+                "WHERE c.oid = %s::regclass;",
+                (self.pg_table,),
+            )
+            reltuples, pages, heap, total, index_bytes, live, dead, typmod = cursor.fetchone()  # type: ignore
+
+            cursor.execute(
+                "SELECT i.relname, am.amname, pg_relation_size(i.oid) FROM pg_index x "
+                "JOIN pg_class i ON i.oid = x.indexrelid JOIN pg_am am ON am.oid = i.relam "
+                "WHERE x.indrelid = %s::regclass ORDER BY i.relname;",
+                (self.pg_table,),
+            )
+            indexes = [{'name': name, 'type': kind, 'bytes': size} for name, kind, size in cursor.fetchall()]
+
+            # the schema comes from the regclass, the table is not necessarily in public
+            cursor.execute(
+                "SELECT s.attname, s.avg_width, s.n_distinct, s.most_common_vals::text::text[], s.most_common_freqs "
+                "FROM pg_stats s JOIN pg_class c ON c.relname = s.tablename "
+                "JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = s.schemaname "
+                "WHERE c.oid = %s::regclass;",
+                (self.pg_table,),
+            )
+            columns = {name: (width, distinct, values, frequencies) for name, width, distinct, values, frequencies in cursor.fetchall()}
+
+            documents = int(live if live is not None else max(reltuples, 0))
+            width = lambda name: columns[name][0] if name in columns else 0
+
+            if 'collection' in columns and columns['collection'][2] is not None:
+                _, distinct, values, frequencies = columns['collection']
+                counts = {value: round(frequency * documents) for value, frequency in zip(values, frequencies)}
+
+                # a negative n_distinct is a fraction of the rows, more distinct values than common ones means some were left out
+                if (distinct if distinct >= 0 else -distinct * documents) > len(values):
+                    cursor.execute(
+                        f"SELECT collection, count(*) FROM {self.pg_table} WHERE collection <> ALL(%s) GROUP BY collection;",
+                        (list(values),),
+                    )
+                    counts.update(cursor.fetchall())
+            else:
+                cursor.execute(f"SELECT collection, count(*) FROM {self.pg_table} GROUP BY collection;")
+                counts = dict(cursor.fetchall())
+        finally:
+            cursor.close()
+            self.connection.commit()
+
+        return {
+            'engine': 'postgres',
+            'documents': documents,
+            'dimensions': typmod if typmod and typmod > 0 else self.dimensions,
+            'dtype': 'float16' if self.vector_type == 'halfvec' else 'float32',
+            'bytes': {
+                'vectors': width('embeddings') * documents,
+                'text': width('text') * documents,
+                'metadata': width('metadata') * documents,
+                'index': index_bytes,
+                'total': total,
+                'heap': heap,
+                'toast': max(total - heap - index_bytes, 0),
+            },
+            'indexes': indexes,
+            'chunks': pages,
+            # dead tuples are only reclaimed by vacuum
+            'tombstone_ratio': dead / (live + dead) if live is not None and live + dead else 0.0,
+            'collections': {
+                collection: {
+                    'documents': count,
+                    'bytes': {
+                        'vectors': width('embeddings') * count,
+                        'text': width('text') * count,
+                        'metadata': width('metadata') * count,
+                    },
+                }
+                for collection, count in counts.items()
+            },
+        }
+
+    def stored(self, uuids: list[str]) -> set[str]:
+        """
+        The uuids of ``uuids`` found in the table, with one indexed lookup
+        """
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(f"SELECT uuid FROM {self.pg_table} WHERE uuid = ANY(%s);", (list(uuids),))
+            return {row[0] for row in cursor.fetchall()}
+        finally:
+            cursor.close()
+            self.connection.commit()
+
+    def update(self, uuid, metadata):
+        """
+        Update the metadata of a document
+        """
+        self.update_many([uuid], [metadata])
+
+        return self.get_document(uuid)
+
+    def update_many(self, uuids: list[str], metadata: list[dict[str, str]]):
+        """
+        Replace the metadata of several documents, one UPDATE ... FROM (VALUES ...) per batch in a single transaction
+        """
+        if len(uuids) != len(metadata):
+            raise ValueError("uuids and metadata must have the same length")
+
+        rows = [(uuid, json.dumps(meta)) for uuid, meta in zip(uuids, metadata)]
+        query = (
+            f"UPDATE {self.pg_table} AS t SET metadata = v.metadata::jsonb "
+            "FROM (VALUES %s) AS v(uuid, metadata) WHERE t.uuid = v.uuid"
         )
-        self.connection.commit()
-        cursor.close()
-        self.connection.close()
 
-    def delete(self, uuid):
+        with self.metrics.span('update', 'write'):
+            self.__transaction(
+                lambda cursor: execute_values(cursor, query, rows, page_size=self.pg_batch_size)
+            )
+
+    def delete_many(self, uuids: list[str]):
+        """
+        Delete several documents by uuid, one DELETE ... WHERE uuid = ANY(%s) per batch in a single transaction
+        """
+        def delete(cursor):
+            for start in range(0, len(uuids), self.pg_batch_size):
+                cursor.execute(
+                    f"DELETE FROM {self.pg_table} WHERE uuid = ANY(%s);",
+                    (list(uuids[start:start + self.pg_batch_size]),),
+                )
+
+        with self.metrics.span('delete', 'write'):
+            self.__transaction(delete)
+
+    def __transaction(self, statements):
+        # every batch is committed together, a failing batch rolls the earlier ones back
         cursor = self.connection.cursor()
-        cursor.execute(f"DELETE FROM {self.pg_table} WHERE uuid = '{uuid}';")
-        self.connection.commit()
+        try:
+            statements(cursor)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def delete(self, uuid: str | None = None, collection: str | None = None, filters: dict[str, str] | Filter | None = None):
+        if uuid is None and collection is None and filters is None:
+            raise ValueError("uuid, collection or filters must be provided")
+
+        where, params = self._where(collection, filters)
+
+        if uuid is not None:
+            where += (" AND " if where else "WHERE ") + "uuid = %s"
+            params.append(uuid)
+
+        cursor = self.connection.cursor()
+        with self.metrics.span('delete', 'write'):
+            cursor.execute(f"DELETE FROM {self.pg_table} {where};", params)
+            self.connection.commit()
         cursor.close()
-        self.connection.close()
+
+
+def _copy_value(value: str | None) -> str:
+    """
+    A field of the COPY text format
+    """
+    if value is None:
+        return '\\N'
+
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
@@ -1,4 +1,7 @@
 from __future__ import annotations
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
 import redis
 import numpy as np
 from redis.commands.search.field import TagField, VectorField, NumericField, TextField
@@ -6,7 +9,9 @@ from redis.commands.search.indexDefinition import IndexDefinition, IndexType
 from redis.commands.search.query import Query
 from verusdb.engines import BaseEngine
 from verusdb.settings import Settings
-from verusdb.utils import generate_uuid
+from verusdb.deadline import Deadline
+from verusdb.filters import Filter, compile_filters
+from verusdb.results import format_frame, frame_from_documents, validate_result_format
 
 class RedisEngine(BaseEngine):
     """
@@ -20,24 +25,55 @@ class RedisEngine(BaseEngine):
         """
         self.settings = settings
         self.embeddings_engine = settings.embeddings
+        self.metrics = settings.metrics
         self.redis_host = settings.redis_host
         self.redis_port = settings.redis_port
         self.redis_db = settings.redis_db
         self.redis_index = settings.redis_index
         self.redis_password = settings.redis_password
         self.redis_doc_prefix = settings.redis_doc_prefix
+        self.redis_batch_size = settings.redis_batch_size
         
-        self.dimensions = self.embeddings_engine.get_dimensions() # type: ignore
+        # only needed to create the index, a client reading an existing one can go without embeddings
+        self.dimensions = settings.dimensions or (self.embeddings_engine.get_dimensions() if self.embeddings_engine else None)
+
+        # RediSearch distance metric matching Settings.metric
+        self.distance_metric = {'cosine': 'COSINE', 'dot': 'IP', 'l2': 'L2'}[settings.metric]
+
+        # FLOAT16 halves the index memory, it requires RediSearch 2.10 or later
+        self.vector_type = (settings.dtype or 'float32').upper()
+        self.vector_dtype = np.dtype(settings.dtype or 'float32')
+
+        # documents are spread over the nodes by a hash of their uuid, every node indexes its own documents
+        self.nodes = settings.redis_nodes or [{}]
+        self.shards: list[redis.Redis] = []
+        self.executor: ThreadPoolExecutor | None = None
 
     def load(self):
         
-        # connect to redis
-        self.store = redis.Redis(host=self.redis_host, port=self.redis_port, db=self.redis_db, password=self.redis_password)
+        # connect to redis, a node inherits the host, port, db and password it does not set
+        self.shards = [
+            redis.Redis(
+                host=node.get('host', self.redis_host),
+                port=node.get('port', self.redis_port),
+                db=node.get('db', self.redis_db),
+                password=node.get('password', self.redis_password),
+            )
+            for node in self.nodes
+        ]
+        self.store = self.shards[0]
 
-        
+        if len(self.shards) > 1 and self.executor is None:
+            # searches fan out to every node at once
+            self.executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix='verusdb-redis')
+
+        for shard in self.shards:
+            self.__create_index(shard)
+
+    def __create_index(self, shard: redis.Redis):
         try:
             # check to see if index exists
-            self.store.ft(self.redis_index).info()
+            shard.ft(self.redis_index).info()
 
         except:
             # schema
@@ -48,9 +84,9 @@ class RedisEngine(BaseEngine):
                 TagField("metadata"),                # Tag Field Name
                 VectorField("embeddings",               # Vector Field Name
                     "HNSW", {                          # Vector Index Type: FLAT or HNSW
-                        "TYPE": "FLOAT32",             # FLOAT32 or FLOAT64
+                        "TYPE": self.vector_type,      # FLOAT16, FLOAT32 or FLOAT64
                         "DIM": self.dimensions,        # Number of Vector Dimensions
-                        "DISTANCE_METRIC": "COSINE",   # Vector Search Distance Metric
+                        "DISTANCE_METRIC": self.distance_metric,   # Vector Search Distance Metric
                     }
                 ),
             )
@@ -59,12 +95,46 @@ class RedisEngine(BaseEngine):
             definition = IndexDefinition(prefix=[self.redis_doc_prefix ], index_type=IndexType.HASH)
 
             # create Index
-            self.store.ft(self.redis_index).create_index(fields=schema, definition=definition)
-        
-        
+            shard.ft(self.redis_index).create_index(fields=schema, definition=definition)
+
+    def _shard(self, uuid: str) -> int:
+        """
+        Index of the node storing a document, crc32 is stable across processes unlike hash()
+        """
+        return zlib.crc32(uuid.encode()) % len(self.nodes) if len(self.nodes) > 1 else 0
+
+    def __route(self, uuids: list[str]) -> dict[int, list[int]]:
+        """
+        Positions of ``uuids`` grouped by the node storing them
+        """
+        routes: dict[int, list[int]] = {}
+        for position, uuid in enumerate(uuids):
+            routes.setdefault(self._shard(uuid), []).append(position)
+        return routes
+
+    def __parallel(self, call, items) -> list:
+        """
+        ``call`` applied to every item, on one thread per node when there are several nodes
+        """
+        if self.executor is None:
+            return [call(item) for item in items]
+        return list(self.executor.map(call, items))
+
+    def __write(self, items: list[dict]):
+        """
+        HSET documents on their nodes, one pipeline per node
+        """
+        routes = self.__route([item['uuid'] for item in items])
+
+        def write(shard: int):
+            pipe = self.shards[shard].pipeline()
+            for position in routes[shard]:
+                pipe.hset(f"{self.redis_doc_prefix}:{items[position]['uuid']}", mapping=items[position])
+            pipe.execute()
 
+        self.__parallel(write, list(routes))
 
-    def add(self, texts: list[str],  collection: str | None = None, embeddings: list[list[float]] | None = None, metadata: list[dict[str, str]] | None = None):
+    def add(self, texts: list[str],  collection: str | None = None, embeddings: list[list[float]] | None = None, metadata: list[dict[str, str]] | None = None, deduplicated: bool = False):
         """
         Add a document to the dataframe
         """
@@ -72,68 +142,270 @@ class RedisEngine(BaseEngine):
         data = []
         
              
-        if embeddings is None:
-            embeddings = [self.embeddings_engine.encode(text) for text in texts] # type: ignore
-        
         if metadata is None:
             metadata = [{}] * len(texts)
-            
-        uuids = generate_uuid(len(texts))
+
+        # duplicates are dropped before anything is encoded
+        uuids, texts, embeddings, metadata = self._new_documents(texts, collection, embeddings, metadata, deduplicated)
+        if not texts:
+            return
+
+        if embeddings is None:
+            with self.metrics.span('add', 'encode'):
+                embeddings = self.embeddings_engine.encode_batch(texts) # type: ignore
         
         for uuid, text, embedding, meta in zip(uuids, texts, embeddings, metadata):
             data.append({
                 'uuid': uuid,
                 'collection': collection,
                 'text': text,
-                'embeddings': np.array(embedding).astype(np.float32).tobytes(),
-                'metadata': ','.join([f'{key}:{value}' for key, value in meta.items()])
+                'embeddings': np.array(embedding).astype(self.vector_dtype).tobytes(),
+                'metadata': _encode_metadata(meta)
             })
 
-        # expand the metadata and add it to the data
-     
-        
         # add the data to the redis index
-        pipe = self.store.pipeline()
-        
-        for i, item in enumerate(data):
-            uuid = item['uuid']
-            pipe.hset(f"{self.redis_doc_prefix}:{uuid}", mapping=item)
-        
+        with self.metrics.span('add', 'write'):
+            self.__write(data)
 
-        pipe.execute()
-            
-            
-        
     def clear(self):
-        self.store.flushdb()            
+        self.__parallel(lambda shard: shard.flushdb(), self.shards)
    
-    def get_documents(self, collection : str | None = None):
+    def get_documents(self, collection : str | None = None, result_format: str = 'dicts'):
         """
         Get all documents from the index
         """
-        query_string = f"@collection:{collection}"
-        query = (Query(f"({query_string})"))
-        
-        
-        results = self.store.ft(self.redis_index).search(query)
-        print(query_string, self.redis_index,results.docs)
-        
-        return self._serialize(results.docs)
+        validate_result_format(result_format)
+        query_string = f"(@collection:{collection})"
+
+        results = self.__parallel(lambda shard: self.__search_all(shard, query_string), self.shards)
+
+        return self._format([doc for documents in results for doc in documents], result_format)
+
+    def __search_all(self, shard: redis.Redis, query_string: str) -> list:
+        """
+        Every document of a shard matching the query, FT.SEARCH only returns 10 of them unless it is paged
+        """
+        documents = []
+
+        while True:
+            result = shard.ft(self.redis_index).search(Query(query_string).paging(len(documents), self.redis_batch_size))
+            documents.extend(result.docs)
+
+            if not result.docs or len(documents) >= result.total:
+                return documents
              
     def get_document(self, uuid: str):
-        
-        return self._serialize(self.store.hgetall(f"{self.redis_doc_prefix}:{uuid}"))
-      
+        shard = self.shards[self._shard(uuid)]
+        return next(self.__fetch(shard, [f"{self.redis_doc_prefix}:{uuid}"], None, False), None)
+
+    def iter_documents(self, collection: str | None = None, include_embeddings: bool = False, itersize: int = 1000, after: str | None = None):
+        """
+        Iterate over the documents with SCAN, fetching ``itersize`` hashes per pipeline
+
+        The documents come in no particular order, ``after`` is not supported.
+        """
+        if after is not None:
+            raise ValueError("Keyset pagination is not available with the redis engine")
+
+        for shard in self.shards:
+            keys = []
+            for key in shard.scan_iter(match=f"{self.redis_doc_prefix}:*", count=itersize):
+                keys.append(key)
+                if len(keys) >= itersize:
+                    yield from self.__fetch(shard, keys, collection, include_embeddings)
+                    keys = []
+
+            if keys:
+                yield from self.__fetch(shard, keys, collection, include_embeddings)
+
+    def __fetch(self, shard: redis.Redis, keys: list, collection: str | None, include_embeddings: bool):
+        pipe = shard.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+
+        for fields in pipe.execute():
+            # deleted since the scan returned its key
+            if not fields:
+                continue
+
+            fields = {key.decode(): value for key, value in fields.items()}
+            if collection is not None and fields['collection'].decode() != collection:
+                continue
+
+            document = {
+                'uuid': fields['uuid'].decode(),
+                'collection': fields['collection'].decode(),
+                'text': fields['text'].decode(),
+                'metadata': _decode_metadata(fields['metadata'].decode()),
+            }
+            if include_embeddings:
+                document['embeddings'] = np.frombuffer(fields['embeddings'], dtype=self.vector_dtype).tolist()
+
+            yield document
+
+    def import_batches(self, batches) -> int:
+        """
+        Store record batches of an export with one pipeline per batch and node, keeping their uuids
+        """
+        from verusdb.engines.transfer import split_batch
+
+        imported = 0
 
-    def delete(self, uuid: str | None = None,  collection: str | None = None, filters: dict[str, str] | None = None):
+        for batch in batches:
+            items = []
+
+            for collection, uuids, texts, vectors, metadata in split_batch(batch):
+                vectors = vectors.astype(self.vector_dtype)
+                for uuid, text, vector, meta in zip(uuids, texts, vectors, metadata):
+                    items.append({
+                        'uuid': uuid,
+                        'collection': collection,
+                        'text': text,
+                        'embeddings': vector.tobytes(),
+                        'metadata': _encode_metadata(meta),
+                    })
+
+            with self.metrics.span('import', 'write'):
+                self.__write(items)
+            imported += batch.num_rows
+
+        return imported
+
+    def stats(self) -> dict:
+        """
+        Document counts and memory of the index from FT.INFO, the collections are counted with one FT.AGGREGATE
+
+        With several nodes the numbers are summed, ``shards`` has the documents of every node.
+        """
+        from redis.commands.search import reducers
+        from redis.commands.search.aggregation import AggregateRequest
+
+        request = AggregateRequest('*').load('@collection').group_by('@collection', reducers.count().alias('documents'))
+
+        def shard_stats(shard: redis.Redis):
+            search = shard.ft(self.redis_index)
+            rows = [dict(zip(*[iter(_decode(value) for value in row)] * 2)) for row in search.aggregate(request).rows]
+            return search.info(), rows, int(shard.info('memory').get('used_memory', 0))
+
+        results = self.__parallel(shard_stats, self.shards)
+
+        # numeric FT.INFO fields summed over the nodes
+        total = lambda name: sum(float(info.get(name, 0) or 0) for info, _, _ in results)
+        megabytes = lambda name: int(total(name) * 1024 * 1024)
+
+        collections: dict[str, dict] = {}
+        for _, rows, _ in results:
+            for row in rows:
+                collection = collections.setdefault(row['collection'], {'documents': 0})
+                collection['documents'] += int(row['documents'])
+
+        itemsize = self.vector_dtype.itemsize
+        for collection in collections.values():
+            collection['bytes'] = {'vectors': collection['documents'] * (self.dimensions or 0) * itemsize}
+
+        documents = int(total('num_docs'))
+        # every delete or rewrite of a hash leaves its old document id behind until the garbage collector runs
+        max_doc_id = int(total('max_doc_id'))
+
+        return {
+            'engine': 'redis',
+            'documents': documents,
+            'dimensions': self.dimensions,
+            'dtype': self.vector_dtype.name,
+            'bytes': {
+                'vectors': megabytes('vector_index_sz_mb'),
+                # the fields of the hashes are not accounted separately by redis
+                'text': None,
+                'metadata': None,
+                'index': megabytes('inverted_sz_mb') + megabytes('vector_index_sz_mb') + megabytes('doc_table_size_mb'),
+                'total': sum(memory for _, _, memory in results),
+            },
+            'indexes': [{'name': self.redis_index, 'type': 'HNSW', 'bytes': megabytes('vector_index_sz_mb')}],
+            'chunks': int(total('total_inverted_index_blocks')),
+            'tombstone_ratio': 1 - documents / max_doc_id if max_doc_id else 0.0,
+            'collections': collections,
+            'shards': [
+                {'node': f"{node.get('host', self.redis_host)}:{node.get('port', self.redis_port)}", 'documents': int(info.get('num_docs', 0))}
+                for node, (info, _, _) in zip(self.nodes, results)
+            ],
+        }
+
+    def stored(self, uuids: list[str]) -> set[str]:
+        """
+        The uuids of ``uuids`` found in the store, the document keys are checked in one pipeline per node
+        """
+        return {uuids[position] for position in self.__existing(uuids)}
+
+    def __existing(self, uuids: list[str]) -> set[int]:
+        """
+        Positions of the uuids whose document exists
+        """
+        routes = self.__route(uuids)
+
+        def exists(shard: int):
+            pipe = self.shards[shard].pipeline(transaction=False)
+            for position in routes[shard]:
+                pipe.exists(f"{self.redis_doc_prefix}:{uuids[position]}")
+            return [position for position, found in zip(routes[shard], pipe.execute()) if found]
+
+        return {position for positions in self.__parallel(exists, list(routes)) for position in positions}
+
+    def update(self, uuid: str, metadata: dict[str, str]):
+        """
+        Update the metadata of a document
+        """
+        self.update_many([uuid], [metadata])
+
+        return self.get_document(uuid)
+
+    def update_many(self, uuids: list[str], metadata: list[dict[str, str]]):
+        """
+        Replace the metadata of several documents with one pipeline per batch
+        """
+        if len(uuids) != len(metadata):
+            raise ValueError("uuids and metadata must have the same length")
+
+        with self.metrics.span('update', 'write'):
+            for start in range(0, len(uuids), self.redis_batch_size):
+                batch = uuids[start:start + self.redis_batch_size]
+
+                # HSET would create a hash without text or embeddings for a missing document
+                existing = self.__existing(batch)
+                routes = self.__route(batch)
+
+                def update(shard: int):
+                    pipe = self.shards[shard].pipeline(transaction=False)
+                    for position in routes[shard]:
+                        if position in existing:
+                            pipe.hset(f"{self.redis_doc_prefix}:{batch[position]}", 'metadata', _encode_metadata(metadata[start + position]))
+                    pipe.execute()
+
+                self.__parallel(update, list(routes))
+
+    def delete_many(self, uuids: list[str]):
+        """
+        Delete several documents by uuid, one DEL per batch
+        """
+        with self.metrics.span('delete', 'write'):
+            for start in range(0, len(uuids), self.redis_batch_size):
+                batch = uuids[start:start + self.redis_batch_size]
+                routes = self.__route(batch)
+
+                self.__parallel(
+                    lambda shard: self.shards[shard].delete(*[f"{self.redis_doc_prefix}:{batch[position]}" for position in routes[shard]]),
+                    list(routes),
+                )
+
+    def delete(self, uuid: str | None = None,  collection: str | None = None, filters: dict[str, str] | Filter | None = None):
         """
         Delete documents from the index based on filters
         """
         if collection is None and filters is None and uuid is None:
-            ValueError("Must provide either a collection, filters or uuid")
+            raise ValueError("Must provide either a collection, filters or uuid")
                    
         if uuid:
-            self.store.delete(f"{self.redis_doc_prefix}:{uuid}")
+            with self.metrics.span('delete', 'write'):
+                self.shards[self._shard(uuid)].delete(f"{self.redis_doc_prefix}:{uuid}")
             return True   
             
         
@@ -141,21 +413,26 @@ class RedisEngine(BaseEngine):
         query_string = f"@collection:{collection}"
 
         
-        if filters:
-            for key, value in filters.items():
-                query_string += f" @metadata:{key}:{value}"
+        compiled = compile_filters(filters)
+        if compiled is not None:
+            query_string += " " + compiled.to_redis()
                 
         query = (Query(f"({query_string})=>[DEL]"))
         
-        self.store.ft(self.redis_index).search(query)
+        with self.metrics.span('delete', 'write'):
+            self.__parallel(lambda shard: shard.ft(self.redis_index).search(query), self.shards)
         
         return True
         
         
     
 
-    def search(self,  embedding: list[float], collection: str | None = None, filters: dict[str, str] | None = None, top_k: int = 10, return_objects: bool = False):
-        
+    def search(self,  embedding: list[float], collection: str | None = None, filters: dict[str, str] | Filter | None = None, top_k: int = 10, return_objects: bool = False, result_format: str = 'dicts', deadline: Deadline | None = None):
+        """
+        KNN search of every node, with a deadline its remaining time is the TIMEOUT of the query
+        """
+        validate_result_format(result_format)
+
         # build the query
         query_string = f"@collection:{collection}"
         # query_string = '*'
@@ -163,9 +440,9 @@ class RedisEngine(BaseEngine):
         
         return_fields = ['uuid','collection', 'text', 'metadata', 'score']
         
-        if filters:
-            for key, value in filters.items():
-                query_string += f" @metadata:{key}:{value}"
+        compiled = compile_filters(filters)
+        if compiled is not None:
+            query_string += " " + compiled.to_redis()
         
             
         # create the query for the embedding, filters and collection
@@ -179,26 +456,58 @@ class RedisEngine(BaseEngine):
              )
         
         
-        query_params = {"vec": np.array(embedding).astype(np.float32).tobytes()}
-        
-        results = self.store.ft(self.redis_index).search(query, query_params) # type: ignore
+        query_params = {"vec": np.array(embedding).astype(self.vector_dtype).tobytes()}
+
+        if deadline is not None:
+            query.timeout(deadline.remaining_ms())
+
+        with self.metrics.span('search', 'query'):
+            # every node returns its own top_k, the closest top_k of all of them are kept
+            shards = self.__parallel(lambda shard: self.__knn(shard, query, query_params, deadline), self.shards) # type: ignore
+
+        if len(shards) == 1:
+            results = shards[0]
+        else:
+            docs = sorted((doc for result in shards for doc in result.docs), key=lambda doc: float(doc.score))[:top_k]
+            results = SimpleNamespace(total=sum(result.total for result in shards), docs=docs)
+
+        self.metrics.count('rows_returned', len(results.docs), 'search') # type: ignore
                 
         if return_objects:
             return results
         
-        return self._serialize(results.docs)
+        with self.metrics.span('search', 'serialize'):
+            return self._format(results.docs, result_format, include_score=True) # type: ignore
         
     
 
-    def search_text(self, text: str, collection: str | None = None,  filters: dict[str, str] | None = None, top_k: int = 10, return_object: bool = False):
+    def __knn(self, shard: redis.Redis, query: Query, query_params: dict, deadline: Deadline | None):
+        try:
+            results = shard.ft(self.redis_index).search(query, query_params) # type: ignore
+        except redis.ResponseError as error:
+            # with ON_TIMEOUT FAIL the node answers an error instead of its partial results
+            if deadline is None or 'timeout' not in str(error).lower():
+                raise
+            deadline.cut()
+            return SimpleNamespace(total=0, docs=[])
+
+        # with the default ON_TIMEOUT RETURN a node silently returns what it found before the timeout
+        if deadline is not None and deadline.expired:
+            deadline.cut()
+
+        return results
+
+    def search_text(self, text: str, collection: str | None = None,  filters: dict[str, str] | Filter | None = None, top_k: int = 10, return_object: bool = False, result_format: str = 'dicts'):
         """
         Search the index for a text string
         """
+        validate_result_format(result_format)
         # calulate the embedding
         if self.embeddings_engine is None:
             raise ValueError('Embeddings Engine is not set')
         
-        embedding : list[float] = self.embeddings_engine.encode(text)
+        with self.metrics.span('search', 'encode'):
+            embedding : list[float] = self.embeddings_engine.encode(text)
 
         #perform the search
         results  = self.search(embedding, collection, filters, top_k, True)
@@ -207,7 +516,8 @@ class RedisEngine(BaseEngine):
         if return_object:
             return results
         
-        return self._serialize(results.docs) # type: ignore
+        with self.metrics.span('search', 'serialize'):
+            return self._format(results.docs, result_format, include_score=True) # type: ignore
         
         # Return the top k results
 
@@ -226,7 +536,7 @@ class RedisEngine(BaseEngine):
                 'uuid': doc['uuid'],
                 'collection': doc['collection'],
                 'text': doc['text'],
-                'metadata': {key: value for key, value in [item.split(':') for item in doc['metadata'].split(',')]} if doc['metadata'] else {},
+                'metadata': _decode_metadata(doc['metadata']),
             }
             
             if include_score:
@@ -240,6 +550,15 @@ class RedisEngine(BaseEngine):
         
        
     
+    def _format(self, documents, result_format: str = 'dicts', include_score: bool = False):
+        """
+        Serialize the redis output in the requested result format, the score is only kept by the columnar formats
+        """
+        if result_format == 'dicts':
+            return self._serialize(documents)
+
+        return format_frame(frame_from_documents(self._serialize(documents, include_score)), result_format)
+
     def save(self):
         """
         No need to save the index
@@ -247,4 +566,22 @@ class RedisEngine(BaseEngine):
         
         pass
 
-    
\ No newline at end of file
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+        for shard in self.shards:
+            shard.close()
+
+
+def _encode_metadata(metadata: dict[str, str]) -> str:
+    return ','.join([f'{key}:{value}' for key, value in metadata.items()])
+
+
+def _decode_metadata(metadata: str) -> dict[str, str]:
+    return dict(item.split(':', 1) for item in metadata.split(',')) if metadata else {}
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
@@ -0,0 +1,79 @@
+# Description: Registry of the storage engines, resolved lazily by name
+from __future__ import annotations
+import importlib
+
+# third party packages expose engines with an entry point in this group, e.g.
+# [tool.poetry.plugins."verusdb.engines"]
+# lancedb = "verusdb_lancedb:LanceDBEngine"
+ENTRY_POINT_GROUP = 'verusdb.engines'
+
+# the driver of an engine is only imported when a client uses it
+_ENGINES: dict[str, str | type] = {
+    'polars': 'verusdb.engines.polars:PolarsEngine',
+    'redis': 'verusdb.engines.redis:RedisEngine',
+    'postgres': 'verusdb.engines.postgresql:PostgreSQLEngine',
+    'tiered': 'verusdb.engines.tiered:TieredEngine',
+}
+
+
+def register_engine(name: str, engine: str | type):
+    """
+    Register an engine class, or a 'module:Class' path imported on first use
+    """
+    _ENGINES[name] = engine
+
+
+def unregister_engine(name: str):
+    """
+    Remove an engine registered with register_engine, entry points are not affected
+    """
+    _ENGINES.pop(name, None)
+
+
+def available_engines() -> list[str]:
+    return sorted(set(_ENGINES) | {entry_point.name for entry_point in _entry_points()})
+
+
+def is_registered(name: str | None) -> bool:
+    if name is None:
+        return False
+    return name in _ENGINES or any(entry_point.name == name for entry_point in _entry_points())
+
+
+def get_engine(name: str) -> type:
+    """
+    The engine class registered under ``name``, importing its module if needed
+    """
+    engine = _ENGINES.get(name)
+
+    if engine is None:
+        for entry_point in _entry_points():
+            if entry_point.name == name:
+                engine = entry_point.value
+                break
+        else:
+            raise ValueError(f'Invalid engine {name}, expected one of {", ".join(available_engines())}')
+
+    if isinstance(engine, str):
+        module, _, attribute = engine.partition(':')
+        try:
+            engine = getattr(importlib.import_module(module), attribute)
+        except ImportError as error:
+            raise ImportError(f'The {name} engine requires {error.name or error}, install it to use this engine') from error
+
+        # later lookups skip the import machinery
+        _ENGINES[name] = engine
+
+    return engine  # type: ignore
+
+
+def _entry_points() -> list:
+    # importlib.metadata is slow to import, it is only needed for engines that are not built in
+    from importlib import metadata
+
+    entry_points = metadata.entry_points()
+
+    # python < 3.10 returns a dict of groups
+    if hasattr(entry_points, 'select'):
+        return list(entry_points.select(group=ENTRY_POINT_GROUP))
+    return list(entry_points.get(ENTRY_POINT_GROUP, []))  # type: ignore
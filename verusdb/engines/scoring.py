@@ -0,0 +1,129 @@
+from __future__ import annotations
+import numpy as np
+import polars as pl
+
+# polars has no half precision type, float16 vectors are stored as their uint16 bit patterns
+POLARS_DTYPES = {'float64': pl.Float64, 'float32': pl.Float32, 'float16': pl.UInt16}
+
+# rows converted to float32 at a time when scoring half precision vectors
+SCORE_CHUNK_SIZE = 65536
+
+
+def descending(metric: str) -> bool:
+    """
+    Whether higher scores are better, l2 scores are distances
+    """
+    return metric != 'l2'
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scale every row to unit length, zero rows are left untouched
+    """
+    if vectors.dtype == np.float16:
+        vectors = vectors.astype(np.float32)
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def to_matrix(series: pl.Series) -> np.ndarray:
+    """
+    Convert a list column of equal length vectors to a 2D matrix without going through python lists
+    """
+    if len(series) == 0:
+        return np.empty((0, 0))
+
+    matrix = series.explode().to_numpy().reshape(len(series), -1)
+
+    if matrix.dtype == np.uint16:
+        return matrix.view(np.float16)
+
+    return matrix
+
+
+def to_series(name: str, matrix: np.ndarray, dtype: str | None = None) -> pl.Series:
+    """
+    Convert a 2D matrix back to a list column, optionally casting it to a storage dtype
+    """
+    if dtype is not None:
+        matrix = matrix.astype(dtype)
+
+    if matrix.dtype == np.float16:
+        matrix = matrix.view(np.uint16)
+
+    return pl.Series(name, matrix.ravel()).reshape(matrix.shape)
+
+
+def prepare_query(embedding: list[float] | np.ndarray, metric: str) -> np.ndarray:
+    query = np.asarray(embedding, dtype=np.float64)
+
+    if metric == 'cosine':
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            raise ValueError('The embedding cannot be a zero vector')
+        query = query / norm
+
+    return query
+
+
+def score(matrix: np.ndarray, query: np.ndarray, metric: str) -> np.ndarray:
+    """
+    Score the rows of ``matrix`` against a prepared query.
+
+    For cosine the rows must already be normalized, so it is a plain dot product.
+    """
+    if matrix.shape[0] == 0:
+        return np.empty(0)
+
+    if matrix.dtype == np.float16:
+        # half precision is only a storage format, accumulate in float32 one chunk at a time
+        query = query.astype(np.float32)
+        return np.concatenate([
+            _score(matrix[offset:offset + SCORE_CHUNK_SIZE].astype(np.float32), query, metric)
+            for offset in range(0, matrix.shape[0], SCORE_CHUNK_SIZE)
+        ])
+
+    if matrix.dtype == np.float32:
+        query = query.astype(np.float32)
+
+    return _score(matrix, query, metric)
+
+
+def score_many(matrix: np.ndarray, queries: np.ndarray, metric: str) -> np.ndarray:
+    """
+    Score the rows of ``matrix`` against several prepared queries at once, one column per query
+    """
+    if matrix.shape[0] == 0:
+        return np.empty((0, queries.shape[0]))
+
+    if matrix.dtype == np.float16:
+        queries = queries.astype(np.float32)
+        return np.concatenate([
+            _score_many(matrix[offset:offset + SCORE_CHUNK_SIZE].astype(np.float32), queries, metric)
+            for offset in range(0, matrix.shape[0], SCORE_CHUNK_SIZE)
+        ])
+
+    if matrix.dtype == np.float32:
+        queries = queries.astype(np.float32)
+
+    return _score_many(matrix, queries, metric)
+
+
+def _score_many(matrix: np.ndarray, queries: np.ndarray, metric: str) -> np.ndarray:
+    products = matrix @ queries.T
+
+    if metric == 'l2':
+        # |a - b|^2 = |a|^2 - 2 a.b + |b|^2, clipped against rounding below zero
+        squared = (matrix * matrix).sum(axis=1)[:, None] - 2 * products + (queries * queries).sum(axis=1)[None, :]
+        return np.sqrt(np.maximum(squared, 0))
+
+    return products
+
+
+def _score(matrix: np.ndarray, query: np.ndarray, metric: str) -> np.ndarray:
+    if metric == 'l2':
+        return np.linalg.norm(matrix - query, axis=1)
+
+    return matrix @ query
@@ -0,0 +1,150 @@
+from __future__ import annotations
+import polars as pl
+import pyarrow.parquet as pq
+from verusdb.metrics import MetricsRecorder
+from verusdb.filters import Filter, compile_filters
+from verusdb.deadline import Deadline
+from verusdb.engines.scoring import descending, normalize, prepare_query, score, to_matrix
+
+
+class ParquetScanner:
+    """
+    Search a parquet store batch by batch without loading it in memory.
+
+    Row groups whose statistics rule out the collection or the metadata filters
+    are skipped, the remaining ones are read ``batch_size`` rows at a time and
+    merged into a running top k, so the peak memory depends on the batch size
+    and not on the size of the store.
+    """
+
+    def __init__(self, path: str, batch_size: int = 65536, metrics: MetricsRecorder | None = None, metric: str = "cosine"):
+        self.path = path
+        self.batch_size = batch_size
+        self.metric = metric
+        self.metrics = metrics or MetricsRecorder()
+
+    def columns(self) -> list[str]:
+        return pq.ParquetFile(self.path).schema_arrow.names
+
+    def __equalities(self, collection: str | None, compiled: Filter | None) -> dict[str, str]:
+        equalities = {}
+
+        if collection is not None:
+            equalities["collection"] = collection
+
+        if compiled is not None:
+            for key, value in compiled.equalities().items():
+                equalities["metadata__" + key] = value
+
+        return equalities
+
+    def __row_groups(self, file: pq.ParquetFile, equalities: dict[str, str]) -> list[int]:
+        """
+        Indexes of the row groups that may contain matching rows according to their min/max statistics
+        """
+        names = file.schema_arrow.names
+        row_groups = []
+
+        for index in range(file.metadata.num_row_groups):
+            row_group = file.metadata.row_group(index)
+            keep = True
+
+            for column, value in equalities.items():
+                statistics = row_group.column(names.index(column)).statistics
+                if statistics is not None and statistics.has_min_max and not statistics.min <= value <= statistics.max:
+                    keep = False
+                    break
+
+            if keep:
+                row_groups.append(index)
+
+        return row_groups
+
+    def batches(
+        self,
+        collection: str | None = None,
+        filters: dict[str, str] | Filter | None = None,
+        columns: list[str] | None = None,
+    ):
+        """
+        Yield the matching rows as frames of at most ``batch_size`` rows
+        """
+        file = pq.ParquetFile(self.path)
+        compiled = compile_filters(filters)
+        equalities = self.__equalities(collection, compiled)
+
+        # a filter on a metadata key that was never stored can not match anything
+        if any(column not in file.schema_arrow.names for column in equalities):
+            return
+
+        row_groups = self.__row_groups(file, equalities)
+        self.metrics.count("row_groups_skipped", file.metadata.num_row_groups - len(row_groups), "search")
+
+        if not row_groups:
+            return
+
+        predicate = None
+
+        if collection is not None:
+            predicate = pl.col("collection") == collection
+
+        if compiled is not None:
+            expression = compiled.to_polars(file.schema_arrow.names)
+            predicate = expression if predicate is None else predicate & expression
+
+        for batch in file.iter_batches(batch_size=self.batch_size, row_groups=row_groups, columns=columns):
+            frame = pl.from_arrow(batch)
+
+            if predicate is not None:
+                frame = frame.filter(predicate.fill_null(False))  # type: ignore
+
+            if frame.height > 0:  # type: ignore
+                yield frame
+
+    def search(
+        self,
+        embedding: list[float],
+        collection: str | None = None,
+        filters: dict[str, str] | Filter | None = None,
+        top_k: int = 10,
+        deadline: Deadline | None = None,
+    ) -> pl.DataFrame | None:
+        """
+        Score every matching batch and keep the running top k, best first
+
+        With a deadline the scan stops at the first batch read after it expired.
+        """
+        query = prepare_query(embedding, self.metric)
+        order = descending(self.metric)
+        best = None
+
+        for frame in self.batches(collection, filters):
+            if best is not None and deadline is not None and deadline.expired:
+                deadline.cut()
+                self.metrics.count("deadline_expired", 1, "search")
+                break
+
+            self.metrics.count("documents_scanned", frame.height, "search")
+
+            with self.metrics.span("search", "score"):
+                vectors = to_matrix(frame["embeddings"])
+
+                # files written by older versions may hold raw vectors
+                if self.metric == "cosine":
+                    vectors = normalize(vectors)
+
+                scores = score(vectors, query, self.metric)
+
+                candidates = (
+                    frame.drop("embeddings")
+                    .with_columns(pl.Series("score", scores))
+                    .sort("score", descending=order)
+                    .head(top_k)
+                )
+
+                if best is None:
+                    best = candidates
+                else:
+                    best = pl.concat([best, candidates]).sort("score", descending=order).head(top_k)
+
+        return best
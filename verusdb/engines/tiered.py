@@ -0,0 +1,379 @@
+from __future__ import annotations
+import json
+import threading
+import time
+import numpy as np
+from verusdb.deadline import Deadline
+from verusdb.engines import BaseEngine
+from verusdb.engines.polars import PolarsEngine
+from verusdb.engines.registry import get_engine
+from verusdb.filters import Filter
+from verusdb.settings import Settings
+
+
+class TierStats:
+    """
+    Searches of a collection served by the hot and the cold tier
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.promotions = 0
+        self.evictions = 0
+        # searches since the collection was last written, they decide promotions and lfu evictions
+        self.accesses = 0
+        self.last_access = 0.0
+        self.size = 0
+        self.hot = False
+        # set when the collection does not fit in the memory budget, cleared by the next write to it
+        self.oversized = False
+
+    @property
+    def searches(self) -> int:
+        return self.hits + self.misses
+
+    def to_dict(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / self.searches if self.searches else 0.0,
+            'promotions': self.promotions,
+            'evictions': self.evictions,
+            'hot': self.hot,
+            'size': self.size,
+        }
+
+
+class TieredEngine(BaseEngine):
+    """
+    Polars copies of the hot collections in front of a Redis or PostgreSQL engine.
+
+    The cold engine is the system of record, every write goes to it. A collection
+    searched ``promote_after`` times is copied to an in-process polars engine and
+    later searches of it are answered without a round trip. When the hot copies
+    exceed ``memory_budget`` the least recently (``lru``) or least frequently
+    (``lfu``) searched collection is evicted. Adding documents drops the hot copy of
+    the collection, updates and deletes are applied to both tiers. The results have
+    the same columns whichever tier answers: the score is only kept when the cold
+    engine is polars, redis scores are distances and postgres has none.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.embeddings_engine = settings.embeddings
+        self.metrics = settings.metrics
+
+        self.cold = get_engine(settings.tiered_cold)(settings)  # type: ignore
+        self.__scores = settings.tiered_cold == 'polars'
+
+        # in-memory polars settings shared by the hot copies
+        self.hot_settings = Settings(engine='polars', embeddings=settings.embeddings, metric=settings.metric, dtype=settings.dtype)
+        self.hot_settings.metrics = settings.metrics
+
+        self.hot: dict[str, PolarsEngine] = {}
+        self.tiers: dict[str, TierStats] = {}
+
+        # a promotion only installs its copy when no write reached the collection while it was read
+        self.__versions: dict[str, int] = {}
+        self.__epoch = 0
+
+        self.__lock = threading.Lock()
+        self.__promote_lock = threading.Lock()
+
+    def load(self):
+        self.cold.load()
+
+    @property
+    def keywords(self):
+        # keyword searches are answered by the cold engine
+        return getattr(self.cold, 'keywords', None)
+
+    def _serialize(self, documents):
+        return self.cold._serialize(documents)
+
+    # tiers
+
+    def __stats(self, collection: str) -> TierStats:
+        stats = self.tiers.get(collection)
+        if stats is None:
+            stats = self.tiers[collection] = TierStats()
+        return stats
+
+    def __tier(self, collection: str | None) -> PolarsEngine | None:
+        """
+        The hot copy of a collection to search, promoting the collection when it is searched often enough
+        """
+        if collection is None:
+            return None
+
+        with self.__lock:
+            stats = self.__stats(collection)
+            stats.last_access = time.monotonic()
+            stats.accesses += 1
+            hot = self.hot.get(collection)
+
+            if hot is not None:
+                stats.hits += 1
+            else:
+                stats.misses += 1
+
+            promote = hot is None and not stats.oversized and stats.accesses >= self.settings.tiered_promote_after  # type: ignore
+
+        self.metrics.count('tier_hits' if hot is not None else 'tier_misses', 1, 'search')
+
+        if promote:
+            self.__promote(collection)
+
+        return hot
+
+    def __promote(self, collection: str):
+        with self.__promote_lock:
+            with self.__lock:
+                if collection in self.hot:
+                    return
+                version, epoch = self.__versions.get(collection, 0), self.__epoch
+
+            with self.metrics.span('promote', 'read'):
+                hot = self.__copy(collection)
+
+            with self.__lock:
+                stats = self.__stats(collection)
+
+                if version != self.__versions.get(collection, 0) or epoch != self.__epoch:
+                    # the copy missed a write, the next search tries again
+                    return
+
+                if hot is None:
+                    stats.oversized = True
+                    return
+
+                stats.size = int(hot.store.estimated_size())
+                stats.hot = True
+                stats.promotions += 1
+                self.hot[collection] = hot
+                self.__evict(keep=collection)
+
+        self.metrics.count('tier_promotions', 1, 'search')
+
+    def __copy(self, collection: str) -> PolarsEngine | None:
+        """
+        Read a collection from the cold tier into a new polars engine, None when it does not fit in the budget
+        """
+        budget = self.settings.tiered_memory_budget  # type: ignore
+        uuids, texts, vectors, metadata = [], [], [], []
+
+        for document in self.cold.iter_documents(collection=collection, include_embeddings=True):
+            embedding = document['embeddings']
+            # pgvector returns its text representation without a registered adapter
+            vectors.append(json.loads(embedding) if isinstance(embedding, str) else embedding)
+            uuids.append(document['uuid'])
+            texts.append(document['text'])
+            metadata.append(document['metadata'] or {})
+
+            if len(vectors) * len(vectors[0]) * 8 > budget:
+                return None
+
+        hot = PolarsEngine(self.hot_settings)
+        hot.load()
+
+        if uuids:
+            hot._insert(uuids, texts, collection, np.asarray(vectors, dtype=np.float64), metadata)
+
+        if hot.store.estimated_size() > budget:
+            return None
+
+        return hot
+
+    def __evict(self, keep: str):
+        """
+        Drop hot copies until they fit in the memory budget, called with the lock held
+        """
+        if self.settings.tiered_policy == 'lfu':  # type: ignore
+            rank = lambda collection: self.tiers[collection].accesses
+        else:
+            rank = lambda collection: self.tiers[collection].last_access
+
+        while sum(self.tiers[collection].size for collection in self.hot) > self.settings.tiered_memory_budget:  # type: ignore
+            candidates = [collection for collection in self.hot if collection != keep]
+            if not candidates:
+                break
+
+            self.__drop(min(candidates, key=rank))
+            self.metrics.count('tier_evictions', 1, 'search')
+
+    def __drop(self, collection: str, evicted: bool = True):
+        self.hot.pop(collection, None)
+        stats = self.__stats(collection)
+        stats.hot = False
+        stats.size = 0
+        if evicted:
+            stats.evictions += 1
+
+    def __written(self, collection: str | None = None):
+        """
+        Record a write, None when it may have touched any collection
+        """
+        with self.__lock:
+            if collection is None:
+                self.__epoch += 1
+            else:
+                self.__versions[collection] = self.__versions.get(collection, 0) + 1
+                self.__stats(collection).oversized = False
+
+    def tier_stats(self) -> dict[str, dict]:
+        """
+        Hits, misses, promotions and evictions of every collection searched so far
+        """
+        with self.__lock:
+            return {collection: stats.to_dict() for collection, stats in self.tiers.items()}
+
+    # reads
+
+    def search(self, embedding: list[float], collection: str | None = None, filters: dict[str, str] | Filter | None = None, top_k: int = 10, result_format: str = 'dicts', deadline: Deadline | None = None, keyword: str | None = None, keyword_mode: str = 'prefilter'):
+        if keyword is not None:
+            # redis and postgres do not take the keyword arguments
+            if getattr(self.cold, 'keywords', None) is None:
+                raise ValueError('Keyword search requires the polars engine with keywords enabled')
+
+            # the hot copies have no keyword index
+            return self.cold.search(embedding, collection, filters, top_k, result_format=result_format, deadline=deadline, keyword=keyword, keyword_mode=keyword_mode)
+
+        hot = self.__tier(collection)
+
+        if hot is not None:
+            results = hot.search(embedding, collection, filters, top_k, result_format=result_format, deadline=deadline)
+        else:
+            results = self.cold.search(embedding, collection, filters, top_k, result_format=result_format, deadline=deadline)
+
+        return self.__shape(results, result_format)
+
+    def search_text(self, text: str, collection: str | None = None, filters: dict[str, str] | Filter | None = None, top_k: int = 10, result_format: str = 'dicts', keyword: str | None = None, keyword_mode: str = 'prefilter'):
+        if self.embeddings_engine is None:
+            raise ValueError('Embeddings Engine is not set')
+
+        with self.metrics.span('search', 'encode'):
+            embedding = self.embeddings_engine.encode(text)
+
+        return self.search(embedding, collection, filters, top_k, result_format=result_format, keyword=keyword, keyword_mode=keyword_mode)
+
+    def search_many(self, embeddings: list[list[float]], collection: str | None = None, filters=None, top_k: int = 10, result_format: str = 'dicts') -> list:
+        hot = self.__tier(collection)
+
+        if hot is not None:
+            results = hot.search_many(embeddings, collection, filters, top_k, result_format=result_format)
+        else:
+            results = self.cold.search_many(embeddings, collection, filters, top_k, result_format=result_format)
+
+        return [self.__shape(result, result_format) for result in results]
+
+    def __shape(self, results, result_format: str):
+        """
+        Drop the score unless the cold engine is polars, so promotions and evictions do not change the columns
+        """
+        if self.__scores:
+            return results
+
+        if result_format == 'dicts':
+            return [{key: value for key, value in document.items() if key != 'score'} for document in results]
+
+        if result_format == 'polars':
+            return results.drop('score') if 'score' in results.columns else results
+
+        if result_format == 'arrow':
+            return results.drop(['score']) if 'score' in results.column_names else results
+
+        return {key: value for key, value in results.items() if key != 'score'}
+
+    def get_documents(self, collection: str | None = None, result_format: str = 'dicts'):
+        return self.cold.get_documents(collection=collection, result_format=result_format)
+
+    def iter_documents(self, collection: str | None = None, **kwargs):
+        return self.cold.iter_documents(collection=collection, **kwargs)
+
+    def get_document(self, uuid: str):
+        return self.cold.get_document(uuid)
+
+    def stored(self, uuids: list[str]) -> set[str]:
+        return self.cold.stored(uuids)
+
+    def stats(self) -> dict:
+        """
+        Stats of the cold engine with the memory of the hot copies and the hits of every collection
+        """
+        stats = self.cold.stats()
+
+        with self.__lock:
+            hot = {collection: engine.store.estimated_size() for collection, engine in self.hot.items()}
+            tiers = {collection: tier.to_dict() for collection, tier in self.tiers.items()}
+
+        stats['engine'] = f'tiered ({stats["engine"]})'
+        stats['bytes']['hot'] = sum(hot.values())
+        stats['tiers'] = tiers
+        return stats
+
+    def export(self, collection: str | None = None, batch_size: int = 1000):
+        return self.cold.export(collection, batch_size)
+
+    # writes go to the cold tier first, it stays the system of record
+
+    def add(self, texts: list[str], collection: str | None = None, embeddings: list[list[float]] | None = None, metadata: list[dict[str, str]] | None = None, deduplicated: bool = False):
+        self.cold.add(texts, collection, embeddings, metadata, deduplicated=deduplicated)
+
+        # the cold engine picks the uuids, the collection is copied again once it is searched enough
+        self.__written(collection)
+        with self.__lock:
+            if collection in self.hot:
+                self.__drop(collection, evicted=False)  # type: ignore
+            self.__stats(collection).accesses = 0  # type: ignore
+
+    def import_batches(self, batches) -> int:
+        imported = self.cold.import_batches(batches)
+        self.__written()
+
+        # the batches may hold any collection, the hot copies are rebuilt from the cold tier
+        with self.__lock:
+            for collection in list(self.hot):
+                self.__drop(collection, evicted=False)
+
+        return imported
+
+    def update(self, uuid: str, metadata: dict[str, str]):
+        self.update_many([uuid], [metadata])
+
+        return self.cold.get_document(uuid)
+
+    def update_many(self, uuids: list[str], metadata: list[dict[str, str]]):
+        self.cold.update_many(uuids, metadata)
+        self.__written()
+
+        for hot in list(self.hot.values()):
+            hot.update_many(uuids, metadata)
+
+    def delete(self, uuid: str | None = None, collection: str | None = None, filters: dict[str, str] | Filter | None = None):
+        self.cold.delete(uuid=uuid, collection=collection, filters=filters)
+        self.__written(collection if uuid is None and filters is None else None)
+
+        for name, hot in list(self.hot.items()):
+            if collection is None or name == collection:
+                hot.delete(uuid=uuid, collection=collection, filters=filters)
+
+    def delete_many(self, uuids: list[str]):
+        self.cold.delete_many(uuids)
+        self.__written()
+
+        for hot in list(self.hot.values()):
+            hot.delete_many(uuids)
+
+    def clear(self):
+        self.cold.clear()
+        self.__written()
+
+        with self.__lock:
+            for collection in list(self.hot):
+                self.__drop(collection, evicted=False)
+
+    def close(self):
+        close = getattr(self.cold, 'close', None)
+        if close is not None:
+            close()
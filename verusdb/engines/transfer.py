@@ -0,0 +1,85 @@
+# Description: Arrow record batches moving documents between engines
+from __future__ import annotations
+import json
+from itertools import islice
+from typing import Iterable, Iterator
+import numpy as np
+import pyarrow as pa
+
+# the columns of an export, every engine imports batches of this schema
+EXPORT_SCHEMA = pa.schema([
+    ('uuid', pa.string()),
+    ('collection', pa.string()),
+    ('text', pa.string()),
+    ('metadata', pa.map_(pa.string(), pa.string())),
+    ('embedding', pa.list_(pa.float64())),
+])
+
+
+def record_batch(uuids: list[str], collections: list, texts: list[str], metadata: list[dict], vectors: np.ndarray) -> pa.RecordBatch:
+    """
+    A record batch of the export schema, ``vectors`` is a matrix with one row per document
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float64).reshape(len(uuids), -1)
+
+    # the list column shares the buffer of the matrix instead of converting every vector to a python list
+    offsets = pa.array(np.arange(len(uuids) + 1, dtype=np.int32) * vectors.shape[1])
+    embeddings = pa.ListArray.from_arrays(offsets, pa.array(vectors.reshape(-1)))
+
+    return pa.record_batch(
+        [
+            pa.array(uuids, pa.string()),
+            pa.array(collections, pa.string()),
+            pa.array(texts, pa.string()),
+            pa.array([[(key, str(value)) for key, value in (meta or {}).items() if value is not None] for meta in metadata], EXPORT_SCHEMA.field('metadata').type),
+            embeddings,
+        ],
+        schema=EXPORT_SCHEMA,
+    )
+
+
+def to_batches(documents: Iterable[dict], batch_size: int = 1000) -> Iterator[pa.RecordBatch]:
+    """
+    Group documents from ``iter_documents(include_embeddings=True)`` in record batches of ``batch_size`` rows
+    """
+    documents = iter(documents)
+
+    while True:
+        chunk = list(islice(documents, batch_size))
+        if not chunk:
+            return
+
+        # pgvector returns its text representation without a registered adapter
+        vectors = [json.loads(item['embeddings']) if isinstance(item['embeddings'], str) else item['embeddings'] for item in chunk]
+
+        yield record_batch(
+            [item['uuid'] for item in chunk],
+            [item['collection'] for item in chunk],
+            [item['text'] for item in chunk],
+            [item.get('metadata') or {} for item in chunk],
+            np.asarray(vectors, dtype=np.float64),
+        )
+
+
+def split_batch(batch: pa.RecordBatch) -> Iterator[tuple[str | None, list[str], list[str], np.ndarray, list[dict[str, str]]]]:
+    """
+    The collection, uuids, texts, embedding matrix and metadata of every collection in a record batch
+    """
+    if batch.num_rows == 0:
+        return
+
+    uuids = batch.column('uuid').to_pylist()
+    collections = batch.column('collection').to_pylist()
+    texts = batch.column('text').to_pylist()
+    metadata = [dict(items or []) for items in batch.column('metadata').to_pylist()]
+    vectors = batch.column('embedding').flatten().to_numpy(zero_copy_only=False).astype(np.float64).reshape(batch.num_rows, -1)
+
+    # exports are usually of a single collection, the rows are only split when they are not
+    distinct = list(dict.fromkeys(collections))
+    if len(distinct) == 1:
+        yield distinct[0], uuids, texts, vectors, metadata
+        return
+
+    for collection in distinct:
+        rows = [index for index, value in enumerate(collections) if value == collection]
+        yield collection, [uuids[i] for i in rows], [texts[i] for i in rows], vectors[rows], [metadata[i] for i in rows]
@@ -0,0 +1,191 @@
+from __future__ import annotations
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+
+# json header length, payload length and crc32 of both
+_FRAME = struct.Struct('<III')
+
+SYNC_MODES = ('group', 'none')
+
+
+class WriteAheadLog:
+    """
+    Append-only log of the writes made since the last snapshot of the store.
+
+    Records are appended to numbered segment files, each one framed with its
+    length and a checksum so a record torn by a crash is detected and dropped
+    on replay. With ``sync='group'`` a write is durable once ``commit``
+    returns, concurrent writers waiting at the same time share a single fsync.
+    With ``sync='none'`` the operating system decides when the log reaches the
+    disk.
+    """
+
+    def __init__(self, folder: str, sync: str = 'group', prefix: str = 'verusdb.wal.'):
+        if sync not in SYNC_MODES:
+            raise ValueError(f'Invalid sync mode {sync}, expected one of {", ".join(SYNC_MODES)}')
+
+        self.folder = folder
+        self.sync = sync
+        self.prefix = prefix
+
+        self.__file = None
+        self.__appended = 0
+        self.__durable = 0
+        self.__syncing = False
+        self.__lock = threading.Lock()
+        self.__synced = threading.Condition()
+
+    def segments(self) -> list[int]:
+        """
+        Numbers of the segment files on disk, oldest first
+        """
+        pattern = re.compile(re.escape(self.prefix) + r'(\d+)$')
+        numbers = []
+
+        for name in os.listdir(self.folder):
+            match = pattern.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+
+        return sorted(numbers)
+
+    def path(self, segment: int) -> str:
+        return os.path.join(self.folder, f'{self.prefix}{segment:08d}')
+
+    @property
+    def segment(self) -> int:
+        """
+        Number of the segment records are appended to
+        """
+        segments = self.segments()
+        return segments[-1] if segments else 1
+
+    def replay(self, after: int = 0):
+        """
+        Yield the records of the segments newer than ``after``, a torn record at the end of a segment is truncated
+        """
+        for segment in self.segments():
+            if segment <= after:
+                continue
+
+            path = self.path(segment)
+            with open(path, 'rb') as file:
+                data = file.read()
+
+            offset = 0
+            while offset + _FRAME.size <= len(data):
+                header_size, payload_size, checksum = _FRAME.unpack_from(data, offset)
+                start = offset + _FRAME.size
+                end = start + header_size + payload_size
+
+                if end > len(data) or zlib.crc32(data[start:end]) != checksum:
+                    break
+
+                header = json.loads(data[start:start + header_size])
+                yield header, data[start + header_size:end]
+                offset = end
+
+            if offset < len(data):
+                # the process stopped in the middle of this record, it was never acknowledged
+                with open(path, 'r+b') as file:
+                    file.truncate(offset)
+
+    def open(self):
+        """
+        Start appending to the newest segment
+        """
+        with self.__lock:
+            self.__file = open(self.path(self.segment), 'ab')
+
+    def append(self, header: dict, payload: bytes = b'') -> int:
+        """
+        Write a record to the log and return its sequence number, pass it to ``commit`` to wait until it is durable
+        """
+        encoded = json.dumps(header).encode('utf-8')
+        frame = _FRAME.pack(len(encoded), len(payload), zlib.crc32(encoded + payload)) + encoded + payload
+
+        with self.__lock:
+            if self.__file is None:
+                raise ValueError('The write-ahead log is not open')
+
+            self.__file.write(frame)
+            # hand the record to the operating system so a crash of the process does not lose it
+            self.__file.flush()
+            self.__appended += 1
+            return self.__appended
+
+    def commit(self, sequence: int):
+        """
+        Block until the record ``sequence`` is on disk, one caller syncs for everyone waiting
+        """
+        if self.sync == 'none':
+            return
+
+        with self.__synced:
+            while self.__durable < sequence:
+                if self.__syncing:
+                    self.__synced.wait()
+                    continue
+
+                self.__syncing = True
+                with self.__lock:
+                    target = self.__appended
+                    file = self.__file
+
+                synced = False
+                self.__synced.release()
+                try:
+                    os.fsync(file.fileno())  # type: ignore
+                    synced = True
+                finally:
+                    self.__synced.acquire()
+                    self.__syncing = False
+                    if synced:
+                        self.__durable = max(self.__durable, target)
+                    self.__synced.notify_all()
+
+    def rotate(self) -> int:
+        """
+        Close the current segment and start a new one, returns the number of the closed segment
+        """
+        with self.__synced:
+            while self.__syncing:
+                self.__synced.wait()
+
+            with self.__lock:
+                closed = self.segment
+
+                if self.__file is not None:
+                    self.__file.flush()
+                    os.fsync(self.__file.fileno())
+                    self.__file.close()
+
+                self.__file = open(self.path(closed + 1), 'ab')
+                self.__durable = self.__appended
+
+        return closed
+
+    def remove(self, upto: int):
+        """
+        Delete the segments covered by a snapshot
+        """
+        for segment in self.segments():
+            if segment <= upto:
+                os.remove(self.path(segment))
+
+    def close(self):
+        with self.__synced:
+            while self.__syncing:
+                self.__synced.wait()
+
+            with self.__lock:
+                if self.__file is not None:
+                    self.__file.flush()
+                    os.fsync(self.__file.fileno())
+                    self.__file.close()
+                    self.__file = None
+                self.__durable = self.__appended
@@ -0,0 +1,311 @@
+# Description: Metadata filter expressions compiled for every engine
+from __future__ import annotations
+import json
+import re
+from typing import TYPE_CHECKING
+
+# polars is only imported when a filter is compiled for the polars engine
+if TYPE_CHECKING:
+    import polars as pl
+
+METADATA_PREFIX = 'metadata__'
+
+# characters that have to be escaped inside a RediSearch tag query
+_REDIS_TAG_SPECIAL = re.compile(r'([,.<>{}\[\]"\':;!@#$%^&*()\-+=~|/\\ ])')
+
+
+class Filter:
+    """
+    Base class of the filter expressions.
+
+    Expressions are combined with ``&``, ``|`` and ``~`` and compiled once per
+    query to a Polars expression, a RediSearch query or a SQL predicate.
+    """
+
+    def __and__(self, other: Filter) -> Filter:
+        # flatten chains like a & b & c so the SQL compiler sees every equality at once
+        return And(*_flatten(self, And), *_flatten(other, And))
+
+    def __or__(self, other: Filter) -> Filter:
+        return Or(*_flatten(self, Or), *_flatten(other, Or))
+
+    def __invert__(self) -> Filter:
+        return Not(self)
+
+    def __repr__(self) -> str:
+        return '{}({})'.format(type(self).__name__, ', '.join(repr(value) for value in self.__dict__.values()))
+
+    def to_polars(self, columns: list[str]) -> pl.Expr:
+        """
+        Compile to a Polars expression over the ``metadata__*`` columns
+        """
+        raise NotImplementedError
+
+    def to_redis(self) -> str:
+        """
+        Compile to a RediSearch query over the ``metadata`` tag field
+        """
+        raise NotImplementedError
+
+    def to_sql(self) -> tuple[str, list]:
+        """
+        Compile to a parameterized SQL predicate over the ``metadata`` JSONB column
+        """
+        raise NotImplementedError
+
+    def equalities(self) -> dict[str, str]:
+        """
+        Key/value pairs every matching document must have, used to prune row groups
+        """
+        return {}
+
+
+class Eq(Filter):
+
+    def __init__(self, key: str, value: str):
+        self.key = key
+        self.value = value
+
+    def to_polars(self, columns: list[str]) -> pl.Expr:
+        import polars as pl
+
+        column = METADATA_PREFIX + self.key
+        if column not in columns:
+            return pl.lit(False)
+        return pl.col(column) == self.value
+
+    def to_redis(self) -> str:
+        return '@metadata:{%s}' % _redis_tag(self.key, self.value)
+
+    def to_sql(self) -> tuple[str, list]:
+        return 'metadata @> %s::jsonb', [json.dumps({self.key: self.value})]
+
+    def equalities(self) -> dict[str, str]:
+        return {self.key: self.value}
+
+
+class Ne(Filter):
+
+    def __init__(self, key: str, value: str):
+        self.key = key
+        self.value = value
+
+    def to_polars(self, columns: list[str]) -> pl.Expr:
+        return ~Eq(self.key, self.value).to_polars(columns)
+
+    def to_redis(self) -> str:
+        return '-' + Eq(self.key, self.value).to_redis()
+
+    def to_sql(self) -> tuple[str, list]:
+        return 'NOT (metadata @> %s::jsonb)', [json.dumps({self.key: self.value})]
+
+
+class In(Filter):
+
+    def __init__(self, key: str, values: list[str]):
+        self.key = key
+        self.values = list(values)
+
+    def to_polars(self, columns: list[str]) -> pl.Expr:
+        import polars as pl
+
+        column = METADATA_PREFIX + self.key
+        if column not in columns:
+            return pl.lit(False)
+        return pl.col(column).is_in(self.values)
+
+    def to_redis(self) -> str:
+        return '@metadata:{%s}' % ' | '.join(_redis_tag(self.key, value) for value in self.values)
+
+    def to_sql(self) -> tuple[str, list]:
+        return 'metadata->>%s = ANY(%s)', [self.key, self.values]
+
+
+# the strings postgres casts to numeric, the ones polars parses as floats apart from inf and nan
+NUMBER_PATTERN = r'^[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?$'
+
+
+class Range(Filter):
+    """
+    Bounds on a metadata value, numeric bounds compare the values as numbers and string bounds lexicographically
+    """
+
+    def __init__(self, key: str, gte=None, lte=None, gt=None, lt=None):
+        self.key = key
+        self.bounds = {op: bound for op, bound in (('>=', gte), ('<=', lte), ('>', gt), ('<', lt)) if bound is not None}
+
+        if not self.bounds:
+            raise ValueError('Range filters require at least one bound')
+
+    def __numeric(self) -> bool:
+        return all(isinstance(bound, (int, float)) for bound in self.bounds.values())
+
+    def to_polars(self, columns: list[str]) -> pl.Expr:
+        import polars as pl
+
+        column = METADATA_PREFIX + self.key
+        if column not in columns:
+            return pl.lit(False)
+
+        value = pl.col(column).cast(pl.Float64, strict=False) if self.__numeric() else pl.col(column)
+        expression = None
+
+        for op, bound in self.bounds.items():
+            condition = {'>=': value >= bound, '<=': value <= bound, '>': value > bound, '<': value < bound}[op]
+            expression = condition if expression is None else expression & condition
+
+        return expression  # type: ignore
+
+    def to_redis(self) -> str:
+        raise ValueError('Range filters are not supported by the redis engine, metadata is stored as tags')
+
+    def to_sql(self) -> tuple[str, list]:
+        conditions = []
+        params = []
+
+        for op, bound in self.bounds.items():
+            if self.__numeric():
+                # a value that is not a number is null, like the non strict cast of polars, instead of failing the query
+                conditions.append(f'CASE WHEN metadata->>%s ~ %s THEN (metadata->>%s)::numeric END {op} %s')
+                params.extend([self.key, NUMBER_PATTERN, self.key, bound])
+            else:
+                conditions.append(f'metadata->>%s {op} %s')
+                params.extend([self.key, bound])
+
+        return '(' + ' AND '.join(conditions) + ')', params
+
+
+class Prefix(Filter):
+
+    def __init__(self, key: str, prefix: str):
+        self.key = key
+        self.prefix = prefix
+
+    def to_polars(self, columns: list[str]) -> pl.Expr:
+        import polars as pl
+
+        column = METADATA_PREFIX + self.key
+        if column not in columns:
+            return pl.lit(False)
+        return pl.col(column).str.starts_with(self.prefix)
+
+    def to_redis(self) -> str:
+        return '@metadata:{%s*}' % _redis_tag(self.key, self.prefix)
+
+    def to_sql(self) -> tuple[str, list]:
+        pattern = self.prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return 'metadata->>%s LIKE %s', [self.key, pattern]
+
+
+class And(Filter):
+
+    def __init__(self, *filters: Filter):
+        self.filters = list(filters)
+
+    def to_polars(self, columns: list[str]) -> pl.Expr:
+        import polars as pl
+
+        expression = pl.lit(True)
+        for item in self.filters:
+            expression = expression & item.to_polars(columns)
+        return expression
+
+    def to_redis(self) -> str:
+        return '(' + ' '.join(item.to_redis() for item in self.filters) + ')'
+
+    def to_sql(self) -> tuple[str, list]:
+        # every equality is merged into a single containment predicate, which the GIN index answers at once
+        equalities = {}
+        conditions = []
+        params = []
+
+        for item in self.filters:
+            if isinstance(item, Eq) and equalities.get(item.key, item.value) == item.value:
+                equalities[item.key] = item.value
+                continue
+            sql, values = item.to_sql()
+            conditions.append(sql)
+            params.extend(values)
+
+        if equalities:
+            conditions.insert(0, 'metadata @> %s::jsonb')
+            params.insert(0, json.dumps(equalities))
+
+        if not conditions:
+            return 'TRUE', []
+
+        return '(' + ' AND '.join(conditions) + ')', params
+
+    def equalities(self) -> dict[str, str]:
+        equalities = {}
+        for item in self.filters:
+            equalities.update(item.equalities())
+        return equalities
+
+
+class Or(Filter):
+
+    def __init__(self, *filters: Filter):
+        self.filters = list(filters)
+
+    def to_polars(self, columns: list[str]) -> pl.Expr:
+        import polars as pl
+
+        expression = pl.lit(False)
+        for item in self.filters:
+            expression = expression | item.to_polars(columns)
+        return expression
+
+    def to_redis(self) -> str:
+        return '(' + ' | '.join(item.to_redis() for item in self.filters) + ')'
+
+    def to_sql(self) -> tuple[str, list]:
+        conditions = []
+        params = []
+
+        for item in self.filters:
+            sql, values = item.to_sql()
+            conditions.append(sql)
+            params.extend(values)
+
+        if not conditions:
+            return 'FALSE', []
+
+        return '(' + ' OR '.join(conditions) + ')', params
+
+
+class Not(Filter):
+
+    def __init__(self, filter: Filter):
+        self.filter = filter
+
+    def to_polars(self, columns: list[str]) -> pl.Expr:
+        return ~self.filter.to_polars(columns)
+
+    def to_redis(self) -> str:
+        return '-(' + self.filter.to_redis() + ')'
+
+    def to_sql(self) -> tuple[str, list]:
+        sql, params = self.filter.to_sql()
+        return f'NOT ({sql})', params
+
+
+def compile_filters(filters: dict[str, str] | Filter | None) -> Filter | None:
+    """
+    Normalize the filters argument, plain dicts are an equality on every key
+    """
+    if filters is None or isinstance(filters, Filter):
+        return filters
+
+    if not filters:
+        return None
+
+    return And(*[Eq(key, value) for key, value in filters.items()])
+
+
+def _flatten(item: Filter, kind: type) -> list[Filter]:
+    return item.filters if isinstance(item, kind) else [item]  # type: ignore
+
+
+def _redis_tag(key: str, value: str) -> str:
+    return _REDIS_TAG_SPECIAL.sub(r'\\\1', f'{key}:{value}')
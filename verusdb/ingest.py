@@ -0,0 +1,212 @@
+# Description: Streaming ingestion pipeline for the VerusClient
+from __future__ import annotations
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable
+from verusdb.embeddings import BaseEmbeddingsEngine
+from verusdb.metrics import MetricsRecorder
+
+
+class IngestProgress:
+    """
+    Counters of a running ingestion, passed to the ``on_progress`` callback after every chunk
+    """
+
+    def __init__(self, collection: str, skipped: int = 0):
+        self.collection = collection
+        self.skipped = skipped
+        self.read = 0
+        self.written = 0
+        # documents of the source that were already stored, counted in written as well
+        self.duplicates = 0
+        self.checkpointed = skipped
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self) -> float:
+        """
+        Documents written per second
+        """
+        return self.written / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f'IngestProgress(collection={self.collection!r}, read={self.read}, written={self.written}, '
+            f'checkpointed={self.checkpointed}, rate={self.rate:.1f}/s)'
+        )
+
+
+class IngestPipeline:
+    """
+    Chunk an iterable of documents, encode the chunks on a worker pool and write them in order.
+
+    At most ``workers + max_pending`` chunks are in flight, when the writer falls
+    behind the source is simply not read any further. Every ``checkpoint_every``
+    chunks the store is flushed and the number of documents written so far is
+    recorded in the ``checkpoint`` file, running the pipeline again with the same
+    checkpoint skips them. Without ``flush`` every write is committed by the
+    engine and the checkpoint is recorded after each chunk.
+
+    With ``deduplicate`` the documents already stored are dropped before their
+    chunk is encoded, and ``write`` is told the chunk needs no second pass unless
+    it shares a text with a chunk written since, while it was in flight.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[list[str], str, list | None, list[dict[str, str]], bool], None],
+        embeddings: BaseEmbeddingsEngine | None = None,
+        chunk_size: int = 256,
+        workers: int = 2,
+        max_pending: int = 4,
+        checkpoint: str | None = None,
+        checkpoint_every: int = 10,
+        flush: Callable[[], None] | None = None,
+        on_progress: Callable[[IngestProgress], None] | None = None,
+        metrics: MetricsRecorder | None = None,
+        deduplicate: Callable[[list[str], str, list[dict[str, str]]], list[int]] | None = None,
+    ):
+        if chunk_size < 1 or workers < 1 or max_pending < 0 or checkpoint_every < 1:
+            raise ValueError('chunk_size, workers and checkpoint_every must be positive and max_pending not negative')
+
+        self.write = write
+        self.embeddings = embeddings
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.max_pending = max_pending
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.flush = flush
+        self.on_progress = on_progress
+        self.metrics = metrics or MetricsRecorder()
+        self.deduplicate = deduplicate
+
+    def run(self, documents: Iterable, collection: str) -> IngestProgress:
+        """
+        Ingest ``documents``, either texts or dicts with a ``text`` and optional ``embedding`` and ``metadata``
+        """
+        skipped = self.__resume(collection)
+        progress = IngestProgress(collection, skipped)
+        source = islice(iter(documents), skipped, None)
+
+        in_flight: deque[Future] = deque()
+        chunks = 0
+        # texts of the chunks written while the next one was in flight, it was deduplicated without seeing them
+        written: deque[set[str]] = deque(maxlen=self.workers + self.max_pending)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='verusdb-ingest') as executor:
+                try:
+                    while True:
+                        chunk = list(islice(source, self.chunk_size))
+
+                        if chunk:
+                            progress.read += len(chunk)
+                            in_flight.append(executor.submit(self.__encode, chunk, collection))
+
+                        # backpressure: wait for the oldest chunk before reading more
+                        while in_flight and (not chunk or len(in_flight) > self.workers + self.max_pending):
+                            self.__write(in_flight.popleft().result(), collection, progress, written)
+                            chunks += 1
+
+                            # without a flush every write is already committed, so it is recorded right away
+                            if self.flush is None or chunks % self.checkpoint_every == 0:
+                                self.__checkpoint(progress)
+
+                        if not chunk:
+                            break
+                finally:
+                    for future in in_flight:
+                        future.cancel()
+        finally:
+            # the chunks written before an interruption are not written again by the next run
+            if progress.checkpointed != progress.skipped + progress.written:
+                self.__checkpoint(progress)
+
+        return progress
+
+    def __encode(self, chunk: list, collection: str) -> tuple[int, list[str], list, list[dict[str, str]]]:
+        documents = [{'text': item} if isinstance(item, str) else item for item in chunk]
+
+        if self.deduplicate is not None:
+            keep = self.deduplicate(
+                [document['text'] for document in documents], collection, [document.get('metadata') or {} for document in documents]
+            )
+            documents = [documents[index] for index in keep]
+
+        texts = [document['text'] for document in documents]
+        metadata = [document.get('metadata') or {} for document in documents]
+        embeddings = [document.get('embedding') for document in documents]
+
+        missing = [index for index, embedding in enumerate(embeddings) if embedding is None]
+
+        if missing:
+            if self.embeddings is None:
+                raise ValueError('Embeddings engine not set')
+
+            with self.metrics.span('add_stream', 'encode'):
+                vectors = self.embeddings.encode_batch([texts[index] for index in missing])
+
+            for index, vector in zip(missing, vectors):
+                embeddings[index] = vector
+
+        return len(chunk), texts, embeddings, metadata
+
+    def __write(self, chunk: tuple[int, list[str], list, list[dict[str, str]]], collection: str, progress: IngestProgress, written: deque[set[str]]):
+        size, texts, embeddings, metadata = chunk
+
+        if texts:
+            deduplicated = False
+
+            if self.deduplicate is not None:
+                keys = set(texts)
+                deduplicated = all(keys.isdisjoint(earlier) for earlier in written)
+                written.append(keys)
+
+            with self.metrics.span('add_stream', 'write'):
+                self.write(texts, collection, embeddings, metadata, deduplicated)
+
+        # the checkpoint counts documents of the source, duplicates included
+        progress.written += size
+        progress.duplicates += size - len(texts)
+        self.metrics.count('documents_ingested', len(texts), 'add_stream')
+
+        if self.on_progress is not None:
+            self.on_progress(progress)
+
+    def __checkpoint(self, progress: IngestProgress):
+        with self.metrics.span('add_stream', 'checkpoint'):
+            if self.flush is not None:
+                self.flush()
+
+            progress.checkpointed = progress.skipped + progress.written
+
+            if self.checkpoint is not None:
+                # written next to the checkpoint and renamed so an interruption never leaves a partial file
+                temporary = self.checkpoint + '.tmp'
+                with open(temporary, 'w') as file:
+                    json.dump({'collection': progress.collection, 'written': progress.checkpointed}, file)
+                os.replace(temporary, self.checkpoint)
+
+    def __resume(self, collection: str) -> int:
+        """
+        Number of documents already written by a previous run of the same collection
+        """
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return 0
+
+        with open(self.checkpoint) as file:
+            state = json.load(file)
+
+        if state.get('collection') != collection:
+            raise ValueError(f'The checkpoint {self.checkpoint} belongs to the collection {state.get("collection")}')
+
+        return int(state.get('written', 0))
@@ -0,0 +1,165 @@
+# Description: Operation level metrics for VerusDB
+from __future__ import annotations
+import bisect
+import contextlib
+import threading
+import time
+from abc import ABC, abstractmethod
+
+# shared no-op context manager, spans cost a single attribute check when metrics are disabled
+_DISABLED = contextlib.nullcontext()
+
+
+class BaseMetricsSink(ABC):
+    """
+    An abstract class that defines the interface for a metrics sink.
+
+    Timings are reported through ``observe`` in seconds, counters through ``increment``.
+    """
+
+    @abstractmethod
+    def observe(self, name: str, value: float, labels: dict[str, str]):
+        pass
+
+    @abstractmethod
+    def increment(self, name: str, value: float, labels: dict[str, str]):
+        pass
+
+
+class InMemoryMetricsSink(BaseMetricsSink):
+    """
+    Thread safe in-process aggregator keeping a histogram per timed span and a total per counter
+    """
+
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets: tuple[float, ...] | None = None):
+        self.buckets = tuple(sorted(buckets)) if buckets else self.DEFAULT_BUCKETS
+        self.histograms: dict[tuple, list] = {}
+        self.counters: dict[tuple, float] = {}
+        self.__lock = threading.Lock()
+
+    def observe(self, name: str, value: float, labels: dict[str, str]):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.__lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # one slot per bucket plus +Inf, then the sum and the count
+                histogram = self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def increment(self, name: str, value: float, labels: dict[str, str]):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.__lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def reset(self):
+        with self.__lock:
+            self.histograms = {}
+            self.counters = {}
+
+    def snapshot(self) -> dict[str, list[dict]]:
+        """
+        Return the aggregated values as plain python objects
+        """
+        with self.__lock:
+            histograms = [
+                {'name': name, 'labels': dict(labels), 'count': count, 'sum': total}
+                for (name, labels), (_, total, count) in self.histograms.items()
+            ]
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in self.counters.items()
+            ]
+
+        return {'histograms': histograms, 'counters': counters}
+
+    def to_prometheus(self) -> str:
+        """
+        Export the metrics in the Prometheus text exposition format
+        """
+        lines = []
+
+        with self.__lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        seen = set()
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in seen:
+                lines.append(f'# TYPE {name} histogram')
+                seen.add(name)
+
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{_labels(labels, le=le)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {total}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f'# TYPE {name} counter')
+                seen.add(name)
+            lines.append(f'{name}{_labels(labels)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: tuple, **extra: str) -> str:
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in items)
+    return '{' + escaped + '}'
+
+
+class _Span:
+    __slots__ = ('sink', 'labels', 'start')
+
+    def __init__(self, sink: BaseMetricsSink, labels: dict[str, str]):
+        self.sink = sink
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.sink.observe('verusdb_operation_seconds', time.perf_counter() - self.start, self.labels)
+        return False
+
+
+class MetricsRecorder:
+    """
+    Front end used by the client and the engines to report spans and counters.
+
+    Without a sink every call returns immediately.
+    """
+
+    def __init__(self, sink: BaseMetricsSink | None = None, engine: str | None = None):
+        self.sink = sink
+        self.engine = engine or ''
+        self.enabled = sink is not None
+
+    def span(self, operation: str, phase: str = 'total'):
+        """
+        Time a phase of an operation, use it as a context manager
+        """
+        if not self.enabled:
+            return _DISABLED
+        return _Span(self.sink, {'engine': self.engine, 'operation': operation, 'phase': phase})  # type: ignore
+
+    def count(self, name: str, value: float = 1, operation: str = ''):
+        """
+        Increment the ``verusdb_<name>_total`` counter
+        """
+        if not self.enabled:
+            return
+        self.sink.increment(f'verusdb_{name}_total', value, {'engine': self.engine, 'operation': operation})  # type: ignore
@@ -0,0 +1,147 @@
+# Description: Columnar result formats shared by the engines
+from __future__ import annotations
+import numpy as np
+import polars as pl
+import pyarrow as pa
+
+RESULT_FORMATS = ('dicts', 'arrow', 'polars', 'numpy')
+
+METADATA_PREFIX = 'metadata__'
+
+
+def validate_result_format(result_format: str):
+    if result_format not in RESULT_FORMATS:
+        raise ValueError(f'Invalid result format {result_format}, expected one of {", ".join(RESULT_FORMATS)}')
+
+
+def fold_metadata(frame: pl.DataFrame) -> pl.DataFrame:
+    """
+    Replace the ``metadata__*`` columns with a single ``metadata`` struct column
+    """
+    columns = [column for column in frame.columns if column.startswith(METADATA_PREFIX)]
+
+    if not columns:
+        return frame.with_columns(pl.lit(None).alias('metadata'))
+
+    return frame.select(
+        pl.exclude(columns),
+        pl.struct([pl.col(column).alias(column[len(METADATA_PREFIX):]) for column in columns]).alias('metadata'),
+    )
+
+
+def frame_from_documents(documents: list[dict]) -> pl.DataFrame:
+    """
+    Build a frame with a struct metadata column from a list of documents whose metadata is a dict
+    """
+    if not documents:
+        return pl.DataFrame(schema=[('uuid', pl.Utf8), ('collection', pl.Utf8), ('text', pl.Utf8)])
+
+    columns = {key: [document[key] for document in documents] for key in documents[0].keys() if key != 'metadata'}
+
+    if 'score' in columns:
+        columns['score'] = [float(score) for score in columns['score']]
+
+    frame = pl.DataFrame(columns)
+
+    # infer the struct fields from every document, keys are not guaranteed to be the same for all of them
+    metadata = pl.from_dicts([document.get('metadata') or {} for document in documents], infer_schema_length=None)
+
+    if metadata.width == 0:
+        return frame.with_columns(pl.lit(None).alias('metadata'))
+
+    return frame.with_columns(metadata.to_struct('metadata'))
+
+
+def to_numpy(frame: pl.DataFrame) -> dict[str, np.ndarray]:
+    """
+    Convert a result frame to a dict of numpy arrays, embeddings become a 2D matrix
+    """
+    arrays = {}
+
+    for column in frame.columns:
+        series = frame[column]
+
+        if column == 'embeddings' and frame.height > 0:
+            arrays[column] = series.explode().to_numpy().reshape(frame.height, -1)
+        elif column == 'metadata':
+            arrays[column] = np.array(series.to_list(), dtype=object)
+        else:
+            arrays[column] = series.to_numpy()
+
+    return arrays
+
+
+def format_frame(frame: pl.DataFrame, result_format: str = 'dicts'):
+    """
+    Return a frame with a folded metadata column in the requested format
+    """
+    if result_format == 'polars':
+        return frame
+
+    if result_format == 'arrow':
+        return frame.to_arrow()
+
+    if result_format == 'numpy':
+        return to_numpy(frame)
+
+    documents = frame.to_dicts()
+
+    if frame.schema.get('metadata') == pl.Null:
+        for document in documents:
+            document['metadata'] = {}
+
+    return documents
+
+
+class SearchResults(list):
+    """
+    Documents of a search with a deadline, ``complete`` is False when the deadline cut the search short
+    """
+
+    def __init__(self, documents=(), complete: bool = True):
+        super().__init__(documents)
+        self.complete = complete
+
+
+class SearchArrays(dict):
+    """
+    Columns of a numpy search result with a deadline, see SearchResults
+    """
+
+    def __init__(self, arrays=(), complete: bool = True):
+        super().__init__(arrays)
+        self.complete = complete
+
+
+def mark_complete(results, complete: bool):
+    """
+    Attach the completeness flag of a search to results of any format
+
+    Arrow tables keep it in their schema metadata as ``verusdb.complete``, the
+    other formats in a ``complete`` attribute.
+    """
+    if isinstance(results, pa.Table):
+        metadata = dict(results.schema.metadata or {})
+        metadata[b'verusdb.complete'] = b'true' if complete else b'false'
+        return results.replace_schema_metadata(metadata)
+
+    if isinstance(results, list):
+        return SearchResults(results, complete)
+
+    if isinstance(results, dict):
+        return SearchArrays(results, complete)
+
+    # a clone shares the columns, the flag is not set on a frame held by the query cache
+    results = results.clone()
+    results.complete = complete
+    return results
+
+
+def is_complete(results) -> bool:
+    """
+    The completeness flag set by mark_complete, results of a search without a deadline are complete
+    """
+    if isinstance(results, pa.Table):
+        return (results.schema.metadata or {}).get(b'verusdb.complete', b'true') == b'true'
+
+    return getattr(results, 'complete', True)
@@ -0,0 +1,354 @@
+# Description: HTTP query server sharing one VerusClient between applications
+from __future__ import annotations
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+from verusdb.client import VerusClient
+from verusdb.metrics import InMemoryMetricsSink
+
+JSON = 'application/json'
+
+# 1D or 2D float arrays saved with numpy.save
+NPY = 'application/x-npy'
+
+# an Arrow IPC stream, requests carry an "embedding" list column
+ARROW = 'application/vnd.apache.arrow.stream'
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class VerusServer(HTTPServer):
+    """
+    HTTP/1.1 server handling every connection on a fixed pool of worker threads.
+
+    Connections are kept alive between requests, an idle connection is closed
+    after ``idle_timeout`` seconds so it does not hold a worker forever.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        client: VerusClient,
+        host: str = '127.0.0.1',
+        port: int = 8000,
+        workers: int | None = None,
+        idle_timeout: float = 5,
+        sink: InMemoryMetricsSink | None = None,
+    ):
+        self.client = client
+        self.sink = sink
+        self.idle_timeout = idle_timeout
+        self.workers = workers or 2 * (os.cpu_count() or 1)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='verusdb-http')
+        super().__init__((host, port), VerusRequestHandler)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.__process, request, client_address)
+
+    def __process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+
+class VerusRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    server: VerusServer
+
+    def setup(self):
+        self.timeout = self.server.idle_timeout
+        super().setup()
+
+    def log_message(self, format, *args):
+        # requests are counted in the metrics, the access log would only slow the workers down
+        pass
+
+    def do_GET(self):
+        self.__dispatch({
+            '/health': self.__health,
+            '/metrics': self.__metrics,
+            '/documents': self.__documents,
+            '/stats': self.__stats,
+        })
+
+    def do_POST(self):
+        self.__dispatch({
+            '/add': self.__add,
+            '/search': self.__search,
+            '/search_many': self.__search_many,
+            '/delete': self.__delete,
+            '/save': self.__save,
+        })
+
+    def __dispatch(self, routes: dict):
+        url = urlparse(self.path)
+        path = url.path.rstrip('/') or '/'
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        route = routes.get(path)
+        if route is None and path.startswith('/documents/'):
+            route = self.__document
+
+        name = path.strip('/').split('/')[0] or 'root'
+        metrics = self.server.client.metrics
+        self.consumed = False
+
+        try:
+            if route is None:
+                raise HTTPError(404, f'Unknown endpoint {self.command} {path}')
+
+            with metrics.span('http_' + name):
+                route(path)
+            status = 200
+        except Exception as error:
+            status, message = _error_status(error)
+            # an unread body would be parsed as the next request, the connection can not be reused
+            close = not self.consumed and int(self.headers.get('Content-Length') or 0) > 0
+            self.__send_json({'error': message}, status, close)
+
+        metrics.count(f'http_{status // 100}xx', 1, name)
+
+    # request and response bodies
+
+    def __body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        self.consumed = True
+        return self.rfile.read(length) if length else b''
+
+    def __content_type(self) -> str:
+        return (self.headers.get('Content-Type') or JSON).split(';')[0].strip()
+
+    def __json(self) -> dict:
+        body = self.__body()
+        if not body:
+            return {}
+
+        try:
+            payload = json.loads(body)
+        except json.JSONDecodeError as error:
+            raise HTTPError(400, f'Invalid JSON body: {error}')
+
+        if not isinstance(payload, dict):
+            raise HTTPError(400, 'The JSON body must be an object')
+
+        return payload
+
+    def __vectors(self) -> list[list[float]]:
+        """
+        Read a binary vector payload, the other parameters are taken from the query string
+        """
+        content_type = self.__content_type()
+        body = self.__body()
+
+        if content_type == NPY:
+            import numpy as np
+
+            vectors = np.load(io.BytesIO(body), allow_pickle=False)
+            return np.atleast_2d(vectors).astype(np.float64).tolist()
+
+        if content_type == ARROW:
+            import pyarrow as pa
+
+            table = pa.ipc.open_stream(body).read_all()
+            if 'embedding' not in table.column_names:
+                raise HTTPError(400, 'The Arrow payload requires an "embedding" column')
+            return table.column('embedding').to_pylist()
+
+        raise HTTPError(415, f'Unsupported content type {content_type}')
+
+    def __parameters(self) -> dict:
+        """
+        Search parameters from the JSON body, or from the query string with a binary payload
+        """
+        if self.__content_type() == JSON:
+            return self.__json()
+
+        parameters: dict = dict(self.query)
+        if 'filters' in parameters:
+            parameters['filters'] = json.loads(parameters['filters'])
+        if 'top_k' in parameters:
+            parameters['top_k'] = int(parameters['top_k'])
+        if 'deadline_ms' in parameters:
+            parameters['deadline_ms'] = float(parameters['deadline_ms'])
+        parameters['embeddings'] = self.__vectors()
+        return parameters
+
+    def __wants_arrow(self) -> bool:
+        return ARROW in (self.headers.get('Accept') or '')
+
+    def __send(self, body: bytes, content_type: str, status: int = 200, close: bool = False):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if close:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __send_json(self, payload, status: int = 200, close: bool = False):
+        self.__send(json.dumps(payload, default=str).encode('utf-8'), JSON, status, close)
+
+    def __send_arrow(self, tables: list, many: bool = False):
+        import pyarrow as pa
+
+        # results of several queries are concatenated with the index of their query
+        if not many:
+            table = tables[0]
+        else:
+            table = pa.concat_tables(
+                [table.append_column('query', pa.array([index] * table.num_rows, pa.int32())) for index, table in enumerate(tables)],
+                promote=True,
+            )
+
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        self.__send(sink.getvalue(), ARROW)
+
+    # endpoints
+
+    def __health(self, path: str):
+        client = self.server.client
+        self.__send_json({'status': 'ok', 'engine': client.settings.engine, 'workers': self.server.workers})
+
+    def __metrics(self, path: str):
+        if self.server.sink is None:
+            raise HTTPError(404, 'Metrics are not enabled')
+        self.__send(self.server.sink.to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4')
+
+    def __stats(self, path: str):
+        self.__send_json(self.server.client.stats())
+
+    def __add(self, path: str):
+        payload = self.__json()
+        texts = payload['texts']
+
+        self.server.client.add(
+            texts=texts,
+            collection=payload.get('collection'),
+            embeddings=payload.get('embeddings'),
+            metadata=payload.get('metadata') or [{} for _ in texts],
+        )
+        self.__send_json({'added': len(texts)})
+
+    def __search(self, path: str):
+        parameters = self.__parameters()
+        embedding = parameters.get('embedding')
+
+        if embedding is None and parameters.get('embeddings'):
+            embedding = parameters['embeddings'][0]
+
+        results = self.server.client.search(
+            text=parameters.get('text'),
+            collection=parameters.get('collection'),
+            embedding=embedding,
+            filters=parameters.get('filters'),
+            top_k=parameters.get('top_k', 10),
+            result_format='arrow' if self.__wants_arrow() else 'dicts',
+            deadline_ms=parameters.get('deadline_ms'),
+            keyword=parameters.get('keyword'),
+            keyword_mode=parameters.get('keyword_mode', 'prefilter'),
+        )
+
+        if self.__wants_arrow():
+            # the completeness flag of a search with a deadline is kept in the schema metadata
+            self.__send_arrow([results])
+        elif parameters.get('deadline_ms') is not None:
+            self.__send_json({'results': results, 'complete': results.complete})
+        else:
+            self.__send_json({'results': results})
+
+    def __search_many(self, path: str):
+        parameters = self.__parameters()
+
+        results = self.server.client.search_many(
+            texts=parameters.get('texts'),
+            collection=parameters.get('collection'),
+            embeddings=parameters.get('embeddings'),
+            filters=parameters.get('filters'),
+            top_k=parameters.get('top_k', 10),
+            result_format='arrow' if self.__wants_arrow() else 'dicts',
+        )
+
+        if self.__wants_arrow():
+            self.__send_arrow(results, many=True)
+        else:
+            self.__send_json({'results': results})
+
+    def __documents(self, path: str):
+        documents = self.server.client.get_documents(
+            collection=self.query.get('collection'),
+            result_format='arrow' if self.__wants_arrow() else 'dicts',
+        )
+
+        if self.__wants_arrow():
+            self.__send_arrow([documents])
+        else:
+            self.__send_json({'documents': documents})
+
+    def __document(self, path: str):
+        document = self.server.client.get_document(path[len('/documents/'):])
+
+        if not document:
+            raise HTTPError(404, 'Document not found')
+
+        self.__send_json(document)
+
+    def __delete(self, path: str):
+        payload = self.__json()
+        self.server.client.delete(
+            uuid=payload.get('uuid'),
+            collection=payload.get('collection'),
+            filters=payload.get('filters'),
+        )
+        self.__send_json({'deleted': True})
+
+    def __save(self, path: str):
+        self.server.client.save()
+        self.__send_json({'saved': True})
+
+
+def _error_status(error: Exception) -> tuple[int, str]:
+    if isinstance(error, HTTPError):
+        return error.status, str(error)
+
+    if isinstance(error, (ValueError, KeyError, TypeError)):
+        return 400, str(error)
+
+    if isinstance(error, NotImplementedError):
+        return 501, str(error)
+
+    return 500, f'{type(error).__name__}: {error}'
+
+
+def serve(client: VerusClient, host: str = '127.0.0.1', port: int = 8000, workers: int | None = None, sink: InMemoryMetricsSink | None = None):
+    """
+    Serve ``client`` until interrupted, the client is closed on the way out
+    """
+    server = VerusServer(client, host, port, workers, sink=sink)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        client.close()
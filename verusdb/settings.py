@@ -1,11 +1,48 @@
 from __future__ import annotations
 from verusdb.embeddings import BaseEmbeddingsEngine
+from verusdb.embeddings.batching import BatchingEmbeddingsEngine
+from verusdb.metrics import BaseMetricsSink, MetricsRecorder
+from verusdb.engines.registry import is_registered
+
+# kept here and not with the scoring kernels so creating Settings does not import numpy or polars
+METRICS = ('cosine', 'dot', 'l2')
+
+DTYPES = ('float64', 'float32', 'float16')
+
+DEDUP_MODES = ('skip', 'upsert')
+
+TIER_POLICIES = ('lru', 'lfu')
+
+
+def validate_metric(metric: str):
+    if metric not in METRICS:
+        raise ValueError(f'Invalid metric {metric}, expected one of {", ".join(METRICS)}')
+
+
+def validate_dtype(dtype: str | None):
+    if dtype is not None and dtype not in DTYPES:
+        raise ValueError(f'Invalid dtype {dtype}, expected one of {", ".join(DTYPES)}')
+
+
+def _redis_node(node: str | dict) -> dict:
+    """
+    A redis node given as a dict or as a 'host:port' string
+    """
+    if isinstance(node, dict):
+        return node
+
+    host, _, port = node.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(f'Invalid redis node {node}, expected host:port')
+
+    return {'host': host, 'port': int(port)}
+
 
 class Settings:
     """
     Settings class for verusdb
     """
-    def __init__(self, folder: str | None = None, engine: str | None = None,  embeddings: BaseEmbeddingsEngine | None = None, **kwargs):
+    def __init__(self, folder: str | None = None, engine: str | None = None,  embeddings: BaseEmbeddingsEngine | None = None, metrics: BaseMetricsSink | None = None, **kwargs):
 
         self.folder = folder
         self.engine = engine
@@ -16,11 +53,92 @@ class Settings:
         
         self.persist = False
 
-        # validate the engine
-        if self.engine not in ['polars', 'redis', 'postgres']:
+        # validate the engine, third party engines are registered in verusdb.engines.registry
+        if not is_registered(self.engine):
             raise ValueError('Invalid engine')
+
+        # engines from plugins read their own settings from here
+        self.options = kwargs
+
+        # dimensions of the embeddings, read from the embeddings engine when not set (e.g. to migrate without one)
+        self.dimensions = kwargs.get('dimensions', None)
+
+        # similarity metric used by every engine: cosine, dot or l2
+        self.metric = kwargs.get('metric', 'cosine')
+        validate_metric(self.metric)
+
+        # embedding storage precision: float64, float32 or float16, None keeps the engine default
+        self.dtype = kwargs.get('dtype', None)
+        validate_dtype(self.dtype)
+
+        # content deduplication at ingest: 'skip' drops texts already stored in the collection,
+        # 'upsert' replaces their metadata, neither encodes them again (True is 'skip')
+        dedup = kwargs.get('dedup', None)
+        self.dedup = 'skip' if dedup is True else (dedup or None)
+        if self.dedup is not None and self.dedup not in DEDUP_MODES:
+            raise ValueError(f'Invalid dedup mode {self.dedup}, expected one of {", ".join(DEDUP_MODES)}')
+
+        # spans and counters are only recorded when a sink is provided
+        self.metrics = MetricsRecorder(metrics, engine=self.engine)
+
+        # coalesce concurrent encodes, True for the defaults or a dict with max_batch_size and max_wait_ms
+        batching = kwargs.get('batching', None)
+        if batching and self.embeddings is not None:
+            self.embeddings = BatchingEmbeddingsEngine(
+                self.embeddings, metrics=self.metrics, **({} if batching is True else batching)
+            )
+
+        # query result cache, True for the defaults or a dict with max_size and ttl (seconds), None or False disables it
+        cache = kwargs.get('cache', None)
+        self.cache = {} if cache is True else (None if cache is False else cache)
         
-        if self.engine == 'redis':
+        # hot collections are cached in memory in front of the cold engine (redis, postgres or a polars store), the system of record
+        self.tiered_cold = None
+        if self.engine == 'tiered':
+            tiered = kwargs.get('tiered', None) or {}
+
+            self.tiered_cold = tiered.get('cold', 'postgres')
+            # searches of a collection before it is promoted, and the memory all hot collections may use
+            self.tiered_promote_after = tiered.get('promote_after', 3)
+            self.tiered_memory_budget = int(tiered.get('memory_budget_mb', 256) * 1024 * 1024)
+            # evict the least recently ('lru') or the least frequently ('lfu') searched collection
+            self.tiered_policy = tiered.get('policy', 'lru')
+
+            if self.tiered_cold == 'tiered' or not is_registered(self.tiered_cold):
+                raise ValueError(f'Invalid cold tier {self.tiered_cold}')
+
+            if self.tiered_policy not in TIER_POLICIES:
+                raise ValueError(f'Invalid eviction policy {self.tiered_policy}, expected one of {", ".join(TIER_POLICIES)}')
+
+        # the engine storing the documents, its settings are read below
+        backend = self.tiered_cold or self.engine
+
+        if backend == 'polars':
+            polars = kwargs.get('polars', None) or {}
+
+            # streaming searches the parquet file in batches instead of loading it in memory, the store is read-only
+            self.polars_streaming = polars.get('streaming', False)
+            self.polars_batch_size = polars.get('batch_size', 65536)
+            self.polars_row_group_size = polars.get('row_group_size', 65536)
+
+            # log every write and replay it on load, sync is 'group' (durable on return) or 'none',
+            # a background thread snapshots the store every checkpoint_interval seconds (None disables it)
+            self.polars_wal = polars.get('wal', False)
+            self.polars_sync = polars.get('sync', 'group')
+            self.polars_checkpoint_interval = polars.get('checkpoint_interval', 60)
+
+            # two-stage search: dict with method ('pca' or 'truncate'), dimensions and candidates
+            # (the coarse pass keeps candidates * top_k documents for the exact rerank)
+            self.polars_coarse = polars.get('coarse', None)
+
+            # inverted bm25 index of the texts for keyword searches: True or a dict with k1, b, rrf_k and rrf_depth
+            # (reciprocal rank fusion ranks the rrf_depth best documents of the vector and the keyword searches)
+            self.polars_keywords = polars.get('keywords', None)
+
+            # searches with a deadline score this many documents between two checks of the clock
+            self.polars_deadline_chunk_size = polars.get('deadline_chunk_size', 50000)
+
+        if backend == 'redis':
             redis = kwargs.get('redis', None)
             if redis is None:
                 raise ValueError('Redis engine requires redis settings')
@@ -31,8 +149,11 @@ class Settings:
             self.redis_password = redis.get('password', None)
             self.redis_doc_prefix = redis.get('prefix', 'doc:')
             self.redis_index = redis.get('index', 'verusdb')
+            self.redis_batch_size = redis.get('batch_size', 1000)
+            # several nodes shard the documents by uuid, a node missing host, port, db or password uses the values above
+            self.redis_nodes = [_redis_node(node) for node in redis.get('nodes') or []]
             
-        if self.engine == 'postgres':
+        if backend == 'postgres':
             postgres = kwargs.get('postgres', None)
             if postgres is None:
                 raise ValueError('Postgres engine requires postgres settings')
@@ -43,12 +164,29 @@ class Settings:
             self.username = postgres.get('username', 'postgres')
             self.pg_password = postgres.get('password', None)
             self.pg_table = postgres.get('table', 'verusdb')
+            self.pg_itersize = postgres.get('itersize', 2000)
+            self.pg_batch_size = postgres.get('batch_size', 1000)
 
 
         if self.folder is not None:
             self.file = self.folder+'/verusdb.parquet'
             self.persist = True
 
+        if backend == 'polars' and self.polars_streaming and not self.persist:
+            raise ValueError('Polars streaming mode requires a folder')
+
+        if backend == 'polars' and self.polars_coarse and self.polars_streaming:
+            raise ValueError('Coarse search is not available in streaming mode, the store is not loaded in memory')
+
+        if backend == 'polars' and self.polars_keywords and self.polars_streaming:
+            raise ValueError('The keyword index is not available in streaming mode, the store is not loaded in memory')
+
+        if backend == 'polars' and self.polars_wal and not self.persist:
+            raise ValueError('The polars write-ahead log requires a folder')
+
+        if backend == 'polars' and self.polars_wal and self.polars_streaming:
+            raise ValueError('The polars write-ahead log can not be used in streaming mode, the store is read-only')
+
     def get_file(self):
         return self.file
     
@@ -6,4 +6,15 @@ def generate_uuid(dimension: int | None = None) -> str | list[str]:
     if dimension is not None:
         return [str(uuid.uuid4()) for _ in range(dimension)]
     
-    return str(uuid.uuid4())
\ No newline at end of file
+    return str(uuid.uuid4())
+
+
+# namespace of the uuids derived from the content of a document
+CONTENT_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'https://github.com/Verusdb/verusdb')
+
+
+def content_uuid(collection: str | None, text: str) -> str:
+    """
+    Deterministic uuid of a text in a collection, the SHA-1 hash of both (uuid5)
+    """
+    return str(uuid.uuid5(CONTENT_NAMESPACE, f'{collection}\x00{text}'))